@@ -0,0 +1,168 @@
+import asyncio
+import math
+from contextlib import asynccontextmanager
+
+from metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUED, ADMISSION_REJECTED
+
+
+class Overloaded(Exception):
+    """A call turned away by an AdmissionLimiter; maps to an HTTP status with a Retry-After hint"""
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    """Bounded concurrency with a bounded wait queue for calls to a rate-limited upstream.
+
+    At most `max_concurrency` calls hold a slot at once. Up to `max_queue`
+    more wait for one; beyond that slot() fails straight away with a 429, and
+    a caller that waits longer than `queue_timeout` seconds gets a 503. Bursts
+    are smoothed into a steady rate the upstream accepts instead of all
+    requests failing on its rate limit.
+    """
+
+    def __init__(self, name, max_concurrency, max_queue, queue_timeout=10.0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def _reject(self, reason, status_code, message):
+        ADMISSION_REJECTED.labels(self.name, reason).inc()
+        return Overloaded(message, status_code, max(1, math.ceil(self.queue_timeout)))
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked() and self.queued >= self.max_queue:
+            raise self._reject("queue_full", 429, f"Too many requests waiting for the {self.name}, retry shortly")
+        self.queued += 1
+        ADMISSION_QUEUED.labels(self.name).inc()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise self._reject("timeout", 503, f"Timed out waiting for the {self.name}, retry shortly") from None
+        finally:
+            self.queued -= 1
+            ADMISSION_QUEUED.labels(self.name).dec()
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.labels(self.name).inc()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            ADMISSION_IN_FLIGHT.labels(self.name).dec()
+            self._semaphore.release()
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+        }
+
+
+class _Fanout:
+    """Events of one async generator, produced by a task and replayed from the first to every subscriber"""
+
+    def __init__(self, events):
+        self.events = []
+        self.error = None
+        self.finished = False
+        self.subscribers = 0
+        self._wake = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(events))
+
+    async def _pump(self, events):
+        try:
+            async for event in events:
+                self.events.append(event)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+            self._notify()
+
+    def _notify(self):
+        self._wake.set()
+        self._wake = asyncio.Event()
+
+    async def subscribe(self):
+        self.subscribers += 1
+        position = 0
+        try:
+            while True:
+                # Taken before looking, so an event published meanwhile still wakes us
+                wake = self._wake
+                if position < len(self.events):
+                    position += 1
+                    yield self.events[position - 1]
+                elif self.finished:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                else:
+                    await wake.wait()
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.finished:
+                # Every caller went away, so nobody needs the rest (and it may hold a completion slot)
+                self.task.cancel()
+
+
+class SingleFlight:
+    """Runs one call per key at a time; callers arriving while it runs share its result.
+
+    The call runs as its own task, so a caller that goes away doesn't cancel
+    it for the others. Exceptions are shared the same way as results.
+    stream() does the same for a call producing a stream of events.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+
+    def __len__(self):
+        return len(self._calls) + len(self._streams)
+
+    def stream(self, key, func):
+        """(async iterator over the events of func(), an async generator, whether it was already in flight).
+
+        Every caller gets every event from the first, however late it joined.
+        The generator is cancelled once all of its callers have gone away.
+        """
+        fanout = self._streams.get(key)
+        shared = fanout is not None
+        if fanout is None:
+            fanout = _Fanout(func())
+            self._streams[key] = fanout
+            fanout.task.add_done_callback(lambda _: self._finish_stream(key, fanout))
+        return fanout.subscribe(), shared
+
+    def _finish_stream(self, key, fanout):
+        if self._streams.get(key) is fanout:
+            del self._streams[key]
+
+    async def run(self, key, func):
+        """(result of func(), whether it was shared with a call already in flight)"""
+        task = self._calls.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task), shared
+
+    def _finish(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception retrieved in case every caller went away
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,176 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+from embedding_cache import normalize_text
+
+# Scope used when a question is asked against every indexed document
+GLOBAL_SCOPE = "*"
+
+
+def scope_key(document_ids=None):
+    """Cache scope for a set of documents; no ids means the whole index"""
+    if not document_ids:
+        return GLOBAL_SCOPE
+    return ",".join(sorted(set(document_ids)))
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+@dataclass
+class CachedAnswer:
+    scope: str
+    question: str
+    answer: str
+    sources: List[dict]
+    document_ids: List[str]
+    vector: np.ndarray
+    created_at: float = field(default_factory=time.time)
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+
+class AnswerCache:
+    """Semantic cache of answers keyed by question embedding and document scope.
+
+    A lookup returns the closest cached question in the same scope that is
+    younger than `ttl_seconds`, if its cosine similarity clears `threshold`. The
+    cache holds at most `max_entries` answers and evicts least recently used.
+    lookup_question() finds an answer to the same wording without needing the
+    question's embedding.
+    """
+
+    def __init__(self, threshold=0.95, ttl_seconds=86400, max_entries=2000):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # scope -> (entry ids, normalized vector matrix, creation times); rebuilt lazily after changes
+        self._matrices = {}
+        # (scope, normalized question) -> id of the newest entry for it
+        self._questions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _scope_matrix(self, scope):
+        if scope not in self._matrices:
+            ids = [entry_id for entry_id, entry in self._entries.items() if entry.scope == scope]
+            matrix = np.stack([self._entries[entry_id].vector for entry_id in ids]) if ids else None
+            created = np.array([self._entries[entry_id].created_at for entry_id in ids])
+            self._matrices[scope] = (ids, matrix, created)
+        return self._matrices[scope]
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        self._matrices.pop(entry.scope, None)
+        key = (entry.scope, normalize_text(entry.question))
+        if self._questions.get(key) == entry_id:
+            del self._questions[key]
+
+    def lookup_question(self, scope, question) -> Optional[CachedAnswer]:
+        """Fresh answer to the same question (ignoring case and whitespace) in `scope`, if cached"""
+        # The same wording has a similarity of 1, so a threshold above that disables this too
+        if self.threshold > 1.0:
+            return None
+        with self._lock:
+            entry_id = self._questions.get((scope, normalize_text(question)))
+            if entry_id is None:
+                return None
+            entry = self._entries[entry_id]
+            if time.time() - entry.created_at > self.ttl_seconds:
+                self._remove(entry_id)
+                return None
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return entry
+
+    def lookup(self, scope, vector) -> Optional[CachedAnswer]:
+        query = _normalize(vector)
+        with self._lock:
+            ids, matrix, created = self._scope_matrix(scope)
+            expired = np.flatnonzero(created < time.time() - self.ttl_seconds)
+            if len(expired):
+                # Dropped before matching, so an expired closest question doesn't hide a fresh one that also matches
+                for i in expired:
+                    self._remove(ids[i])
+                ids, matrix, _ = self._scope_matrix(scope)
+            if matrix is not None:
+                similarities = matrix @ query
+                best = int(np.argmax(similarities))
+                entry = self._entries[ids[best]]
+                if similarities[best] >= self.threshold:
+                    self._entries.move_to_end(entry.id)
+                    self.hits += 1
+                    return entry
+            self.misses += 1
+            return None
+
+    def store(self, scope, vector, question, answer, sources, document_ids, created_at=None):
+        entry = CachedAnswer(
+            scope=scope,
+            question=question,
+            answer=answer,
+            sources=sources,
+            document_ids=list(document_ids),
+            vector=_normalize(vector),
+        )
+        if created_at is not None:
+            entry.created_at = created_at
+        with self._lock:
+            self._entries[entry.id] = entry
+            self._matrices.pop(scope, None)
+            self._questions[(scope, normalize_text(question))] = entry.id
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+        return entry
+
+    def invalidate_document(self, document_id):
+        """Drop answers that may have been drawn from `document_id`.
+
+        Whole-index answers are dropped too, since the index they were answered
+        from just changed.
+        """
+        with self._lock:
+            stale = [
+                entry_id for entry_id, entry in self._entries.items()
+                if entry.scope == GLOBAL_SCOPE
+                or document_id in entry.document_ids
+                or document_id in entry.scope.split(",")
+            ]
+            for entry_id in stale:
+                self._remove(entry_id)
+            self.invalidations += len(stale)
+        return len(stale)
+
+    def clear(self):
+        """Drop every answer, e.g. once the index they were answered from is replaced"""
+        with self._lock:
+            dropped = len(self._entries)
+            self._entries.clear()
+            self._matrices.clear()
+            self._questions.clear()
+            self.invalidations += dropped
+        return dropped
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidated": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -1,27 +1,50 @@
+import asyncio
+import hashlib
+import json
 import os
+import tempfile
 import time
 import uuid
-from datetime import datetime
-from typing import List, Optional
-import fitz
-import pytesseract
-from PIL import Image
-import io
+from collections import Counter, defaultdict
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
 
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import openai
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_pinecone import Pinecone as LangchainPinecone
-from pinecone import Pinecone
-from sqlalchemy import create_engine, Column, String, Integer, DateTime, Text, Float
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from pydantic import BaseModel, field_validator
+import httpx
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy import func, or_, text, update
 from dotenv import load_dotenv
 
+from admission import AdmissionLimiter, Overloaded, SingleFlight
+from answer_cache import GLOBAL_SCOPE, AnswerCache, scope_key
+from audit import AuditWriter
+from benefits import format_answer, match_question
+from chunking import StreamingChunker
+from context import ContextBuilder
+from database import (
+    engine, SessionLocal, Document, Query, PageText, DocumentChunk, Benefit, PrewarmedAnswer, init_db, pack_vector,
+    unpack_vector,
+)
+from dependencies import Dependency
+from embedding_cache import CachedEmbeddings, normalize_text
+from executors import run_blocking, run_db, shutdown_executors
+from extraction import (
+    EXTRACT_WORKERS, iter_extracted_pages, page_fingerprints, pool_started, shutdown_pool, start_pool
+)
+from indexes import IndexSettings, active_settings, open_vector_store
+from jobs import IngestJobQueue, QueueFullError
+from lexical import LexicalIndex, reciprocal_rank_fusion, tokenize
+from metrics import (
+    ANSWERS_PREWARMED, ASK_COALESCED, ASK_CONTEXT_TOKENS, ASK_ERRORS, INGEST_ERRORS, StageTimer, observe_ask,
+    observe_ingest, observe_page
+)
+from ocr import OCR_ENGINE, engine as ocr_engine
+
 # Load environment variables
 load_dotenv()
 
@@ -46,264 +69,1897 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database setup
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")
-if DATABASE_URL.startswith("postgresql"):
-    engine = create_engine(DATABASE_URL)
-else:
-    # Use SQLite for local testing
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-# Database models
-class Document(Base):
-    __tablename__ = "documents"
-    
-    id = Column(String, primary_key=True)
-    filename = Column(String, nullable=False)
-    page_count = Column(Integer, nullable=False)
-    uploaded_at = Column(DateTime, nullable=False)
-
-class Query(Base):
-    __tablename__ = "queries"
-    
-    id = Column(String, primary_key=True)
-    question = Column(Text, nullable=False)
-    answer = Column(Text, nullable=False)
-    latency_ms = Column(Float, nullable=False)
-    created_at = Column(DateTime, nullable=False)
-
-# Create tables
-Base.metadata.create_all(bind=engine)
+# OpenAI setup
+CHAT_MODEL = "gpt-4o-mini"
+# Created on first use by get_openai_client()
+openai_client = None
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+# Embedding model, chunking and vector index being served; replaced when reindex.py activates an index build
+active_index = IndexSettings.default()
+# How often the index build reindex.py last activated is checked for
+INDEX_CHECK_SECONDS = float(os.getenv("INDEX_CHECK_SECONDS", "30"))
+# Every chunk and question embedding goes through the cache (memory LRU, then the embedding_cache table)
+def create_openai_embeddings():
+    # langchain_openai is slow to import, so it is loaded with the first embedding request
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(model=active_index.embedding_model)
 
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy", "message": "Backend is running"}
+embeddings = CachedEmbeddings(
+    create_openai_embeddings,
+    model=active_index.embedding_model,
+    session_factory=SessionLocal if os.getenv("EMBEDDING_CACHE_PERSIST", "true").lower() == "true" else None,
+    max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+)
+# Admission control in front of the question embedding and completion calls: at most *_MAX_CONCURRENCY
+# in flight, *_MAX_QUEUE more waiting up to ADMISSION_QUEUE_TIMEOUT seconds, the rest rejected with 429/503
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+llm_limiter = AdmissionLimiter(
+    "completion model",
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+    max_queue=int(os.getenv("LLM_MAX_QUEUE", "64")),
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT
+)
+embed_limiter = AdmissionLimiter(
+    "embedding model",
+    max_concurrency=int(os.getenv("EMBED_MAX_CONCURRENCY", "16")),
+    max_queue=int(os.getenv("EMBED_MAX_QUEUE", "64")),
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT
+)
+# Seconds clients are told to wait when OpenAI itself rate limits us
+UPSTREAM_RETRY_AFTER = int(os.getenv("UPSTREAM_RETRY_AFTER", "5"))
+# Identical /ask questions against the same documents share one answer while it is being produced
+ask_flights = SingleFlight()
+# Chunks sent per embedding request at ingest
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+# Batches waiting between ingest stages; bounds memory on very long documents
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+# Page texts loaded from / saved to the page text cache per round trip
+PAGE_WINDOW = 64
+UPLOAD_BLOCK_SIZE = 1024 * 1024
 
-# OpenAI setup
-openai.api_key = os.getenv("OPENAI_API_KEY")
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+# BM25 index over the same chunks, fused with vector results ("hybrid") or unused ("vector")
+lexical_index = LexicalIndex(SessionLocal)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Short keyword questions fully matched by the lexical index skip the question embedding
+LEXICAL_FAST_PATH = os.getenv("LEXICAL_FAST_PATH", "true").lower() == "true"
+LEXICAL_FAST_MAX_TERMS = int(os.getenv("LEXICAL_FAST_MAX_TERMS", "4"))
 
-# Pinecone setup
-print("DEBUG: About to initialize Pinecone...")
-print(f"DEBUG: PINECONE_API_KEY (first 10 chars): {os.getenv('PINECONE_API_KEY', 'NOT_SET')[:10]}...")
-print(f"DEBUG: PINECONE_ENVIRONMENT: {os.getenv('PINECONE_ENVIRONMENT', 'NOT_SET')}")
+# Retrieved chunks are merged, deduplicated and packed into this many prompt tokens
+context_builder = ContextBuilder(CHAT_MODEL, token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000")))
 
-# Initialize Pinecone with new API
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-
-# Ensure Pinecone index exists
-index_name = os.getenv("PINECONE_INDEX_NAME", "docsage-lite")
-try:
-    if index_name not in pc.list_indexes().names():
-        print(f"Index '{index_name}' does not exist. Creating it...")
-        # Note: Creating indexes requires specific configuration based on your plan
-        # For now, we'll just use the existing index
-        print(f"Please create the index '{index_name}' manually in your Pinecone dashboard")
-    else:
-        print(f"Using existing Pinecone index: {index_name}")
-except Exception as e:
-    print(f"Warning: Could not check Pinecone index: {e}")
-
-# Initialize Pinecone vectorstore
-try:
-    # Use LangChain Pinecone with environment variables
-    vectorstore = LangchainPinecone.from_existing_index(
-        index_name=index_name,
-        embedding=embeddings
-    )
-    print(f"✅ Successfully initialized Pinecone vectorstore with index: {index_name}")
-except Exception as e:
-    print(f"Warning: Could not initialize Pinecone vectorstore: {e}")
-    vectorstore = None
+# Copay/deductible/out-of-pocket questions the benefits table can answer skip retrieval and the LLM
+BENEFITS_ANSWERS = os.getenv("BENEFITS_ANSWERS", "true").lower() == "true"
+
+# Semantic answer cache for /ask
+answer_cache = AnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    ttl_seconds=int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400")),
+    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "2000"))
+)
+
+# After each ingest, common questions are answered ahead of time against the new document: the seed
+# list (by default the frontend's example questions, "|"-separated) plus the PREWARM_TOP_QUERIES
+# questions asked most often in the last PREWARM_LOOKBACK_DAYS days
+PREWARM_ANSWERS = os.getenv("PREWARM_ANSWERS", "true").lower() == "true"
+PREWARM_SEED_QUESTIONS = [
+    question.strip()
+    for question in os.getenv("PREWARM_SEED_QUESTIONS", "|".join([
+        "Is MRI covered under this policy?",
+        "What's the copay for emergency room visits?",
+        "What's the annual deductible?",
+        "Are prescription drugs covered?",
+        "What's the out-of-pocket maximum?",
+        "Is physical therapy covered?",
+        "What's the copay for specialist visits?",
+        "Are mental health services covered?",
+    ])).split("|")
+    if question.strip()
+]
+PREWARM_TOP_QUERIES = int(os.getenv("PREWARM_TOP_QUERIES", "10"))
+PREWARM_LOOKBACK_DAYS = int(os.getenv("PREWARM_LOOKBACK_DAYS", "30"))
+# Completions a pre-warm runs at once; they also count against LLM_MAX_CONCURRENCY
+PREWARM_CONCURRENCY = int(os.getenv("PREWARM_CONCURRENCY", "2"))
+# Chunks retrieved per pre-warmed question, as the frontend asks with
+PREWARM_K = 4
+
+# Vector store setup: VECTOR_BACKEND "pinecone" (default) or "local" for the in-process NumPy index,
+# unless an index build with its own vector index is active
+def create_vectorstore():
+    return open_vector_store(active_index.vector_backend, active_index.vector_target)
+
+def connect_database():
+    # Create tables
+    init_db()
+    return engine
+
+# Connected by startup tasks that retry with backoff; see start_dependencies()
+database = Dependency("database", connect_database)
+vector_store = Dependency("vector store", create_vectorstore)
+# How long /health/ready waits on its database ping
+READY_DB_TIMEOUT = float(os.getenv("READY_DB_TIMEOUT", "2"))
+
+# Chunks retrieved per question when a request doesn't say
+DEFAULT_K = 4
+
+def default_k(k):
+    """An explicit "k": null means the default, like leaving k out"""
+    return DEFAULT_K if k is None else k
 
 # Pydantic models
 class AskRequest(BaseModel):
     question: str
-    k: Optional[int] = 4
+    k: Optional[int] = DEFAULT_K
+    # Documents to answer from; without either, every indexed document is searched
+    document_id: Optional[str] = None
+    document_ids: Optional[List[str]] = None
+
+    _default_k = field_validator("k")(default_k)
 
 class AskResponse(BaseModel):
     answer: str
     latency_ms: float
     sources: List[dict]
+    cached: bool = False
+    retrieval: Optional[str] = None
+    stages: Dict[str, float] = {}
+    # Answered by an identical question that was already in flight
+    coalesced: bool = False
+
+class AskBatchRequest(BaseModel):
+    questions: List[str]
+    k: Optional[int] = DEFAULT_K
+    document_id: Optional[str] = None
+    document_ids: Optional[List[str]] = None
+
+    _default_k = field_validator("k")(default_k)
+
+class AskBatchItem(BaseModel):
+    question: str
+    answer: Optional[str] = None
+    sources: List[dict] = []
+    cached: bool = False
+    retrieval: Optional[str] = None
+    retrieve_ms: Optional[float] = None
+    llm_ms: Optional[float] = None
+    latency_ms: float
+    error: Optional[str] = None
+
+class AskBatchResponse(BaseModel):
+    results: List[AskBatchItem]
+    latency_ms: float
+    embed_ms: float
+    unique_chunks: int
+
+class PageTiming(BaseModel):
+    page: int
+    elapsed_ms: float
+    ocr: bool
 
 class IngestResponse(BaseModel):
     document_id: str
     pages: int
     chunks: int
+    extract_ms: Optional[float] = None
+    extract_workers: Optional[int] = None
+    page_timings: List[PageTiming] = []
+    stages: Dict[str, float] = {}
+    cached: bool = False
+    version: int = 1
+    # For a revision of an existing document: pages extracted again, chunks embedded and upserted, chunks deleted
+    pages_changed: Optional[int] = None
+    chunks_changed: Optional[int] = None
+    chunks_removed: Optional[int] = None
 
-def extract_text_from_page(page, page_num):
-    """Extract text from a PDF page, with Tesseract fallback if needed"""
-    # Try PyMuPDF text extraction first
-    text = page.get_text("text").strip()
-    
-    if not text:
-        # Fallback to Tesseract OCR
-        try:
-            # Render page to image
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))  # 2x zoom for better OCR
-            img_data = pix.tobytes("png")
-            img = Image.open(io.BytesIO(img_data))
-            
-            # Use Tesseract
-            tesseract_cmd = os.getenv("TESSERACT_CMD", "/usr/bin/tesseract")
-            pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
-            text = pytesseract.image_to_string(img).strip()
-            
-            if text:
-                print(f"Used Tesseract fallback for page {page_num + 1}")
-        except Exception as e:
-            print(f"Tesseract fallback failed for page {page_num + 1}: {e}")
-            text = f"[Page {page_num + 1} - OCR failed]"
-    
-    return text
+class IngestJobResponse(BaseModel):
+    job_id: str
+    status: str
+    filename: str
+    pages_total: Optional[int] = None
+    pages_done: int = 0
+    chunks_total: Optional[int] = None
+    chunks_embedded: int = 0
+    result: Optional[IngestResponse] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
 
 @app.get("/health")
+@app.get("/health/live")
 async def health_check():
+    """Liveness: the process is up and serving; never touches a dependency"""
     return {"status": "ok"}
 
-@app.post("/ingest", response_model=IngestResponse)
-async def ingest_document(file: UploadFile = File(...)):
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Only PDF files are supported")
-    
+def ping_database():
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness: 200 once every dependency needed to ingest and answer is up, else 503"""
+    checks = {
+        "database": database.state(),
+        "vector_store": vector_store.state(),
+        "lexical_index": {"ready": lexical_index.loaded, "chunks": len(lexical_index)},
+        "ingest_jobs": {"ready": ingest_jobs.running},
+        "extraction_pool": {"ready": pool_started(), "workers": EXTRACT_WORKERS},
+        "openai": {"ready": bool(os.getenv("OPENAI_API_KEY")), "error": None if os.getenv("OPENAI_API_KEY") else "OPENAI_API_KEY is not set"},
+    }
+    if database.ready:
+        # The connection can drop after startup, so check it is still reachable
+        try:
+            await asyncio.wait_for(run_db(ping_database), timeout=READY_DB_TIMEOUT)
+        except Exception as e:
+            checks["database"].update(ready=False, error=str(e) or "Timed out")
+    ready = all(check["ready"] for check in checks.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not ready", "checks": checks}
+    )
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: request counts plus per-stage latency histograms for /ask and /ingest"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "embeddings": embeddings.stats(),
+        "answers": answer_cache.stats(),
+        "admission": {"llm": llm_limiter.stats(), "embed": embed_limiter.stats(), "ask_in_flight": len(ask_flights)}
+    }
+
+@app.on_event("startup")
+def start_extraction_pool():
+    if OCR_ENGINE != "pytesseract" and ocr_engine() == "pytesseract":
+        # Scanned pages still get OCR'd, just with a tesseract process started per page
+        print(f"Warning: tesserocr is not installed, OCR_ENGINE={OCR_ENGINE} falls back to pytesseract")
+    start_pool()
+
+def use_index(settings):
+    """Embed and chunk the way the index described by `settings` was built"""
+    global active_index, embeddings
+    active_index = settings
+    if settings.embedding_model != embeddings.model:
+        embeddings = embeddings.for_model(settings.embedding_model, create_openai_embeddings)
+
+@dataclass(frozen=True)
+class ServedIndex:
+    """The index build a request works against: its settings, the model its vectors come from and its store"""
+    settings: IndexSettings
+    embeddings: CachedEmbeddings
+    store: Optional[object]
+
+def served_index():
+    """Taken once per request, on the event loop, so the request embeds and searches within one index build
+    even if refresh_index() switches builds while it awaits"""
+    return ServedIndex(active_index, embeddings, vector_store.value)
+
+def still_served(index):
+    """Whether `index` is still the build being served"""
+    return index.settings.build_id == active_index.build_id and index.embeddings is embeddings
+
+def lookup_answer(index, scope, question_vector):
+    # Once another build is served the cache holds vectors of its model, which can't be compared with this one
+    return answer_cache.lookup(scope, question_vector) if still_served(index) else None
+
+def store_answer(index, scope, question_vector, question, answer, sources, document_ids):
+    if still_served(index):
+        answer_cache.store(scope, question_vector, question, answer, sources, document_ids)
+
+# Index switches run one at a time
+index_switch_lock = asyncio.Lock()
+
+async def refresh_index():
+    """Move to the index build reindex.py last activated, unless it is already being served"""
+    settings = await run_db(active_settings, SessionLocal)
+    if settings.build_id == active_index.build_id:
+        return
+    async with index_switch_lock:
+        if settings.build_id == active_index.build_id:
+            return
+        store = await run_blocking(open_vector_store, settings.vector_backend, settings.vector_target)
+        # Switched with no await in between, so every served_index() taken from here on sees the new model
+        # and store together; requests that took theirs before finish against the old ones
+        vector_store.set(store)
+        use_index(settings)
+        chunks = await run_db(lexical_index.load)
+        # Cached answers came from the old index, and their question vectors from the old model
+        answer_cache.clear()
+        print(f"Switched to index build {settings.build_id} ({settings.embedding_model}, {chunks} chunks)")
+
+async def watch_index_builds():
+    while True:
+        await asyncio.sleep(INDEX_CHECK_SECONDS)
+        if not vector_store.ready:
+            continue
+        try:
+            await refresh_index()
+        except Exception as e:
+            print(f"Warning: Could not switch to the active index build: {e}")
+
+async def bootstrap():
+    """Everything that needs the database, run once it is reachable"""
+    await database.connect()
+    # Which vector index and embedding model to use depends on the active index build
     try:
-        # Read PDF content
-        content = await file.read()
-        doc = fitz.open(stream=content, filetype="pdf")
-        
-        document_id = str(uuid.uuid4())
-        page_count = len(doc)
-        
-        # Extract text from each page
-        all_texts = []
-        for page_num in range(page_count):
-            page = doc.load_page(page_num)
-            text = extract_text_from_page(page, page_num)
-            if text:
-                all_texts.append(f"Page {page_num + 1}:\n{text}")
-        
-        # Combine all text
-        full_text = "\n\n".join(all_texts)
-        
-        if not full_text.strip():
-            raise HTTPException(status_code=400, detail="No text could be extracted from PDF")
-        
-        # Split text into chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
+        use_index(await run_db(active_settings, SessionLocal))
+    except Exception as e:
+        print(f"Warning: Could not load the active index build: {e}")
+    startup_tasks.append(asyncio.create_task(vector_store.connect()))
+    await ingest_jobs.start()
+    try:
+        print(f"Loaded lexical index ({await run_db(lexical_index.load)} chunks)")
+    except Exception as e:
+        print(f"Warning: Could not load lexical index: {e}")
+    try:
+        await run_blocking(warm_answer_cache, served_index(), int(os.getenv("ANSWER_CACHE_WARM", "200")))
+        await run_blocking(load_prewarmed_answers, served_index())
+    except Exception as e:
+        print(f"Warning: Could not warm answer cache: {e}")
+
+startup_tasks = []
+# Runs until shutdown, so it is kept apart from the startup tasks
+index_watcher = None
+
+@app.on_event("startup")
+async def start_dependencies():
+    global index_watcher
+    # Not awaited, so the server accepts connections (and liveness probes) while dependencies come up
+    startup_tasks.append(asyncio.create_task(bootstrap()))
+    # tiktoken may download its encoding on first load; do that now rather than in the first question
+    startup_tasks.append(asyncio.create_task(run_blocking(lambda: context_builder.encoding)))
+    index_watcher = asyncio.create_task(watch_index_builds())
+
+@app.on_event("shutdown")
+async def stop_dependencies():
+    tasks = startup_tasks + ([index_watcher] if index_watcher else [])
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+@app.on_event("shutdown")
+def shutdown_extraction_pool():
+    shutdown_pool()
+
+def find_ingested_document(content_hash):
+    """Return an already indexed document with the same PDF bytes, if any"""
+    db = SessionLocal()
+    try:
+        return (
+            db.query(Document)
+            .filter(Document.content_hash == content_hash, Document.indexed.is_(True))
+            .first()
         )
-        chunks = text_splitter.split_text(full_text)
-        
-        # Create embeddings and store in Pinecone
-        if vectorstore:
-            metadatas = [
-                {
-                    "source": file.filename,
-                    "page": i // 2 + 1,  # Approximate page number
-                    "document_id": document_id
-                }
-                for i in range(len(chunks))
-            ]
-            
-            # Add chunks to vectorstore
-            vectorstore.add_texts(chunks, metadatas=metadatas)
-        
-        # Store document info in database
-        db = SessionLocal()
-        try:
-            doc_record = Document(
-                id=document_id,
-                filename=file.filename,
-                page_count=page_count,
-                uploaded_at=datetime.utcnow()
+    finally:
+        db.close()
+
+def cached_page_numbers(content_hash):
+    """Pages of this PDF whose text was stored by an earlier attempt"""
+    db = SessionLocal()
+    try:
+        rows = db.query(PageText.page_num).filter(PageText.content_hash == content_hash).all()
+        return {row.page_num for row in rows}
+    finally:
+        db.close()
+
+def load_page_texts(content_hash, page_nums):
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(PageText)
+            .filter(PageText.content_hash == content_hash, PageText.page_num.in_(page_nums))
+            .all()
+        )
+        return {row.page_num: row.text for row in rows}
+    finally:
+        db.close()
+
+def save_page_texts(content_hash, document_id, page_results, fingerprints=None):
+    """Store extracted page texts, and the benefit values found on those pages"""
+    db = SessionLocal()
+    try:
+        for result in page_results:
+            db.merge(PageText(
+                content_hash=content_hash,
+                page_num=result.page_num,
+                text=result.text,
+                ocr=result.ocr,
+                page_hash=fingerprints[result.page_num] if fingerprints else None
+            ))
+        db.query(Benefit).filter(
+            Benefit.document_id == document_id,
+            Benefit.page.in_([result.page_num + 1 for result in page_results])
+        ).delete(synchronize_session=False)
+        db.add_all([
+            Benefit(
+                document_id=document_id,
+                category=row.category,
+                benefit_type=row.benefit_type,
+                value=row.value,
+                network=row.network,
+                page=result.page_num + 1,
+                snippet=row.snippet
             )
-            db.add(doc_record)
+            for result in page_results
+            for row in result.benefits
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+def chunk_id(document_id, index, version=1):
+    # Chunks written by a revision get their own id series, so they never collide
+    # with the chunks of earlier versions that the revision keeps
+    if version > 1:
+        return f"{document_id}-v{version}-{index}"
+    return f"{document_id}-{index}"
+
+def embed_chunk_batch(embeddings, document_id, chunks, version=1):
+    """Embed one batch of chunks, reusing embeddings stored by an earlier attempt at the same document"""
+    ids = [chunk_id(document_id, chunk.index, version) for chunk in chunks]
+    db = SessionLocal()
+    try:
+        stored = {row.id: row for row in db.query(DocumentChunk).filter(DocumentChunk.id.in_(ids)).all()}
+        vectors = {
+            id_: unpack_vector(stored[id_].embedding)
+            for id_, chunk in zip(ids, chunks)
+            if id_ in stored and stored[id_].embedding and stored[id_].text == chunk.text
+        }
+        missing = [(id_, chunk) for id_, chunk in zip(ids, chunks) if id_ not in vectors]
+        if missing:
+            # Committed per batch, so an interrupted ingest resumes after the last one
+            new_vectors = embeddings.embed_documents([chunk.text for _, chunk in missing])
+            for (id_, chunk), vector in zip(missing, new_vectors):
+                vectors[id_] = vector
+                db.merge(DocumentChunk(
+                    id=id_,
+                    document_id=document_id,
+                    chunk_index=chunk.index,
+                    page=chunk.page_start,
+                    page_end=chunk.page_end,
+                    text=chunk.text,
+                    embedding=pack_vector(vector),
+                    version=version
+                ))
             db.commit()
-        finally:
-            db.close()
+        return [vectors[id_] for id_ in ids]
+    finally:
+        db.close()
+
+def save_document(doc_record):
+    db = SessionLocal()
+    try:
+        db.merge(doc_record)
+        db.commit()
+    finally:
+        db.close()
+
+def get_document(document_id):
+    db = SessionLocal()
+    try:
+        return db.get(Document, document_id)
+    finally:
+        db.close()
+
+def chunk_signature(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def pages_of(pages):
+    """Column values for a (page, page_end) pair; none for None"""
+    return {} if pages is None else {"page": pages[0], "page_end": pages[1]}
+
+@dataclass
+class Revision:
+    """A revised PDF being ingested over an existing document, and what it keeps from the current version"""
+    document: Document
+    version: int
+    # Page number in the revised PDF -> page number in the current version, for pages that did not change
+    unchanged_pages: Dict[int, int]
+    # chunk_signature() -> (id, page, page_end) of current chunks with that text, in document order
+    chunks: Dict[str, List[tuple]]
+    # Current chunks kept, with their vectors: id -> index in the revised document
+    kept: Dict[str, int] = field(default_factory=dict)
+    # Kept chunks whose pages moved, e.g. behind an inserted page: id -> (page, page_end) in the revised document
+    moved: Dict[str, tuple] = field(default_factory=dict)
+
+    @property
+    def benefits_id(self):
+        # Benefits of re-extracted pages are staged under this id until the revision is committed
+        return f"{self.document.id}@v{self.version}"
+
+    def keep(self, chunk):
+        """Id of a current chunk with the same text as `chunk`, which then needs no embedding or upsert; else None.
+
+        Matched on text alone, so a chunk behind an added or removed page is
+        kept too; only its page numbers are updated.
+        """
+        matches = self.chunks.get(chunk_signature(chunk.text))
+        if not matches:
+            return None
+        id_, page, page_end = matches.pop(0)
+        self.kept[id_] = chunk.index
+        if (page, page_end) != (chunk.page_start, chunk.page_end):
+            self.moved[id_] = (chunk.page_start, chunk.page_end)
+        return id_
+
+def plan_revision(document, content_hash, fingerprints):
+    """Match a revised PDF's pages and chunks against the document's current version.
+
+    Text of unchanged pages is copied to the page text cache under the new
+    content hash, so only changed pages are extracted (or OCR'd) again.
+    """
+    current_version = document.version or 1
+    db = SessionLocal()
+    try:
+        previous = {}
+        for row in db.query(PageText).filter(
+            PageText.content_hash == document.content_hash, PageText.page_hash.isnot(None)
+        ):
+            previous.setdefault(row.page_hash, row)
+        cached = {row.page_num for row in db.query(PageText.page_num).filter(PageText.content_hash == content_hash)}
+        unchanged_pages = {}
+        changed_cached = []
+        for page_num, fingerprint in enumerate(fingerprints):
+            row = previous.get(fingerprint)
+            if row is None:
+                # Text cached by an earlier ingest of this PDF comes without this document's
+                # benefit rows, so changed pages are always extracted again
+                if page_num in cached:
+                    changed_cached.append(page_num)
+                continue
+            unchanged_pages[page_num] = row.page_num
+            if page_num not in cached:
+                db.add(PageText(
+                    content_hash=content_hash,
+                    page_num=page_num,
+                    text=row.text,
+                    ocr=row.ocr,
+                    page_hash=fingerprint
+                ))
+        if changed_cached:
+            db.query(PageText).filter(
+                PageText.content_hash == content_hash, PageText.page_num.in_(changed_cached)
+            ).delete(synchronize_session=False)
+        db.commit()
+
+        # Chunks still in the shared default namespace (or never indexed) are all written again
+        chunks = defaultdict(list)
+        if document.vector_namespace and document.indexed:
+            # Rows from an interrupted attempt at this revision have a newer version and are not kept
+            rows = (
+                db.query(DocumentChunk.id, DocumentChunk.text, DocumentChunk.page, DocumentChunk.page_end)
+                .filter(
+                    DocumentChunk.document_id == document.id,
+                    or_(DocumentChunk.version.is_(None), DocumentChunk.version <= current_version)
+                )
+                .order_by(DocumentChunk.chunk_index)
+            )
+            for row in rows:
+                chunks[chunk_signature(row.text)].append((row.id, row.page, row.page_end))
+        return Revision(document, current_version + 1, unchanged_pages, dict(chunks))
+    finally:
+        db.close()
+
+def stale_chunk_ids(document_id, live_ids):
+    db = SessionLocal()
+    try:
+        rows = db.query(DocumentChunk.id).filter(DocumentChunk.document_id == document_id)
+        return [row.id for row in rows if row.id not in live_ids]
+    finally:
+        db.close()
+
+async def remove_chunks(document, chunk_ids):
+    """Delete chunks of a document from the vector index and the lexical index"""
+    if document.vector_namespace:
+        if chunk_ids:
+            await run_blocking(vector_store.value.delete, chunk_ids, namespace=document.vector_namespace)
+    else:
+        # Ingested into the shared default namespace, before documents had their own
+        await run_blocking(vector_store.value.delete, filter={"document_id": document.id}, namespace="")
+    if chunk_ids:
+        await run_db(lexical_index.remove_chunks, chunk_ids)
+
+def delete_chunk_rows(chunk_ids):
+    db = SessionLocal()
+    try:
+        for start in range(0, len(chunk_ids), 500):
+            db.query(DocumentChunk).filter(
+                DocumentChunk.id.in_(chunk_ids[start:start + 500])
+            ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+async def discard_chunks(document_id, chunk_ids):
+    """Remove chunks an ingest wrote from the vector index, document_chunks and the lexical index"""
+    await run_blocking(vector_store.value.delete, chunk_ids, namespace=document_id)
+    await run_db(delete_chunk_rows, chunk_ids)
+    await run_db(lexical_index.remove_chunks, chunk_ids)
+
+def commit_revision(revision, doc_record, stale_ids):
+    """Switch the document to its revised version in one transaction: chunk rows, benefits and the document row"""
+    document_id = revision.document.id
+    db = SessionLocal()
+    try:
+        for start in range(0, len(stale_ids), 500):
+            db.query(DocumentChunk).filter(
+                DocumentChunk.id.in_(stale_ids[start:start + 500])
+            ).delete(synchronize_session=False)
+        if revision.kept:
+            db.execute(
+                update(DocumentChunk),
+                [
+                    {"id": id_, "chunk_index": index, **pages_of(revision.moved.get(id_))}
+                    for id_, index in revision.kept.items()
+                ]
+            )
         
-        return IngestResponse(
-            document_id=document_id,
-            pages=page_count,
-            chunks=len(chunks)
+        # Unchanged pages keep their benefit rows (renumbered if pages moved); re-extracted pages get the staged ones
+        current = defaultdict(list)
+        for row in db.query(Benefit).filter(Benefit.document_id == document_id):
+            current[row.page].append(row)
+        carried = [
+            Benefit(
+                document_id=document_id,
+                category=row.category,
+                benefit_type=row.benefit_type,
+                value=row.value,
+                network=row.network,
+                page=page_num + 1,
+                snippet=row.snippet
+            )
+            for page_num, previous_page in revision.unchanged_pages.items()
+            for row in current.get(previous_page + 1, [])
+        ]
+        db.query(Benefit).filter(Benefit.document_id == document_id).delete(synchronize_session=False)
+        db.query(Benefit).filter(Benefit.document_id == revision.benefits_id).update(
+            {Benefit.document_id: document_id}, synchronize_session=False
         )
-        
+        db.add_all(carried)
+        db.merge(doc_record)
+        db.commit()
+    finally:
+        db.close()
+
+# Revisions of the same document run one at a time
+revision_locks = defaultdict(asyncio.Lock)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+async def iter_pages(pdf_path, content_hash, document_id, fingerprints, page_timings, progress, timer):
+    """Yield (page_num, text) in page order, from the page text cache or fresh extraction.
+
+    Cached texts are loaded and new ones saved a window of pages at a time, so
+    only one window of page text is held here however long the document is.
+    Benefit values found on extracted pages are stored under `document_id`.
+    """
+    page_count = len(fingerprints)
+    with timer.stage("db"):
+        cached = await run_db(cached_page_numbers, content_hash)
+    extracted = iter_extracted_pages(pdf_path, [page_num for page_num in range(page_count) if page_num not in cached])
+    pages_done = len(cached)
+    progress(pages_total=page_count, pages_done=pages_done)
+    try:
+        for window_start in range(0, page_count, PAGE_WINDOW):
+            window = range(window_start, min(window_start + PAGE_WINDOW, page_count))
+            with timer.stage("db"):
+                texts = await run_db(load_page_texts, content_hash, [page_num for page_num in window if page_num in cached])
+            new_results = []
+            for page_num in window:
+                if page_num in cached:
+                    yield page_num, texts.get(page_num, "")
+                    continue
+                result = await extracted.__anext__()
+                new_results.append(result)
+                page_timings.append(PageTiming(page=result.page_num + 1, elapsed_ms=result.elapsed_ms, ocr=result.ocr))
+                observe_page(result.elapsed_ms, result.ocr)
+                if result.ocr:
+                    timer.add("ocr", result.ocr_ms)
+                pages_done += 1
+                progress(pages_done=pages_done)
+                yield result.page_num, result.text
+            if new_results:
+                with timer.stage("db"):
+                    await run_db(save_page_texts, content_hash, document_id, new_results, fingerprints)
+    finally:
+        await extracted.aclose()
+
+async def run_pipeline_stages(*stages):
+    """Run connected pipeline stages together; if one fails the others are cancelled"""
+    tasks = [asyncio.create_task(stage) for stage in stages]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+async def run_ingest(pdf_path, filename, progress=None, content_hash=None, document_id=None):
+    """Ingest the PDF at `pdf_path`: extract, split, embed, index and record it.
+
+    Pages flow through extract -> chunk -> embed -> upsert stages connected by
+    bounded queues, so a slow stage holds back the ones before it and memory
+    stays flat however many pages the PDF has. `progress(**fields)` receives
+    page and chunk counts as the pipeline advances; the background job queue
+    stores them on the job row.
+    
+    With `document_id` the PDF is a revision of that document: pages whose
+    fingerprint is unchanged are not extracted again, chunks identical to
+    current ones are neither embedded nor upserted, chunks that no longer
+    exist are deleted, and the document's version is bumped. Re-uploading
+    the original PDF of a document that has been revised since is handled
+    the same way, as a revision of that document.
+    """
+    progress = progress or (lambda **fields: None)
+    timer = StageTimer()
+    try:
+        if document_id:
+            # Answers still being pre-warmed from the previous version would be stale
+            cancel_prewarm(document_id)
+            async with revision_locks[document_id]:
+                result = await ingest_pipeline(pdf_path, filename, progress, content_hash, timer, document_id)
+        else:
+            result = await ingest_pipeline(pdf_path, filename, progress, content_hash, timer)
+    except Exception:
+        INGEST_ERRORS.inc()
+        raise
+    if not result.cached:
+        schedule_prewarm(result.document_id)
+    return result
+
+async def ingest_pipeline(pdf_path, filename, progress, content_hash, timer, document_id=None):
+    if not content_hash:
+        with timer.stage("hash"):
+            content_hash = await run_blocking(file_sha256, pdf_path)
+    
+    current = None
+    if document_id:
+        current = await run_db(get_document, document_id)
+        if current is None:
+            raise HTTPException(status_code=404, detail=f"Unknown document: {document_id}")
+        if current.content_hash == content_hash and current.indexed:
+            observe_ingest(timer, 0, cached=True)
+            return IngestResponse(
+                document_id=current.id,
+                pages=current.page_count,
+                chunks=current.chunk_count or 0,
+                cached=True,
+                version=current.version or 1
+            )
+        if not vector_store.ready:
+            raise HTTPException(status_code=503, detail="Vector store not available")
+    else:
+        # The same PDF was already ingested (possibly under another filename)
+        existing = await run_db(find_ingested_document, content_hash)
+        if existing:
+            observe_ingest(timer, 0, cached=True)
+            return IngestResponse(
+                document_id=existing.id,
+                pages=existing.page_count,
+                chunks=existing.chunk_count or 0,
+                cached=True,
+                version=existing.version or 1
+            )
+        # Derived from the content so a retried ingest overwrites its own vectors
+        document_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"sha256:{content_hash}"))
+        derived = await run_db(get_document, document_id)
+        if derived and (derived.content_hash != content_hash or (derived.version or 1) > 1):
+            # The document first ingested from this PDF has been revised since: this upload is
+            # another revision of it, rather than a fresh ingest that would reset its version
+            async with revision_locks[document_id]:
+                return await ingest_pipeline(pdf_path, filename, progress, content_hash, timer, document_id)
+
+    if vector_store.ready:
+        # Never write into an index reindex.py has just replaced
+        await refresh_index()
+    # Embedded and upserted with this build's model and store throughout, even if another is switched to
+    index = served_index()
+    
+    with timer.stage("hash"):
+        fingerprints = await run_blocking(page_fingerprints, pdf_path)
+    page_count = len(fingerprints)
+    revision = None
+    if current:
+        with timer.stage("db"):
+            revision = await run_db(plan_revision, current, content_hash, fingerprints)
+    version = revision.version if revision else 1
+    
+    chunk_queue = asyncio.Queue(maxsize=EMBED_BATCH_SIZE * PIPELINE_QUEUE_SIZE)
+    upsert_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    page_timings = []
+    counts = {"chunks": 0, "indexed": 0}
+    written_ids = []
+    
+    async def chunk_stage():
+        chunker = StreamingChunker(index.settings.chunk_size, index.settings.chunk_overlap)
+        extract_start = time.time()
+        pages = iter_pages(
+            pdf_path, content_hash, revision.benefits_id if revision else document_id, fingerprints,
+            page_timings, progress, timer
+        )
+        async for page_num, text in pages:
+            with timer.stage("split"):
+                chunks = await run_blocking(chunker.add_page, page_num + 1, text)
+            for chunk in chunks:
+                await chunk_queue.put(chunk)
+                counts["chunks"] += 1
+            progress(chunks_total=counts["chunks"])
+        timer.add("extract", (time.time() - extract_start) * 1000)
+        with timer.stage("split"):
+            chunks = await run_blocking(chunker.finish)
+        for chunk in chunks:
+            await chunk_queue.put(chunk)
+            counts["chunks"] += 1
+        progress(chunks_total=counts["chunks"])
+        await chunk_queue.put(None)
+    
+    async def embed_stage():
+        done = False
+        while not done:
+            batch = []
+            while len(batch) < EMBED_BATCH_SIZE:
+                chunk = await chunk_queue.get()
+                if chunk is None:
+                    done = True
+                    break
+                batch.append(chunk)
+            if index.store is None:
+                continue
+            if revision:
+                # Chunks identical to one of the current version stay as they are
+                changed = [chunk for chunk in batch if revision.keep(chunk) is None]
+                if len(changed) < len(batch):
+                    counts["indexed"] += len(batch) - len(changed)
+                    progress(chunks_embedded=counts["indexed"])
+                batch = changed
+            if batch:
+                with timer.stage("embed"):
+                    vectors = await run_blocking(embed_chunk_batch, index.embeddings, document_id, batch, version)
+                await upsert_queue.put((batch, vectors))
+        await upsert_queue.put(None)
+    
+    async def upsert_stage():
+        while (item := await upsert_queue.get()) is not None:
+            batch, vectors = item
+            # Deterministic ids make the upsert idempotent
+            ids = [chunk_id(document_id, chunk.index, version) for chunk in batch]
+            with timer.stage("upsert"):
+                await run_blocking(
+                    index.store.upsert,
+                    ids,
+                    vectors,
+                    [chunk.text for chunk in batch],
+                    [
+                        {
+                            "source": filename,
+                            "page": chunk.page_start,
+                            "page_end": chunk.page_end,
+                            "document_id": document_id
+                        }
+                        for chunk in batch
+                    ],
+                    namespace=document_id
+                )
+            with timer.stage("db"):
+                await run_db(lexical_index.add_chunks, document_id, ids, [chunk.text for chunk in batch])
+            written_ids.extend(ids)
+            counts["indexed"] += len(batch)
+            progress(chunks_embedded=counts["indexed"])
+    
+    await run_pipeline_stages(chunk_stage(), embed_stage(), upsert_stage())
+    
+    if written_ids and (await run_db(active_settings, SessionLocal)).build_id != index.settings.build_id:
+        # Embedded for the index that was replaced meanwhile; a retry reuses the stored page text
+        await discard_chunks(document_id, written_ids)
+        raise HTTPException(
+            status_code=503, detail="The index was rebuilt while this document was being ingested; ingest it again"
+        )
+    
+    if not counts["chunks"]:
+        raise HTTPException(status_code=400, detail="No text could be extracted from PDF")
+    
+    stale_ids = []
+    if revision:
+        # Chunks of the current version that the revision neither kept nor rewrote
+        with timer.stage("db"):
+            stale_ids = await run_db(stale_chunk_ids, document_id, set(revision.kept) | set(written_ids))
+        with timer.stage("upsert"):
+            await remove_chunks(revision.document, stale_ids)
+            if revision.moved:
+                # Kept chunks behind added or removed pages only get their page numbers updated
+                await run_blocking(
+                    index.store.update_metadata,
+                    list(revision.moved),
+                    [pages_of(pages) for pages in revision.moved.values()],
+                    namespace=revision.document.vector_namespace
+                )
+    
+    # Store document info in database; the final commit itself is only timed in the metrics
+    with timer.stage("db"):
+        doc_record = Document(
+            id=document_id,
+            filename=filename,
+            page_count=page_count,
+            uploaded_at=datetime.utcnow(),
+            content_hash=content_hash,
+            chunk_count=counts["chunks"],
+            indexed=index.store is not None,
+            vector_namespace=document_id,
+            version=version,
+            ingest_ms=timer.elapsed_ms(),
+            extract_ms=timer.get("extract"),
+            ocr_ms=timer.get("ocr") or 0.0,
+            ocr_pages=sum(1 for timing in page_timings if timing.ocr),
+            split_ms=timer.get("split"),
+            embed_ms=timer.get("embed"),
+            upsert_ms=timer.get("upsert"),
+            db_ms=timer.get("db")
+        )
+        if revision:
+            await run_db(commit_revision, revision, doc_record, stale_ids)
+        else:
+            await run_db(save_document, doc_record)
+    
+    # Cached answers drawn from the previous index contents are stale now
+    answer_cache.invalidate_document(document_id)
+    observe_ingest(timer, counts["chunks"])
+    
+    return IngestResponse(
+        document_id=document_id,
+        pages=page_count,
+        chunks=counts["chunks"],
+        extract_ms=timer.get("extract"),
+        extract_workers=EXTRACT_WORKERS,
+        page_timings=page_timings,
+        stages=timer.as_dict(),
+        version=version,
+        pages_changed=page_count - len(revision.unchanged_pages) if revision else None,
+        chunks_changed=len(written_ids) if revision else None,
+        chunks_removed=len(stale_ids) if revision else None
+    )
+
+# Background ingest jobs, so large PDFs don't have to finish within one HTTP request
+ingest_jobs = IngestJobQueue(
+    run_ingest,
+    SessionLocal,
+    spool_dir=os.getenv("INGEST_SPOOL_DIR", "./ingest_spool"),
+    workers=int(os.getenv("INGEST_JOB_WORKERS", "2")),
+    max_queued=int(os.getenv("INGEST_QUEUE_MAX", "100"))
+)
+
+@app.on_event("shutdown")
+async def stop_ingest_jobs():
+    await ingest_jobs.stop()
+
+async def spool_upload(file, directory=None):
+    """Stream an upload to a temporary file block by block, hashing it on the way.
+
+    Returns (path, sha256); the upload is never held in memory as a whole.
+    """
+    digest = hashlib.sha256()
+    tmp = await run_blocking(tempfile.NamedTemporaryFile, suffix=".pdf", dir=directory, delete=False)
+    try:
+        while block := await file.read(UPLOAD_BLOCK_SIZE):
+            digest.update(block)
+            await run_blocking(tmp.write, block)
+    except BaseException:
+        tmp.close()
+        os.unlink(tmp.name)
+        raise
+    tmp.close()
+    return tmp.name, digest.hexdigest()
+
+@app.post("/ingest", response_model=IngestResponse)
+async def ingest_document(file: UploadFile = File(...), document_id: Optional[str] = Form(None)):
+    """Ingest a PDF; with `document_id`, as a revised version of that existing document"""
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    
+    pdf_path = None
+    try:
+        # Spool the PDF to disk so the extraction workers can open it
+        pdf_path, content_hash = await spool_upload(file)
+        return await run_ingest(pdf_path, file.filename, content_hash=content_hash, document_id=document_id)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+    finally:
+        if pdf_path:
+            os.unlink(pdf_path)
 
-@app.post("/ask", response_model=AskResponse)
-async def ask_question(request: AskRequest):
-    if not vectorstore:
-        raise HTTPException(status_code=500, detail="Vector store not available")
+@app.post("/ingest/jobs", response_model=IngestJobResponse, status_code=202)
+async def submit_ingest_job(file: UploadFile = File(...), document_id: Optional[str] = Form(None)):
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
     
-    start_time = time.time()
+    if not ingest_jobs.running:
+        raise HTTPException(status_code=503, detail="Ingest jobs are not available until the database is reachable")
+    if document_id and await run_db(get_document, document_id) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown document: {document_id}")
     
+    pdf_path, _ = await spool_upload(file, directory=ingest_jobs.spool_dir)
     try:
-        # Retrieve relevant chunks
-        docs = vectorstore.similarity_search(request.question, k=request.k)
-        
-        # Build context from retrieved documents
-        context = "\n\n".join([doc.page_content for doc in docs])
-        
-        # Create sources list
-        sources = []
-        for doc in docs:
-            if hasattr(doc, 'metadata'):
-                sources.append({
-                    "page": doc.metadata.get("page", "Unknown"),
-                    "source": doc.metadata.get("source", "Unknown")
-                })
-        
-        # Build prompt
-        prompt = f"""Answer only using the provided context. Cite pages like [pX]. If unsure, say you don't know.
+        job_id = await ingest_jobs.submit(file.filename, pdf_path, document_id)
+    except QueueFullError as e:
+        os.unlink(pdf_path)
+        raise HTTPException(status_code=429, detail=str(e))
+    return job_response(await run_db(ingest_jobs.get, job_id))
+
+@app.get("/ingest/jobs/{job_id}", response_model=IngestJobResponse)
+async def get_ingest_job(job_id: str):
+    job = await run_db(ingest_jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_response(job)
+
+def job_response(job):
+    return IngestJobResponse(
+        job_id=job.id,
+        status=job.status,
+        filename=job.filename,
+        pages_total=job.pages_total,
+        pages_done=job.pages_done or 0,
+        chunks_total=job.chunks_total,
+        chunks_embedded=job.chunks_embedded or 0,
+        result=IngestResponse(**json.loads(job.result)) if job.result else None,
+        error=job.error,
+        created_at=job.created_at,
+        updated_at=job.updated_at
+    )
+
+# Query rows are written behind the response, in bulk, so answering never waits on the database
+audit_writer = AuditWriter(
+    SessionLocal,
+    batch_size=int(os.getenv("AUDIT_BATCH_SIZE", "100")),
+    flush_interval=float(os.getenv("AUDIT_FLUSH_SECONDS", "1")),
+    max_pending=int(os.getenv("AUDIT_MAX_PENDING", "10000"))
+)
+
+@app.on_event("startup")
+def start_audit_writer():
+    audit_writer.start()
+
+@app.on_event("shutdown")
+def stop_audit_writer():
+    audit_writer.stop()
+
+def record_query(question, answer, latency_ms, scope, sources, retrieval=None, stages=None):
+    stages = stages or {}
+    audit_writer.add(
+        Query,
+        id=str(uuid.uuid4()),
+        question=question,
+        answer=answer,
+        latency_ms=latency_ms,
+        created_at=datetime.utcnow(),
+        scope=scope,
+        sources=json.dumps(sources),
+        retrieval=retrieval,
+        embed_ms=stages.get("embed"),
+        retrieve_ms=stages.get("retrieve"),
+        prompt_ms=stages.get("prompt"),
+        llm_ms=stages.get("llm")
+    )
+
+def warm_answer_cache(index, limit):
+    """Seed the answer cache from recent queries that are still valid.
+
+    Only queries newer than the TTL and than the latest upload are used, since
+    any upload may have changed the answer. Their question embeddings were
+    stored by the embedding cache when they were asked.
+    """
+    db = SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(seconds=answer_cache.ttl_seconds)
+        newest_upload = db.query(func.max(Document.uploaded_at)).scalar()
+        if newest_upload and newest_upload > cutoff:
+            cutoff = newest_upload
+        rows = (
+            db.query(Query)
+            .filter(Query.scope.isnot(None), Query.created_at > cutoff)
+            .order_by(Query.created_at.desc())
+            .limit(limit)
+            .all()
+        )
+    finally:
+        db.close()
+    
+    latest = {}
+    for row in rows:
+        latest.setdefault((row.scope, normalize_text(row.question)), row)
+    rows = sorted(latest.values(), key=lambda row: row.created_at)
+    if not rows:
+        return
+    
+    vectors = index.embeddings.embed_documents([row.question for row in rows])
+    if not still_served(index):
+        return
+    for row, vector in zip(rows, vectors):
+        answer_cache.store(
+            row.scope,
+            vector,
+            row.question,
+            row.answer,
+            json.loads(row.sources or "[]"),
+            [] if row.scope == GLOBAL_SCOPE else row.scope.split(","),
+            created_at=row.created_at.replace(tzinfo=timezone.utc).timestamp()
+        )
+    print(f"Warmed answer cache with {len(rows)} recent answers")
+
+def load_prewarmed_answers(index):
+    """Put pre-warmed answers back in the answer cache, skipping those of documents ingested again since"""
+    db = SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(seconds=answer_cache.ttl_seconds)
+        rows = (
+            db.query(PrewarmedAnswer)
+            .join(Document, Document.id == PrewarmedAnswer.document_id)
+            .filter(
+                Document.indexed.is_(True),
+                PrewarmedAnswer.created_at > cutoff,
+                PrewarmedAnswer.created_at >= Document.uploaded_at
+            )
+            .order_by(PrewarmedAnswer.created_at)
+            .all()
+        )
+    finally:
+        db.close()
+    if not rows:
+        return
+    
+    # Embedded when they were pre-warmed, so these come from the embedding cache
+    vectors = index.embeddings.embed_documents([row.question for row in rows])
+    if not still_served(index):
+        return
+    for row, vector in zip(rows, vectors):
+        answer_cache.store(
+            scope_key([row.document_id]),
+            vector,
+            row.question,
+            row.answer,
+            json.loads(row.sources or "[]"),
+            [row.document_id],
+            created_at=row.created_at.replace(tzinfo=timezone.utc).timestamp()
+        )
+    print(f"Loaded {len(rows)} pre-warmed answers")
+
+@dataclass
+class SearchScope:
+    """What a question is asked against: document_ids is None for every indexed document.
+
+    namespaces are the vector index namespaces holding those documents, and
+    filter narrows the shared default namespace to them for documents
+    ingested before each got its own namespace. sources has the current
+    filename of revised documents, whose unchanged chunks still carry the
+    filename of the version that wrote them.
+    """
+    document_ids: Optional[List[str]]
+    namespaces: List[str]
+    filter: Optional[dict] = None
+    sources: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def key(self):
+        return scope_key(self.document_ids)
+
+def requested_document_ids(request):
+    document_ids = list(request.document_ids or [])
+    if request.document_id:
+        document_ids.append(request.document_id)
+    return sorted(set(document_ids)) or None
+
+def resolve_scope(document_ids=None):
+    """SearchScope for the given documents; 404 if any of them is unknown or not indexed"""
+    db = SessionLocal()
+    try:
+        query = db.query(Document.id, Document.vector_namespace).filter(Document.indexed.is_(True))
+        revised = query.with_entities(Document.id, Document.filename).filter(Document.version > 1)
+        if not document_ids:
+            namespaces = {namespace or "" for (namespace,) in query.with_entities(Document.vector_namespace).distinct()}
+            return SearchScope(None, sorted(namespaces), sources=dict(revised.all()))
+        documents = query.filter(Document.id.in_(document_ids)).all()
+        sources = dict(revised.filter(Document.id.in_(document_ids)).all())
+    finally:
+        db.close()
+    
+    missing = set(document_ids) - {document_id for document_id, _ in documents}
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Document not found: {', '.join(sorted(missing))}")
+    namespaces = sorted({namespace or "" for _, namespace in documents})
+    shared = any(namespace is None for _, namespace in documents)
+    return SearchScope(
+        document_ids, namespaces, {"document_id": {"$in": document_ids}} if shared else None, sources
+    )
+
+def lookup_benefits(category, benefit_type, document_ids=None):
+    db = SessionLocal()
+    try:
+        query = (
+            db.query(Benefit.value, Benefit.network, Benefit.page, Document.filename)
+            .join(Document, Document.id == Benefit.document_id)
+            .filter(
+                Benefit.category == category,
+                Benefit.benefit_type == benefit_type,
+                Document.indexed.is_(True)
+            )
+        )
+        if document_ids:
+            query = query.filter(Benefit.document_id.in_(document_ids))
+        return query.order_by(Document.uploaded_at.desc(), Benefit.page).all()
+    finally:
+        db.close()
+
+def benefits_answer(question, scope):
+    """(answer, sources) straight from the benefits table, or None if the question needs RAG"""
+    if not BENEFITS_ANSWERS:
+        return None
+    match = match_question(question)
+    if match is None:
+        return None
+    rows = lookup_benefits(*match, scope.document_ids)
+    if not rows:
+        return None
+    return format_answer(*match, rows)
+
+def lexical_fast_path(question, k, scope):
+    """Hits for a short keyword question that every top lexical match fully covers, else None.
+
+    These are answered from the lexical index alone, without embedding the
+    question (so the semantic answer cache is not consulted either).
+    """
+    terms = tokenize(question)
+    if not LEXICAL_FAST_PATH or not terms or len(terms) > LEXICAL_FAST_MAX_TERMS:
+        return None
+    matches = lexical_index.search(question, k=k, document_ids=scope.document_ids)
+    if not matches or any(coverage < 1.0 for _, _, coverage in matches):
+        return None
+    return lexical_index.fetch([chunk_id for chunk_id, _, _ in matches]) or None
+
+def vector_search(store, question_vector, k, scope):
+    hits = store.search(question_vector, k=k, filter=scope.filter, namespaces=scope.namespaces)
+    for hit in hits:
+        source = scope.sources.get(hit.metadata.get("document_id"))
+        if source:
+            hit.metadata = {**hit.metadata, "source": source}
+    return hits
+
+def hybrid_search(store, question, question_vector, k, scope):
+    """Vector search of `store` within `scope`, fused with BM25 results by reciprocal rank in hybrid mode"""
+    if RETRIEVAL_MODE != "hybrid" or not len(lexical_index):
+        return vector_search(store, question_vector, k, scope)
+    
+    # Fuse deeper candidate lists than k, so a chunk ranked well by only one side can still make it
+    candidates = max(k * 2, 10)
+    vector_hits = vector_search(store, question_vector, candidates, scope)
+    lexical_ids = [
+        chunk_id for chunk_id, _, _ in lexical_index.search(question, k=candidates, document_ids=scope.document_ids)
+    ]
+    fused = reciprocal_rank_fusion([[hit.id for hit in vector_hits], lexical_ids])[:k]
+    hits = {hit.id: hit for hit in vector_hits}
+    missing = [chunk_id for chunk_id in fused if chunk_id not in hits]
+    if missing:
+        hits.update({hit.id: hit for hit in lexical_index.fetch(missing)})
+    return [hits[chunk_id] for chunk_id in fused if chunk_id in hits]
+
+def vector_search_many(store, question_vectors, k, scope):
+    results = store.search_many(question_vectors, k=k, filter=scope.filter, namespaces=scope.namespaces)
+    for hits in results:
+        for hit in hits:
+            source = scope.sources.get(hit.metadata.get("document_id"))
+            if source:
+                hit.metadata = {**hit.metadata, "source": source}
+    return results
+
+def hybrid_search_many(store, questions, question_vectors, k, scope):
+    """hybrid_search for several questions: their vectors are searched together, and a chunk they share is
+    fetched once and returned as the same SearchResult to each of them"""
+    if RETRIEVAL_MODE != "hybrid" or not len(lexical_index):
+        return vector_search_many(store, question_vectors, k, scope)
+    
+    candidates = max(k * 2, 10)
+    vector_hits = vector_search_many(store, question_vectors, candidates, scope)
+    fused = []
+    for question, hits in zip(questions, vector_hits):
+        lexical_ids = [
+            chunk_id for chunk_id, _, _ in lexical_index.search(question, k=candidates, document_ids=scope.document_ids)
+        ]
+        fused.append(reciprocal_rank_fusion([[hit.id for hit in hits], lexical_ids])[:k])
+    chunks = {}
+    for hits in vector_hits:
+        for hit in hits:
+            chunks.setdefault(hit.id, hit)
+    # Chunks only BM25 found, for any of the questions, in one query
+    missing = list(dict.fromkeys(chunk_id for ids in fused for chunk_id in ids if chunk_id not in chunks))
+    if missing:
+        chunks.update({hit.id: hit for hit in lexical_index.fetch(missing)})
+    return [[chunks[chunk_id] for chunk_id in ids if chunk_id in chunks] for ids in fused]
+
+def context_from_hits(hits):
+    """Prompt context, sources and document ids for the retrieved chunks, within CONTEXT_TOKEN_BUDGET"""
+    context = context_builder.build(hits)
+    ASK_CONTEXT_TOKENS.observe(context.tokens)
+    return context.text, context.sources, context.document_ids
+
+def build_prompt(question, context):
+    return f"""Answer only using the provided context. Cite pages like [pX]. If unsure, say you don't know.
 
 Context:
 {context}
 
-Question: {request.question}
+Question: {question}
 
 Answer:"""
-        
-        # Get response from OpenAI
-        from openai import OpenAI
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.2,
-            max_tokens=500
+
+def get_openai_client():
+    """One long-lived async client, so requests share its HTTP connection pool"""
+    global openai_client
+    if openai_client is None:
+        from openai import AsyncOpenAI
+        openai_client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS
+                ),
+                timeout=httpx.Timeout(60.0, connect=5.0)
+            )
         )
-        
+    return openai_client
+
+@app.on_event("shutdown")
+async def close_openai_client():
+    if openai_client is not None:
+        await openai_client.close()
+
+async def chat_completion(prompt, stream=False):
+    return await get_openai_client().chat.completions.create(
+        model=CHAT_MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.2,
+        max_tokens=500,
+        stream=stream
+    )
+
+def rejection(e):
+    """HTTPException telling the client to back off, for an admission rejection or an upstream rate limit"""
+    if isinstance(e, Overloaded):
+        return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    # openai.RateLimitError, once the client's own retries are used up
+    if getattr(e, "status_code", None) == 429:
+        return HTTPException(
+            status_code=503,
+            detail="The language model is rate limited, retry shortly",
+            headers={"Retry-After": str(UPSTREAM_RETRY_AFTER)}
+        )
+    return None
+
+async def embed_question(index, question):
+    async with embed_limiter.slot():
+        return await run_blocking(index.embeddings.embed_query, question)
+
+@dataclass
+class AskResult:
+    answer: str
+    sources: List[dict]
+    retrieval: Optional[str]
+    cached: bool
+    stages: Dict[str, float]
+
+async def answer_question(question, k, search_scope):
+    """Answer one question: benefits table, lexical fast path or embedding + retrieval, then the LLM"""
+    timer = StageTimer()
+    scope = search_scope.key
+    with timer.stage("benefits"):
+        direct = await run_db(benefits_answer, question, search_scope)
+    if direct:
+        answer, sources = direct
+        return AskResult(answer, sources, "benefits", False, timer.stages)
+    # Pre-warmed answers, and earlier answers to the same wording, need no embedding
+    cached = answer_cache.lookup_question(scope, question)
+    if cached:
+        return AskResult(cached.answer, cached.sources, None, True, timer.stages)
+    
+    index = served_index()
+    question_vector = None
+    retrieval = "lexical"
+    with timer.stage("lexical"):
+        hits = await run_blocking(lexical_fast_path, question, k, search_scope)
+    if hits is None:
+        # Near-identical questions against the same documents are answered from the cache
+        with timer.stage("embed"):
+            question_vector = await embed_question(index, question)
+        cached = lookup_answer(index, scope, question_vector)
+        if cached:
+            return AskResult(cached.answer, cached.sources, None, True, timer.stages)
+        if index.store is None:
+            raise HTTPException(status_code=500, detail="Vector store not available")
+        # Retrieve relevant chunks
+        retrieval = RETRIEVAL_MODE
+        with timer.stage("retrieve"):
+            hits = await run_blocking(hybrid_search, index.store, question, question_vector, k, search_scope)
+    
+    with timer.stage("prompt"):
+        context, sources, document_ids = context_from_hits(hits)
+        prompt = build_prompt(question, context)
+    
+    # Get response from OpenAI
+    async with llm_limiter.slot():
+        with timer.stage("llm"):
+            response = await chat_completion(prompt)
+    answer = response.choices[0].message.content.strip()
+    if question_vector is not None:
+        store_answer(index, scope, question_vector, question, answer, sources, document_ids)
+    return AskResult(answer, sources, retrieval, False, timer.stages)
+
+def prewarm_questions():
+    """The seed questions, then the ones asked more than once recently, most asked first, without repeats"""
+    db = SessionLocal()
+    try:
+        asked = func.count(Query.id)
+        rows = (
+            db.query(Query.question, asked)
+            .filter(Query.created_at > datetime.utcnow() - timedelta(days=PREWARM_LOOKBACK_DAYS))
+            .group_by(Query.question)
+            .having(asked > 1)
+            .order_by(asked.desc())
+            .limit(PREWARM_TOP_QUERIES * 5)
+            .all()
+        )
+    finally:
+        db.close()
+    
+    # Wordings that differ only in case and whitespace count as one question
+    counts = Counter()
+    wordings = {}
+    for question, count in rows:
+        key = normalize_text(question)
+        counts[key] += count
+        wordings.setdefault(key, question)
+    questions = {normalize_text(question): question for question in PREWARM_SEED_QUESTIONS}
+    for key, _ in counts.most_common(PREWARM_TOP_QUERIES):
+        questions.setdefault(key, wordings[key])
+    return list(questions.values())
+
+def replace_prewarmed_answers(document_id, rows):
+    db = SessionLocal()
+    try:
+        db.query(PrewarmedAnswer).filter(PrewarmedAnswer.document_id == document_id).delete(synchronize_session=False)
+        db.add_all(rows)
+        db.commit()
+    finally:
+        db.close()
+
+async def prewarm_answers(document_id):
+    """Answer the common questions against a newly ingested document ahead of time.
+
+    The questions are embedded in one batch and answered like /ask would,
+    PREWARM_CONCURRENCY at a time through the same admission limiters. The
+    answers go to the answer cache, where the first click on one of them
+    finds its exact wording, and to prewarmed_answers for the next start.
+    Questions the benefits table answers are skipped, being instant anyway.
+    """
+    search_scope = await run_db(resolve_scope, [document_id])
+    scope = search_scope.key
+    questions = await run_db(prewarm_questions)
+    direct = await run_db(lambda: [benefits_answer(question, search_scope) for question in questions])
+    questions = [question for question, answer in zip(questions, direct) if answer is None]
+    index = served_index()
+    if not questions or index.store is None:
+        return
+    async with embed_limiter.slot():
+        vectors = await run_blocking(index.embeddings.embed_documents, questions)
+    
+    slots = asyncio.Semaphore(PREWARM_CONCURRENCY)
+    
+    async def answer_one(question, question_vector):
+        async with slots:
+            hits = await run_blocking(hybrid_search, index.store, question, question_vector, PREWARM_K, search_scope)
+            context, sources, document_ids = context_from_hits(hits)
+            async with llm_limiter.slot():
+                response = await chat_completion(build_prompt(question, context))
         answer = response.choices[0].message.content.strip()
-        latency_ms = (time.time() - start_time) * 1000
+        store_answer(index, scope, question_vector, question, answer, sources, document_ids)
+        return PrewarmedAnswer(
+            document_id=document_id,
+            question=question,
+            answer=answer,
+            sources=json.dumps(sources),
+            created_at=datetime.utcnow()
+        )
+    
+    results = await asyncio.gather(
+        *[answer_one(question, vector) for question, vector in zip(questions, vectors)], return_exceptions=True
+    )
+    rows = [result for result in results if isinstance(result, PrewarmedAnswer)]
+    failed = [result for result in results if not isinstance(result, PrewarmedAnswer)]
+    await run_db(replace_prewarmed_answers, document_id, rows)
+    ANSWERS_PREWARMED.labels("answered").inc(len(rows))
+    ANSWERS_PREWARMED.labels("failed").inc(len(failed))
+    print(f"Pre-warmed {len(rows)} answers for document {document_id}" + (f" ({len(failed)} failed: {failed[0]})" if failed else ""))
+
+# Pre-warm task per document; ingesting the document again cancels a running one
+prewarm_tasks = {}
+
+def cancel_prewarm(document_id):
+    task = prewarm_tasks.pop(document_id, None)
+    if task:
+        task.cancel()
+
+def schedule_prewarm(document_id):
+    """Start pre-warming answers for `document_id` in the background"""
+    if not PREWARM_ANSWERS:
+        return
+    cancel_prewarm(document_id)
+    
+    async def run():
+        try:
+            await prewarm_answers(document_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Warning: Could not pre-warm answers for document {document_id}: {e}")
+        finally:
+            if prewarm_tasks.get(document_id) is task:
+                del prewarm_tasks[document_id]
+    
+    task = asyncio.create_task(run())
+    prewarm_tasks[document_id] = task
+
+@app.on_event("shutdown")
+async def stop_prewarm():
+    tasks = list(prewarm_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+@app.post("/ask", response_model=AskResponse)
+async def ask_question(request: AskRequest):
+    timer = StageTimer()
+    
+    try:
+        search_scope = await run_db(resolve_scope, requested_document_ids(request))
+        scope = search_scope.key
+        flight_key = (scope, request.k, normalize_text(request.question).rstrip("?!. "))
+        wait_start = time.perf_counter()
+        result, coalesced = await ask_flights.run(
+            flight_key, lambda: answer_question(request.question, request.k, search_scope)
+        )
+        if coalesced:
+            # This request only waited; the stage timings belong to the one that did the work
+            ASK_COALESCED.inc()
+            timer.add("coalesced", (time.perf_counter() - wait_start) * 1000)
+        else:
+            timer.stages.update(result.stages)
         
         # Store query in database
-        db = SessionLocal()
-        try:
-            query_record = Query(
-                id=str(uuid.uuid4()),
-                question=request.question,
-                answer=answer,
-                latency_ms=latency_ms,
-                created_at=datetime.utcnow()
+        latency_ms = timer.elapsed_ms()
+        stages = timer.as_dict()
+        with timer.stage("persist"):
+            record_query(
+                request.question, result.answer, latency_ms, scope, result.sources, result.retrieval, timer.stages
             )
-            db.add(query_record)
-            db.commit()
-        finally:
-            db.close()
+        observe_ask("ask", timer, result.retrieval, cached=result.cached)
         
         return AskResponse(
-            answer=answer,
+            answer=result.answer,
             latency_ms=latency_ms,
-            sources=sources
+            sources=result.sources,
+            cached=result.cached,
+            retrieval=result.retrieval,
+            stages=stages,
+            coalesced=coalesced
         )
         
+    except HTTPException:
+        ASK_ERRORS.labels("ask").inc()
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing question: {str(e)}")
+        ASK_ERRORS.labels("ask").inc()
+        raise rejection(e) or HTTPException(status_code=500, detail=f"Error processing question: {str(e)}")
+
+# Questions per /ask/batch call, and how many of their completions run at once
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "50"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+
+@app.post("/ask/batch", response_model=AskBatchResponse)
+async def ask_batch(request: AskBatchRequest):
+    """Answer a list of questions together.
+
+    All questions are embedded in one call and retrieved together: their
+    vectors are scored in one pass over the index, and a chunk several of them
+    retrieve is fetched once and shared. Completions run with at most
+    BATCH_LLM_CONCURRENCY in flight, so the batch takes roughly as long as its
+    slowest question. A failed question reports its error without failing the
+    rest.
+    """
+    batch_timer = StageTimer()
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="No questions given")
+    if len(request.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+    
+    search_scope = await run_db(resolve_scope, requested_document_ids(request))
+    scope = search_scope.key
+    index = served_index()
+    # Questions answered from the benefits table, by a cached answer to the same wording, or confidently
+    # by the lexical index, are not embedded at all
+    with batch_timer.stage("benefits"):
+        direct = await run_db(lambda: [benefits_answer(question, search_scope) for question in request.questions])
+    exact = [
+        answer_cache.lookup_question(scope, question) if answer is None else None
+        for question, answer in zip(request.questions, direct)
+    ]
+    with batch_timer.stage("lexical"):
+        fast_hits = await run_blocking(
+            lambda: [
+                lexical_fast_path(question, request.k, search_scope) if answer is None and cached is None else None
+                for question, answer, cached in zip(request.questions, direct, exact)
+            ]
+        )
+    vectors = [None] * len(request.questions)
+    to_embed = [
+        i for i, hits in enumerate(fast_hits) if hits is None and direct[i] is None and exact[i] is None
+    ]
+    if to_embed:
+        try:
+            with batch_timer.stage("embed"):
+                async with embed_limiter.slot():
+                    embedded = await run_blocking(
+                        index.embeddings.embed_documents, [request.questions[i] for i in to_embed]
+                    )
+        except Exception as e:
+            ASK_ERRORS.labels("batch").inc()
+            raise rejection(e) or HTTPException(status_code=500, detail=f"Error embedding questions: {str(e)}")
+        for i, vector in zip(to_embed, embedded):
+            vectors[i] = vector
+            exact[i] = lookup_answer(index, scope, vector)
+    
+    # The embedded questions without a cached answer are retrieved together
+    to_retrieve = [i for i in to_embed if exact[i] is None]
+    retrieve_error = None
+    if to_retrieve and index.store is not None:
+        try:
+            with batch_timer.stage("retrieve"):
+                retrieved = await run_blocking(
+                    hybrid_search_many,
+                    index.store,
+                    [request.questions[i] for i in to_retrieve],
+                    [vectors[i] for i in to_retrieve],
+                    request.k,
+                    search_scope
+                )
+        except Exception as e:
+            retrieve_error = e
+        else:
+            for i, hits in zip(to_retrieve, retrieved):
+                fast_hits[i] = hits
+    llm_slots = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+    
+    async def answer_one(question, question_vector, hits, direct_answer, exact_answer):
+        # Each question carries the shared batch stages, so its row and metrics add up to its latency
+        timer = StageTimer()
+        timer.started = batch_timer.started
+        timer.stages = dict(batch_timer.stages)
+        if question_vector is None:
+            timer.stages.pop("embed", None)
+        if question_vector is None or exact_answer is not None:
+            timer.stages.pop("retrieve", None)
+        retrieval = None
+        cached = exact_answer
+        
+        if direct_answer:
+            retrieval = "benefits"
+            answer, sources = direct_answer
+        else:
+            if cached:
+                answer, sources = cached.answer, cached.sources
+            else:
+                if hits is None:
+                    if retrieve_error is not None:
+                        raise retrieve_error
+                    raise RuntimeError("Vector store not available")
+                
+                retrieval = "lexical" if question_vector is None else RETRIEVAL_MODE
+                with timer.stage("prompt"):
+                    context, sources, document_ids = context_from_hits(hits)
+                    prompt = build_prompt(question, context)
+                
+                async with llm_slots, llm_limiter.slot():
+                    with timer.stage("llm"):
+                        response = await chat_completion(prompt)
+                answer = response.choices[0].message.content.strip()
+                if question_vector is not None:
+                    store_answer(index, scope, question_vector, question, answer, sources, document_ids)
+        
+        latency_ms = timer.elapsed_ms()
+        with timer.stage("persist"):
+            record_query(question, answer, latency_ms, scope, sources, retrieval, timer.stages)
+        observe_ask("batch", timer, retrieval, cached=cached is not None)
+        return AskBatchItem(
+            question=question,
+            answer=answer,
+            sources=sources,
+            cached=cached is not None,
+            retrieval=retrieval,
+            retrieve_ms=timer.get("retrieve"),
+            llm_ms=timer.get("llm"),
+            latency_ms=latency_ms
+        )
+    
+    async def answer_or_error(question, question_vector, hits, direct_answer, exact_answer):
+        try:
+            return await answer_one(question, question_vector, hits, direct_answer, exact_answer)
+        except Exception as e:
+            ASK_ERRORS.labels("batch").inc()
+            rejected = rejection(e)
+            return AskBatchItem(
+                question=question,
+                latency_ms=batch_timer.elapsed_ms(),
+                error=rejected.detail if rejected else f"Error processing question: {str(e)}"
+            )
+    
+    results = await asyncio.gather(*[
+        answer_or_error(question, vector, hits, direct_answer, exact_answer)
+        for question, vector, hits, direct_answer, exact_answer in zip(
+            request.questions, vectors, fast_hits, direct, exact
+        )
+    ])
+    return AskBatchResponse(
+        results=results,
+        latency_ms=batch_timer.elapsed_ms(),
+        embed_ms=batch_timer.get("embed") or 0.0,
+        unique_chunks=len({hit.id for hits in fast_hits if hits for hit in hits})
+    )
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def answer_events(question, k, search_scope):
+    """The work of /ask/stream, shared by identical questions in flight: ("sources", data) and ("token", data)
+    events as they become available, then ("result", AskResult)"""
+    timer = StageTimer()
+    scope = search_scope.key
+    with timer.stage("benefits"):
+        direct = await run_db(benefits_answer, question, search_scope)
+    if direct:
+        answer, sources = direct
+        yield "sources", {"sources": sources, "cached": False, "retrieval": "benefits"}
+        yield "token", {"text": answer}
+        yield "result", AskResult(answer, sources, "benefits", False, timer.stages)
+        return
+    
+    index = served_index()
+    question_vector = None
+    hits = None
+    retrieval = "lexical"
+    cached = answer_cache.lookup_question(scope, question)
+    if cached is None:
+        with timer.stage("lexical"):
+            hits = await run_blocking(lexical_fast_path, question, k, search_scope)
+    if cached is None and hits is None:
+        with timer.stage("embed"):
+            question_vector = await embed_question(index, question)
+        cached = lookup_answer(index, scope, question_vector)
+    if cached:
+        yield "sources", {"sources": cached.sources, "cached": True}
+        yield "token", {"text": cached.answer}
+        yield "result", AskResult(cached.answer, cached.sources, None, True, timer.stages)
+        return
+    
+    if hits is None:
+        if index.store is None:
+            raise HTTPException(status_code=500, detail="Vector store not available")
+        retrieval = RETRIEVAL_MODE
+        with timer.stage("retrieve"):
+            hits = await run_blocking(hybrid_search, index.store, question, question_vector, k, search_scope)
+    with timer.stage("prompt"):
+        context, sources, document_ids = context_from_hits(hits)
+        prompt = build_prompt(question, context)
+    yield "sources", {"sources": sources, "cached": False, "retrieval": retrieval}
+    
+    parts = []
+    # The slot is held until the last token, or until every client asking has gone away
+    async with llm_limiter.slot():
+        with timer.stage("llm"):
+            async for chunk in await chat_completion(prompt, stream=True):
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield "token", {"text": delta}
+    
+    answer = "".join(parts).strip()
+    if question_vector is not None:
+        store_answer(index, scope, question_vector, question, answer, sources, document_ids)
+    yield "result", AskResult(answer, sources, retrieval, False, timer.stages)
+
+async def stream_answer(request, search_scope, timer):
+    """Yield the answer as Server-Sent Events: sources, then tokens, then a done event with stage timings.
+
+    Identical questions against the same documents in flight at once share
+    one answer_events() run, the way /ask coalesces; each request gets every
+    event from the start and records its own query row.
+    """
+    try:
+        scope = search_scope.key
+        flight_key = (scope, request.k, normalize_text(request.question).rstrip("?!. "))
+        events, coalesced = ask_flights.stream(
+            flight_key, lambda: answer_events(request.question, request.k, search_scope)
+        )
+        if coalesced:
+            ASK_COALESCED.inc()
+        result = None
+        async with aclosing(events):
+            async for event, data in events:
+                if event == "result":
+                    result = data
+                    continue
+                if event == "token" and "first_token" not in timer.stages:
+                    timer.add("first_token", timer.elapsed_ms())
+                yield sse_event(event, data)
+        if coalesced:
+            # This request only followed along; the stage timings belong to the one that did the work
+            timer.add("coalesced", timer.elapsed_ms())
+        else:
+            timer.stages.update(result.stages)
+        
+        latency_ms = timer.elapsed_ms()
+        stages = timer.as_dict()
+        with timer.stage("persist"):
+            record_query(
+                request.question, result.answer, latency_ms, scope, result.sources, result.retrieval, timer.stages
+            )
+        observe_ask("stream", timer, result.retrieval, cached=result.cached)
+        
+        yield sse_event("done", {
+            "answer": result.answer,
+            "latency_ms": latency_ms,
+            "stages": stages,
+            "cached": result.cached,
+            "retrieval": result.retrieval,
+            "coalesced": coalesced
+        })
+    except Exception as e:
+        ASK_ERRORS.labels("stream").inc()
+        rejected = rejection(e)
+        if isinstance(e, HTTPException):
+            yield sse_event("error", {"detail": e.detail})
+        elif rejected:
+            yield sse_event("error", {
+                "detail": rejected.detail,
+                "status": rejected.status_code,
+                "retry_after": int(rejected.headers["Retry-After"])
+            })
+        else:
+            yield sse_event("error", {"detail": f"Error processing question: {str(e)}"})
+
+@app.post("/ask/stream")
+async def ask_question_stream(request: AskRequest):
+    timer = StageTimer()
+    # Resolved before streaming starts, so an unknown document is a plain 404
+    try:
+        search_scope = await run_db(resolve_scope, requested_document_ids(request))
+    except HTTPException:
+        ASK_ERRORS.labels("stream").inc()
+        raise
+    return StreamingResponse(
+        stream_answer(request, search_scope, timer),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.on_event("shutdown")
+def stop_executors():
+    # Registered last so the other shutdown hooks can still use the executors
+    shutdown_executors()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,117 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import insert
+
+from metrics import AUDIT_DROPPED, AUDIT_PENDING, AUDIT_WRITTEN
+
+_STOP = object()
+
+
+class AuditWriter:
+    """Write-behind persistence for rows nothing reads back right away (the queries table).
+
+    add() only queues the row. A background thread inserts queued rows in
+    bulk once `batch_size` are waiting or `flush_interval` seconds after the
+    first of them, so requests never wait on the database. When a flush
+    fails the rows are kept and retried with backoff, up to `max_pending`
+    rows (the oldest are dropped beyond that), so a database blip delays
+    audit rows instead of failing answers. stop() flushes what is left.
+    """
+
+    def __init__(self, session_factory, batch_size=100, flush_interval=1.0, max_pending=10000, max_backoff=30.0):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_backoff = max_backoff
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10.0):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def add(self, model, **values):
+        """Queue one row of `model` for insertion"""
+        self._queue.put((model, values))
+        AUDIT_PENDING.inc()
+
+    def _flush(self, pending):
+        by_model = defaultdict(list)
+        for model, values in pending:
+            by_model[model].append(values)
+        db = None
+        try:
+            db = self.session_factory()
+            for model, rows in by_model.items():
+                for start in range(0, len(rows), self.batch_size):
+                    db.execute(insert(model), rows[start:start + self.batch_size])
+            db.commit()
+        except Exception as e:
+            if db is not None:
+                db.rollback()
+            print(f"Warning: Could not write {len(pending)} audit rows, will retry: {e}")
+            return False
+        finally:
+            if db is not None:
+                db.close()
+        for model, rows in by_model.items():
+            AUDIT_WRITTEN.labels(model.__tablename__).inc(len(rows))
+        AUDIT_PENDING.dec(len(pending))
+        return True
+
+    def _drop(self, rows):
+        for model, _ in rows:
+            AUDIT_DROPPED.labels(model.__tablename__).inc()
+        AUDIT_PENDING.dec(len(rows))
+
+    def _run(self):
+        pending = []
+        deadline = None
+        backoff = self.flush_interval
+        # After a failed flush, nothing is retried before its backoff has passed, however many rows arrive
+        retrying = False
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=None if not pending else max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                stopping = True
+            elif item is not None:
+                if not pending:
+                    deadline = time.monotonic() + self.flush_interval
+                pending.append(item)
+                if (retrying or len(pending) < self.batch_size) and time.monotonic() < deadline:
+                    continue
+            if not pending:
+                continue
+
+            if self._flush(pending):
+                pending = []
+                backoff = self.flush_interval
+                retrying = False
+                continue
+            if len(pending) > self.max_pending:
+                overflow = len(pending) - self.max_pending
+                print(f"Warning: Dropping {overflow} audit rows, the database has been unavailable too long")
+                self._drop(pending[:overflow])
+                pending = pending[overflow:]
+            retrying = True
+            deadline = time.monotonic() + backoff
+            backoff = min(backoff * 2, self.max_backoff)
+
+        if pending:
+            print(f"Warning: Dropping {len(pending)} audit rows that could not be written before shutdown")
+            self._drop(pending)
@@ -0,0 +1,276 @@
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+# Service categories and the phrases that name them, most specific first
+CATEGORIES = {
+    "specialist": ["specialist", "specialists"],
+    "primary_care": ["primary care", "pcp", "office visit", "office visits", "doctor visit", "doctor visits"],
+    "urgent_care": ["urgent care"],
+    "emergency_room": ["emergency room", "emergency department", "emergency care", "er"],
+    "imaging": ["mri", "mris", "ct scan", "ct scans", "pet scan", "imaging", "x-ray", "x-rays", "xray"],
+    "physical_therapy": ["physical therapy", "physiotherapy"],
+    "mental_health": ["mental health", "behavioral health"],
+    "prescription_drugs": ["prescription", "prescriptions", "prescription drugs", "generic drugs", "brand drugs"],
+    "hospital": ["inpatient", "hospital stay", "hospital stays", "hospitalization"],
+    "preventive": ["preventive", "preventive care", "wellness visit", "annual physical"],
+    "lab": ["lab work", "laboratory", "blood work", "lab tests"],
+}
+
+CATEGORY_LABELS = {
+    "general": "this plan",
+    "specialist": "specialist visits",
+    "primary_care": "primary care visits",
+    "urgent_care": "urgent care",
+    "emergency_room": "emergency room visits",
+    "imaging": "imaging (MRI, CT, X-ray)",
+    "physical_therapy": "physical therapy",
+    "mental_health": "mental health services",
+    "prescription_drugs": "prescription drugs",
+    "hospital": "inpatient hospital stays",
+    "preventive": "preventive care",
+    "lab": "lab work",
+}
+
+BENEFIT_TYPES = {
+    "copay": r"co-?pays?|co-?payments?",
+    "coinsurance": r"co-?insurance",
+    "deductible": r"deductibles?",
+    "out_of_pocket_max": r"out[- ]of[- ]pocket (?:max(?:imum)?|limit)|\boop max(?:imum)?|maximum out[- ]of[- ]pocket",
+}
+
+TYPE_LABELS = {
+    "copay": "copay",
+    "coinsurance": "coinsurance",
+    "deductible": "deductible",
+    "out_of_pocket_max": "out-of-pocket maximum",
+}
+
+# Deductibles and out-of-pocket limits are plan-wide unless a service is named
+PLAN_WIDE_TYPES = {"deductible", "out_of_pocket_max"}
+
+_CATEGORY_PATTERNS = {
+    category: re.compile(r"\b(?:" + "|".join(re.escape(phrase) for phrase in phrases) + r")\b", re.IGNORECASE)
+    for category, phrases in CATEGORIES.items()
+}
+_TYPE_PATTERNS = {
+    benefit_type: re.compile(r"\b(?:" + pattern + r")\b", re.IGNORECASE)
+    for benefit_type, pattern in BENEFIT_TYPES.items()
+}
+_ANY_TYPE = re.compile("|".join(pattern.pattern for pattern in _TYPE_PATTERNS.values()), re.IGNORECASE)
+_MONEY = re.compile(r"\$\s?\d+(?:,\d{3})*(?:\.\d{2})?")
+_PERCENT = re.compile(r"\b\d{1,3}(?:\.\d+)?\s?%")
+_NO_CHARGE = re.compile(r"\bno charge\b|\bno cost\b", re.IGNORECASE)
+_OUT_OF_NETWORK = re.compile(r"\bout[- ]of[- ]network\b|\bnon[- ](?:network|participating)\b", re.IGNORECASE)
+_IN_NETWORK = re.compile(r"\bin[- ]network\b|\bparticipating\b", re.IGNORECASE)
+# Clauses within a line: sentences and semicolon-separated items
+_CLAUSE_END = re.compile(r"(?<=\.)\s+|\s*;\s*")
+_BULLET = re.compile(r"^\s*(?:[-*\u2022\u25aa\u25cf\u2013]|\(?\d{1,2}[.)]|\(?[a-z][.)])\s+")
+# "Generic: $10 copay" -> label "Generic"
+_LABEL = re.compile(r"^([^:$%]{1,60}):\s*\S")
+# Questions a single table value can't answer: yes/no, conditional or comparative ones
+_YES_NO_QUESTION = re.compile(
+    r"^\s*(?:is|are|am|was|were|does|do|did|can|could|will|would|should|has|have|must|may)\b", re.IGNORECASE
+)
+_QUALIFIED_QUESTION = re.compile(
+    r"\b(?:if|when|unless|after|before|once|waived?|apply|applies|count|counts|toward|towards|instead|"
+    r"compared?|versus|vs|differen(?:t|ce)|why|reimburs\w*|met|exceed\w*|still)\b",
+    re.IGNORECASE
+)
+
+
+@dataclass
+class BenefitRow:
+    category: str
+    benefit_type: str
+    value: str
+    network: Optional[str] = None
+    snippet: str = ""
+
+
+def mentions_benefits(text):
+    """Cheap check run before the more expensive table detection"""
+    return bool(_ANY_TYPE.search(text))
+
+
+def _categories(text):
+    return [category for category, pattern in _CATEGORY_PATTERNS.items() if pattern.search(text)]
+
+
+def _network(text):
+    if _OUT_OF_NETWORK.search(text):
+        return "out_of_network"
+    if _IN_NETWORK.search(text):
+        return "in_network"
+    return None
+
+
+def _values(text, benefit_type):
+    pattern = _PERCENT if benefit_type == "coinsurance" else _MONEY
+    values = [(match.start(), " ".join(match.group().split())) for match in pattern.finditer(text)]
+    if benefit_type in ("copay", "coinsurance"):
+        values += [(match.start(), "No charge") for match in _NO_CHARGE.finditer(text)]
+    return values
+
+
+def _rules(text, category=None, network=None, label=None):
+    """Benefit rows stated in one clause or table cell.
+
+    Values are paired with the benefit types mentioned closest to them, each
+    type and each value used once (a dollar amount, or a percentage for
+    coinsurance). The category named in the clause wins over `category`, the
+    one of its section heading; copays and coinsurance need exactly one to be
+    recorded. `label` qualifies the value, e.g. the drug tier of a copay.
+    """
+    categories = _categories(text)
+    if len(categories) == 1:
+        category = categories[0]
+    elif categories:
+        category = None
+    network = network or _network(text)
+
+    pairs = []
+    for benefit_type, pattern in _TYPE_PATTERNS.items():
+        mention = pattern.search(text)
+        if not mention:
+            continue
+        row_category = category or ("general" if benefit_type in PLAN_WIDE_TYPES else None)
+        if row_category is None:
+            continue
+        for position, value in _values(text, benefit_type):
+            pairs.append((abs(position - mention.start()), position, benefit_type, row_category, value))
+
+    rows = []
+    claimed_types = set()
+    claimed_values = set()
+    for _, position, benefit_type, row_category, value in sorted(pairs):
+        if benefit_type in claimed_types or position in claimed_values:
+            continue
+        claimed_types.add(benefit_type)
+        claimed_values.add(position)
+        if label:
+            value = f"{value} ({label})"
+        rows.append(BenefitRow(row_category, benefit_type, value, network, " ".join(text.split())[:300]))
+    return rows
+
+
+def _clauses(block):
+    """(clause, section category, label) for each line, bullet item and clause of a text block.
+
+    A value is only ever read from the clause that mentions it, so one line's
+    figure can't be attributed to the next line's benefit. A line ending in a
+    colon, like "PRESCRIPTION DRUGS:", is a heading whose category applies to
+    the items under it; their own "Generic:" style label then qualifies the
+    value. Wrapped lines, which continue in lowercase, are joined back first.
+    """
+    lines = []
+    for line in block.splitlines():
+        line = " ".join(line.split())
+        if not line:
+            continue
+        if lines and line[0].islower() and not _BULLET.match(line):
+            lines[-1] += " " + line
+        else:
+            lines.append(line)
+
+    section = None
+    for line in lines:
+        line = _BULLET.sub("", line)
+        if line.endswith(":") and not _values(line, "copay") and not _values(line, "coinsurance"):
+            categories = _categories(line)
+            section = categories[0] if len(categories) == 1 else None
+            continue
+        label = None
+        if section:
+            match = _LABEL.match(line)
+            if match and not _categories(match.group(1)) and not _ANY_TYPE.search(match.group(1)):
+                label = match.group(1).strip()
+        for clause in _CLAUSE_END.split(line):
+            if clause:
+                yield clause, section, label
+
+
+def _table_rows(table):
+    """Rules applied cell by cell, with the first column naming the service and the header the column"""
+    if not table:
+        return []
+    header = [cell or "" for cell in table[0]]
+    rows = []
+    for row in table[1:]:
+        cells = [cell or "" for cell in row]
+        if not cells or not any(cells):
+            continue
+        categories = _categories(cells[0])
+        category = categories[0] if categories else None
+        for column, cell in enumerate(cells[1:], start=1):
+            if not cell.strip():
+                continue
+            heading = header[column] if column < len(header) else ""
+            text = f"{cells[0]} {heading} {cell}"
+            rows.extend(_rules(text, category=category, network=_network(heading) or _network(cell)))
+    return rows
+
+
+def extract_benefits(blocks, tables=()):
+    """Benefit rows from a page's text blocks and extracted tables (lists of rows of cells)"""
+    rows = []
+    for table in tables:
+        rows.extend(_table_rows(table))
+    for block in blocks:
+        if not mentions_benefits(block):
+            continue
+        for clause, section, label in _clauses(block):
+            rows.extend(_rules(clause, category=section, label=label))
+
+    # Table text shows up in the text blocks too
+    unique = {}
+    for row in rows:
+        unique.setdefault((row.category, row.benefit_type, row.value, row.network), row)
+    return list(unique.values())
+
+
+def match_question(question):
+    """(category, benefit type) for a question the benefits table could answer directly, else None.
+
+    Only questions asking for the value itself qualify; yes/no questions and
+    ones with a condition ("...if I'm admitted?") are left to retrieval.
+    """
+    if _YES_NO_QUESTION.search(question) or _QUALIFIED_QUESTION.search(question):
+        return None
+    types = [benefit_type for benefit_type, pattern in _TYPE_PATTERNS.items() if pattern.search(question)]
+    categories = _categories(question)
+    if len(types) != 1 or len(categories) > 1:
+        return None
+    benefit_type = types[0]
+    if categories:
+        return categories[0], benefit_type
+    if benefit_type in PLAN_WIDE_TYPES:
+        return "general", benefit_type
+    return None
+
+
+def format_answer(category, benefit_type, rows, max_values=5):
+    """Answer text and sources from (value, network, page, source) rows, citing pages like the LLM does"""
+    distinct = {}
+    for value, network, page, source in rows:
+        distinct.setdefault((source, value, network), page)
+    multiple_sources = len({source for source, _, _ in distinct}) > 1
+
+    parts = []
+    sources = []
+    for (source, value, network), page in list(distinct.items())[:max_values]:
+        part = value
+        if network:
+            part += f" {network.replace('_', '-')}"
+        if multiple_sources:
+            part += f" in {source}"
+        parts.append(f"{part} [p{page}]")
+        if {"page": page, "page_end": page, "source": source} not in sources:
+            sources.append({"page": page, "page_end": page, "source": source})
+
+    subject = f"The {TYPE_LABELS[benefit_type]}"
+    if category != "general":
+        subject += f" for {CATEGORY_LABELS[category]}"
+    if len(parts) == 1:
+        return f"{subject} is {parts[0]}.", sources
+    return f"{subject}: " + "; ".join(parts) + ".", sources
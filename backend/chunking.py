@@ -0,0 +1,94 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+
+@dataclass
+class Chunk:
+    index: int
+    text: str
+    page_start: int
+    page_end: int
+
+
+class StreamingChunker:
+    """Split pages into overlapping chunks as they arrive, tracking the pages each chunk spans.
+
+    Pages are appended to a buffer separated by blank lines; the pages a chunk
+    spans are kept in its page_start/page_end rather than in its text, so a
+    chunk's text doesn't change when pages before it are added or removed.
+    Once the buffer passes `flush_size` characters it is split and
+    every chunk but the last is emitted; the last one may still grow with the
+    next page, so the buffer restarts at its first character. Memory stays
+    bounded by `flush_size` however long the document is.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, flush_size=None):
+        # Imported here rather than at module level, where it would add about a second to startup
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+            add_start_index=True,
+        )
+        self.flush_size = flush_size or chunk_size * 8
+        self._buffer = ""
+        # (offset in buffer, page number) for each page in the buffer, ascending
+        self._pages = []
+        self._next_index = 0
+
+    def add_page(self, page_number, text):
+        """Add one page's text; returns the chunks that are now final"""
+        if not text:
+            return []
+        if self._buffer:
+            self._buffer += "\n\n"
+        self._pages.append((len(self._buffer), page_number))
+        self._buffer += text
+        if len(self._buffer) < self.flush_size:
+            return []
+        return self._split(final=False)
+
+    def finish(self):
+        """Flush the remaining buffer once the last page has been added"""
+        if not self._buffer.strip():
+            return []
+        return self._split(final=True)
+
+    def _page_at(self, offset):
+        position = bisect_right([page_offset for page_offset, _ in self._pages], offset) - 1
+        return self._pages[max(position, 0)][1]
+
+    def _split(self, final):
+        documents = self.splitter.create_documents([self._buffer])
+        keep_from = None
+        if not final and len(documents) > 1:
+            keep_from = documents[-1].metadata["start_index"]
+            documents = documents[:-1]
+        elif not final:
+            return []
+
+        chunks = []
+        for document in documents:
+            start = max(document.metadata["start_index"], 0)
+            chunks.append(Chunk(
+                index=self._next_index,
+                text=document.page_content,
+                page_start=self._page_at(start),
+                page_end=self._page_at(start + len(document.page_content) - 1),
+            ))
+            self._next_index += 1
+
+        if keep_from is None:
+            self._buffer = ""
+            self._pages = []
+        else:
+            # Keep the page the retained text starts in, plus every page after it
+            first = bisect_right([page_offset for page_offset, _ in self._pages], keep_from) - 1
+            self._pages = [(max(offset - keep_from, 0), page) for offset, page in self._pages[max(first, 0):]]
+            self._buffer = self._buffer[keep_from:]
+        return chunks
@@ -0,0 +1,231 @@
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import List
+
+from chunking import CHUNK_OVERLAP
+
+_SHINGLE = 5
+_SPACES = re.compile(r"[ \t\r\f\v]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+_WORD = re.compile(r"\w+")
+_CHUNK_SUFFIX = re.compile(r"(?:v(\d+)-)?(\d+)")
+
+
+@dataclass
+class Passage:
+    """Text of one or more consecutive chunks of a document, ranked by its best hit"""
+    rank: int
+    text: str
+    source: str
+    page: object
+    page_end: object
+    document_id: str = None
+    # Chunk id series (document version) the indexes count in
+    series: int = None
+    first_index: int = None
+    last_index: int = None
+    chunk_ids: List[str] = field(default_factory=list)
+
+
+@dataclass
+class Context:
+    text: str
+    sources: List[dict]
+    document_ids: set
+    tokens: int
+    # Passages left out or cut short to stay within the budget
+    dropped: int = 0
+    truncated: int = 0
+
+
+def compress(text):
+    """Collapse runs of spaces and blank lines, which PDF text is full of"""
+    lines = [_SPACES.sub(" ", line).strip() for line in text.split("\n")]
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+
+def join_overlapping(first, second, max_overlap=CHUNK_OVERLAP * 2, min_overlap=20):
+    """Concatenate two consecutive chunks, keeping the text they share only once"""
+    for size in range(min(len(first), len(second), max_overlap), min_overlap - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return f"{first}\n{second}"
+
+
+def _chunk_position(hit):
+    """(series, index) of a hit's chunk in its document, from a "<document id>-<index>" or
+    "<document id>-v<version>-<index>" chunk id; None if the id has neither form.
+
+    Chunks a revision of the document left unchanged keep their ids, so only
+    indexes in the same series are known to be consecutive.
+    """
+    document_id = hit.metadata.get("document_id")
+    if document_id and hit.id.startswith(f"{document_id}-"):
+        match = _CHUNK_SUFFIX.fullmatch(hit.id[len(document_id) + 1:])
+        if match:
+            return int(match.group(1) or 1), int(match.group(2))
+    return None
+
+
+def page_label(page, page_end):
+    """Header put before a passage, since chunk text doesn't carry its page numbers"""
+    if page_end is None or page_end == page:
+        return f"Page {page}:"
+    return f"Pages {page}-{page_end}:"
+
+
+def _shingles(text):
+    words = _WORD.findall(text.lower())
+    return {tuple(words[i:i + _SHINGLE]) for i in range(max(len(words) - _SHINGLE + 1, 1))}
+
+
+class ContextBuilder:
+    """Turns ranked retrieval hits into prompt context that fits a token budget.
+
+    Hits from consecutive chunks of a document are merged into one passage
+    with their overlap removed, a passage whose text is mostly contained in a
+    better-ranked one is dropped, and passages are headed with the pages they
+    span (chunk text has no page numbers) and packed best first until
+    `token_budget` tokens are used; the passage that crosses the budget is
+    cut at a sentence boundary. Tokens are counted with tiktoken's encoding
+    for `model`, or estimated at 4 characters per token if it can't be loaded.
+    """
+
+    def __init__(self, model, token_budget=2000, duplicate_threshold=0.8, min_tokens=50):
+        self.model = model
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.min_tokens = min_tokens
+        self._encoding = None
+        self._lock = threading.Lock()
+
+    @property
+    def encoding(self):
+        """tiktoken encoding, loaded on first use; False if unavailable"""
+        if self._encoding is None:
+            with self._lock:
+                if self._encoding is None:
+                    try:
+                        import tiktoken
+                        try:
+                            self._encoding = tiktoken.encoding_for_model(self.model)
+                        except KeyError:
+                            self._encoding = tiktoken.get_encoding("o200k_base")
+                    except Exception as e:
+                        print(f"Warning: Could not load tokenizer for {self.model}, estimating token counts: {e}")
+                        self._encoding = False
+        return self._encoding
+
+    def count_tokens(self, text):
+        if self.encoding:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return (len(text) + 3) // 4
+
+    def truncate(self, text, max_tokens):
+        """Longest prefix within `max_tokens`, cut back to the end of a sentence or line when there is one"""
+        if self.encoding:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            prefix = self.encoding.decode(tokens[:max_tokens])
+        else:
+            if len(text) <= max_tokens * 4:
+                return text
+            prefix = text[:max_tokens * 4]
+        cut = max(prefix.rfind(". "), prefix.rfind(".\n"), prefix.rfind("\n"))
+        # Don't throw away most of the prefix just to end on a full sentence
+        if cut > len(prefix) // 2:
+            prefix = prefix[:cut + 1]
+        return prefix.rstrip()
+
+    def passages(self, hits):
+        """Hits merged into passages, in rank order, with near duplicates removed"""
+        passages = []
+        seen = set()
+        for rank, hit in enumerate(hits):
+            if hit.id in seen:
+                continue
+            seen.add(hit.id)
+            series, index = _chunk_position(hit) or (None, None)
+            passages.append(Passage(
+                rank=rank,
+                text=compress(hit.text),
+                source=hit.metadata.get("source", "Unknown"),
+                page=hit.metadata.get("page", "Unknown"),
+                page_end=hit.metadata.get("page_end"),
+                document_id=hit.metadata.get("document_id"),
+                series=series,
+                first_index=index,
+                last_index=index,
+                chunk_ids=[hit.id],
+            ))
+
+        # Merge runs of consecutive chunks from the same document
+        ordered = sorted(
+            (passage for passage in passages if passage.first_index is not None),
+            key=lambda passage: (passage.document_id, passage.series, passage.first_index)
+        )
+        merged = [passage for passage in passages if passage.first_index is None]
+        for passage in ordered:
+            previous = merged[-1] if merged else None
+            if (
+                previous is not None
+                and previous.first_index is not None
+                and previous.document_id == passage.document_id
+                and previous.series == passage.series
+                and passage.first_index == previous.last_index + 1
+            ):
+                previous.text = join_overlapping(previous.text, passage.text)
+                previous.last_index = passage.last_index
+                previous.page_end = passage.page_end if passage.page_end is not None else passage.page
+                previous.rank = min(previous.rank, passage.rank)
+                previous.chunk_ids.extend(passage.chunk_ids)
+            else:
+                merged.append(passage)
+        merged.sort(key=lambda passage: passage.rank)
+
+        # Drop passages mostly repeated in a better-ranked one (shared boilerplate, re-uploaded copies)
+        kept = []
+        kept_shingles = []
+        for passage in merged:
+            shingles = _shingles(passage.text)
+            if any(
+                len(shingles & other) >= self.duplicate_threshold * len(shingles)
+                for other in kept_shingles
+            ):
+                continue
+            kept.append(passage)
+            kept_shingles.append(shingles)
+        return kept
+
+    def build(self, hits, token_budget=None):
+        budget = token_budget or self.token_budget
+        parts = []
+        sources = []
+        document_ids = set()
+        used = 0
+        dropped = truncated = 0
+        passages = self.passages(hits)
+        for passage in passages:
+            # Passages are separated by a blank line, about one token
+            remaining = budget - used - (1 if parts else 0)
+            if remaining < self.min_tokens:
+                dropped += 1
+                continue
+            text = f"{page_label(passage.page, passage.page_end)}\n{passage.text}"
+            tokens = self.count_tokens(text)
+            if tokens > remaining:
+                text = self.truncate(text, remaining)
+                tokens = self.count_tokens(text)
+                truncated += 1
+            parts.append(text)
+            used += tokens + (1 if len(parts) > 1 else 0)
+            sources.append({
+                "page": passage.page,
+                "page_end": passage.page_end,
+                "source": passage.source
+            })
+            if passage.document_id:
+                document_ids.add(passage.document_id)
+        return Context("\n\n".join(parts), sources, document_ids, used, dropped, truncated)
@@ -0,0 +1,244 @@
+import os
+
+import numpy as np
+from sqlalchemy import (
+    create_engine, inspect, text, Column, String, Integer, DateTime, Text, Float,
+    Boolean, LargeBinary, Index,
+)
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Database setup
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")
+# Sessions are opened from the DB_WORKERS pool, the background writers and, for the
+# embedding cache, the blocking pool; requests beyond the overflow wait DB_POOL_TIMEOUT
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+if DATABASE_URL.startswith("postgresql"):
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        # Replace connections the server dropped, e.g. after a Postgres restart
+        pool_pre_ping=True,
+        pool_recycle=1800
+    )
+else:
+    # Use SQLite for local testing
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base = declarative_base()
+
+# Database models
+class Document(Base):
+    __tablename__ = "documents"
+
+    id = Column(String, primary_key=True)
+    filename = Column(String, nullable=False, index=True)
+    page_count = Column(Integer, nullable=False)
+    uploaded_at = Column(DateTime, nullable=False, index=True)
+    # sha256 of the uploaded PDF bytes, used to recognise re-uploads of the same file
+    content_hash = Column(String(64), index=True)
+    chunk_count = Column(Integer)
+    # True once the chunks have been written to the vector index
+    indexed = Column(Boolean, default=False)
+    # Vector index namespace holding the chunks; NULL for documents ingested into the shared default namespace
+    vector_namespace = Column(String)
+    # Bumped each time a revised PDF is ingested over the document; NULL for documents from before versioning
+    version = Column(Integer, default=1)
+    # Ingest timings: wall clock for the whole ingest and for extraction,
+    # busy time for the overlapping pipeline stages
+    ingest_ms = Column(Float)
+    extract_ms = Column(Float)
+    ocr_ms = Column(Float)
+    ocr_pages = Column(Integer)
+    split_ms = Column(Float)
+    embed_ms = Column(Float)
+    upsert_ms = Column(Float)
+    db_ms = Column(Float)
+
+class Query(Base):
+    __tablename__ = "queries"
+
+    id = Column(String, primary_key=True)
+    question = Column(Text, nullable=False)
+    answer = Column(Text, nullable=False)
+    latency_ms = Column(Float, nullable=False)
+    created_at = Column(DateTime, nullable=False, index=True)
+    # Document scope the question was asked against and the cited sources (JSON)
+    scope = Column(String)
+    sources = Column(Text)
+    # How the question was answered (benefits, lexical, hybrid, vector, or empty when cached) and stage timings;
+    # persisting the row itself is timed in the ask_stage_seconds metric only
+    retrieval = Column(String)
+    embed_ms = Column(Float)
+    retrieve_ms = Column(Float)
+    prompt_ms = Column(Float)
+    llm_ms = Column(Float)
+
+class PageText(Base):
+    """Extracted (or OCR'd) text of one page, keyed by the PDF's content hash"""
+    __tablename__ = "page_texts"
+
+    content_hash = Column(String(64), primary_key=True)
+    page_num = Column(Integer, primary_key=True)
+    text = Column(Text, nullable=False)
+    ocr = Column(Boolean, default=False)
+    # extraction.page_fingerprints() of the page, to find unchanged pages in a revised PDF
+    page_hash = Column(String(64))
+
+class DocumentChunk(Base):
+    """One indexed chunk; the id doubles as the vector id in the index"""
+    __tablename__ = "document_chunks"
+
+    id = Column(String, primary_key=True)
+    document_id = Column(String, nullable=False, index=True)
+    chunk_index = Column(Integer, nullable=False)
+    page = Column(Integer)  # First page the chunk spans
+    page_end = Column(Integer)
+    text = Column(Text, nullable=False)
+    embedding = Column(LargeBinary)
+    # Document version that wrote the chunk; chunks unchanged by a revision keep theirs
+    version = Column(Integer, default=1)
+
+class LexicalPosting(Base):
+    """Term frequency of one term in one chunk; the persisted form of the BM25 index"""
+    __tablename__ = "lexical_postings"
+
+    term = Column(String, primary_key=True)
+    chunk_id = Column(String, primary_key=True, index=True)
+    document_id = Column(String, nullable=False, index=True)
+    tf = Column(Integer, nullable=False)
+
+class Benefit(Base):
+    """A cost-sharing value extracted at ingest, e.g. the specialist visit copay"""
+    __tablename__ = "benefits"
+    __table_args__ = (Index("ix_benefits_lookup", "category", "benefit_type", "document_id"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    document_id = Column(String, nullable=False, index=True)
+    category = Column(String, nullable=False)  # service category, "general" for plan-wide values
+    benefit_type = Column(String, nullable=False)  # copay, coinsurance, deductible, out_of_pocket_max
+    value = Column(String, nullable=False)
+    network = Column(String)  # in_network, out_of_network, or unstated
+    page = Column(Integer, nullable=False)
+    snippet = Column(Text)  # text the value was read from
+
+class PrewarmedAnswer(Base):
+    """Answer to a common question computed right after a document was ingested, scoped to that document"""
+    __tablename__ = "prewarmed_answers"
+
+    document_id = Column(String, primary_key=True)
+    question = Column(Text, primary_key=True)
+    answer = Column(Text, nullable=False)
+    sources = Column(Text)  # JSON
+    created_at = Column(DateTime, nullable=False)
+
+class EmbeddingCacheEntry(Base):
+    """Persistent tier of the embedding cache, keyed on model + normalized text"""
+    __tablename__ = "embedding_cache"
+
+    key = Column(String(64), primary_key=True)
+    model = Column(String, nullable=False)
+    embedding = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+class IngestJob(Base):
+    """Background ingest job; the uploaded PDF is spooled at file_path until the job finishes"""
+    __tablename__ = "ingest_jobs"
+
+    id = Column(String, primary_key=True)
+    filename = Column(String, nullable=False)
+    file_path = Column(String, nullable=False)
+    # Existing document the upload is a revision of, if any
+    document_id = Column(String)
+    status = Column(String, nullable=False, index=True)  # queued, running, done, failed
+    pages_total = Column(Integer)
+    pages_done = Column(Integer, default=0)
+    chunks_total = Column(Integer)
+    chunks_embedded = Column(Integer, default=0)
+    result = Column(Text)  # IngestResponse JSON once done
+    error = Column(Text)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+class IndexBuild(Base):
+    """A vector and lexical index rebuilt from stored page text by reindex.py, with the settings it was built with"""
+    __tablename__ = "index_builds"
+
+    id = Column(String, primary_key=True)
+    status = Column(String, nullable=False, index=True)  # building, active, retired
+    embedding_model = Column(String, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    chunk_overlap = Column(Integer, nullable=False)
+    vector_backend = Column(String, nullable=False)
+    # Pinecone index name or local index path the vectors are written to
+    vector_target = Column(String, nullable=False)
+    documents_total = Column(Integer, default=0)
+    documents_done = Column(Integer, default=0)
+    chunks = Column(Integer, default=0)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    activated_at = Column(DateTime)
+
+class IndexBuildDocument(Base):
+    """Checkpoint: a document whose chunks are complete in a build, as of the given content hash"""
+    __tablename__ = "index_build_documents"
+
+    build_id = Column(String, primary_key=True)
+    document_id = Column(String, primary_key=True)
+    content_hash = Column(String(64), nullable=False)
+    chunk_count = Column(Integer, nullable=False)
+    built_at = Column(DateTime, nullable=False)
+
+class ReindexChunk(Base):
+    """A chunk of an index build, copied over document_chunks when the build is activated"""
+    __tablename__ = "reindex_chunks"
+
+    build_id = Column(String, primary_key=True)
+    id = Column(String, primary_key=True)
+    document_id = Column(String, nullable=False, index=True)
+    chunk_index = Column(Integer, nullable=False)
+    page = Column(Integer)
+    page_end = Column(Integer)
+    text = Column(Text, nullable=False)
+    embedding = Column(LargeBinary)
+
+class ReindexPosting(Base):
+    """A lexical posting of an index build, copied over lexical_postings when the build is activated"""
+    __tablename__ = "reindex_postings"
+
+    build_id = Column(String, primary_key=True)
+    term = Column(String, primary_key=True)
+    chunk_id = Column(String, primary_key=True)
+    document_id = Column(String, nullable=False, index=True)
+    tf = Column(Integer, nullable=False)
+
+def pack_vector(vector):
+    """Serialize an embedding to float32 bytes for a LargeBinary column"""
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+def unpack_vector(data):
+    return np.frombuffer(data, dtype=np.float32).tolist()
+
+def init_db():
+    """Create tables, plus any columns and indexes added since a table was first created"""
+    Base.metadata.create_all(bind=engine)
+
+    # create_all never alters existing tables, so bring older databases up to date
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                    print(f"Added column {table.name}.{column.name}")
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+
+class Dependency:
+    """A client or resource the app needs but can start without.
+
+    `factory` is never called at import: connect() runs it in a thread from a
+    startup task, retrying with exponential backoff until it succeeds, so the
+    server starts answering (and reporting not ready) straight away and comes
+    up on its own once the dependency does. Until then `value` is None.
+    """
+
+    def __init__(self, name, factory, initial_backoff=1.0, max_backoff=60.0):
+        self.name = name
+        self.factory = factory
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.value = None
+        self.attempts = 0
+        self.last_error = None
+        self.ready_at = None
+
+    @property
+    def ready(self):
+        return self.value is not None
+
+    def set(self, value):
+        """Use an already created value, e.g. a stand-in in the benchmark"""
+        self.value = value
+        self.last_error = None
+        self.ready_at = time.time()
+
+    async def connect(self):
+        delay = self.initial_backoff
+        while self.value is None:
+            self.attempts += 1
+            try:
+                value = await asyncio.to_thread(self.factory)
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Warning: Could not initialize {self.name} (attempt {self.attempts}, retrying in {delay:.0f}s): {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+                continue
+            # set() may have been called while the factory ran
+            if self.value is None:
+                self.set(value)
+        return self.value
+
+    def state(self):
+        return {"ready": self.ready, "attempts": self.attempts, "error": None if self.ready else self.last_error}
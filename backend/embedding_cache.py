@@ -0,0 +1,162 @@
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from database import EmbeddingCacheEntry, pack_vector, unpack_vector
+
+# Keys are looked up in batches to keep the IN (...) clause a sane size
+_DB_BATCH = 500
+
+
+def normalize_text(text):
+    """Collapse whitespace and case so trivially different inputs share an embedding"""
+    return " ".join(unicodedata.normalize("NFKC", text).split()).casefold()
+
+
+class CachedEmbeddings:
+    """Caching wrapper around an embeddings model.
+
+    Lookups go to a bounded in-memory LRU first, then to the embedding_cache
+    table, and only the remaining misses are sent to the wrapped model.
+    `embeddings` may also be a function returning the model, which is then
+    created on the first miss rather than at startup.
+    """
+
+    def __init__(self, embeddings, model, session_factory=None, max_entries=10000):
+        self._embeddings = embeddings
+        self._create_lock = threading.Lock()
+        self.model = model
+        self.session_factory = session_factory
+        self.max_entries = max_entries
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    @property
+    def embeddings(self):
+        if not hasattr(self._embeddings, "embed_documents"):
+            with self._create_lock:
+                if not hasattr(self._embeddings, "embed_documents"):
+                    self._embeddings = self._embeddings()
+        return self._embeddings
+
+    @embeddings.setter
+    def embeddings(self, embeddings):
+        self._embeddings = embeddings
+
+    def for_model(self, model, embeddings):
+        """A cache like this one for another embedding model; `embeddings` as in the constructor.
+
+        This one keeps embedding with its own model, so a caller holding it
+        never mixes vectors of the two models.
+        """
+        return CachedEmbeddings(embeddings, model, session_factory=self.session_factory, max_entries=self.max_entries)
+
+    def cache_key(self, text):
+        return hashlib.sha256(f"{self.model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def _load(self, keys):
+        if not self.session_factory or not keys:
+            return {}
+        found = {}
+        db = self.session_factory()
+        try:
+            for start in range(0, len(keys), _DB_BATCH):
+                rows = db.query(EmbeddingCacheEntry).filter(
+                    EmbeddingCacheEntry.key.in_(keys[start:start + _DB_BATCH])
+                ).all()
+                found.update({row.key: unpack_vector(row.embedding) for row in rows})
+        finally:
+            db.close()
+        return found
+
+    def _store(self, entries):
+        if not self.session_factory or not entries:
+            return
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            for key, vector in entries.items():
+                db.merge(EmbeddingCacheEntry(key=key, model=self.model, embedding=pack_vector(vector), created_at=now))
+            db.commit()
+        except IntegrityError:
+            # Another request stored the same text first; the cache write is best effort
+            db.rollback()
+        finally:
+            db.close()
+
+    def embed_documents(self, texts):
+        keys = [self.cache_key(text) for text in texts]
+        vectors = {}
+        with self._lock:
+            for key in keys:
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    vectors[key] = self._lru[key]
+        self.memory_hits += sum(1 for key in keys if key in vectors)
+
+        stored = self._load([key for key in dict.fromkeys(keys) if key not in vectors])
+        for key, vector in stored.items():
+            self._remember(key, vector)
+        vectors.update(stored)
+        self.db_hits += sum(1 for key in keys if key in stored)
+
+        # Embed each distinct missing text once
+        pending = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in pending:
+                pending[key] = text
+        if pending:
+            self.misses += len(pending)
+            new_vectors = dict(zip(pending, self.embeddings.embed_documents(list(pending.values()))))
+            for key, vector in new_vectors.items():
+                self._remember(key, vector)
+            self._store(new_vectors)
+            vectors.update(new_vectors)
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text):
+        key = self.cache_key(text)
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.memory_hits += 1
+                return self._lru[key]
+
+        stored = self._load([key])
+        if key in stored:
+            self.db_hits += 1
+            self._remember(key, stored[key])
+            return stored[key]
+
+        self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self._remember(key, vector)
+        self._store({key: vector})
+        return vector
+
+    def stats(self):
+        lookups = self.memory_hits + self.db_hits + self.misses
+        return {
+            "model": self.model,
+            "entries_in_memory": len(self._lru),
+            "max_entries": self.max_entries,
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.db_hits) / lookups if lookups else 0.0,
+        }
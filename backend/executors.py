@@ -0,0 +1,33 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Blocking client calls (embeddings, vector search, PDF parsing) run here so the event loop stays free
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "32"))
+# Database work gets its own pool, sized to the connection pool, so it never queues behind slow API calls
+DB_WORKERS = int(os.getenv("DB_WORKERS", "5"))
+
+blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking call on the bounded blocking executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, functools.partial(fn, *args, **kwargs))
+
+
+async def run_db(fn, *args, **kwargs):
+    """Run a synchronous SQLAlchemy call on the database executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(fn, *args, **kwargs))
+
+
+def shutdown_executors():
+    blocking_executor.shutdown(wait=False, cancel_futures=True)
+    db_executor.shutdown(wait=True)
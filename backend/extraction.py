@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import fitz
+from dotenv import load_dotenv
+
+from benefits import BenefitRow, extract_benefits, mentions_benefits
+from ocr import ocr_page
+
+load_dotenv()
+
+
+def _available_cores():
+    """Number of cores this process may run on (respects container CPU affinity)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# EXTRACT_WORKERS=0 (the default) sizes the pool to the available cores,
+# EXTRACT_WORKERS=1 keeps extraction in a single background thread
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "0")) or _available_cores()
+# Pages per task sent to a worker; small batches keep OCR-heavy pages balanced
+EXTRACT_BATCH_PAGES = int(os.getenv("EXTRACT_BATCH_PAGES", "4"))
+# Read copays, deductibles etc. out of each page for the benefits table
+EXTRACT_BENEFITS = os.getenv("EXTRACT_BENEFITS", "true").lower() == "true"
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+@dataclass
+class PageResult:
+    page_num: int
+    text: str
+    elapsed_ms: float
+    ocr: bool
+    ocr_ms: float = 0.0
+    benefits: List[BenefitRow] = field(default_factory=list)
+
+
+def extract_text_from_page(page, page_num):
+    """Extract text from a PDF page, with Tesseract OCR for scanned pages and for images on mixed pages.
+
+    Returns the text, whether OCR was used, the time spent on OCR in ms, and
+    the part of the text that came from OCR.
+    """
+    # Try PyMuPDF text extraction first
+    text = page.get_text("text").strip()
+    has_text = bool(text)
+
+    try:
+        ocr_text, ocr_ms = ocr_page(page, has_text)
+    except Exception as e:
+        print(f"Tesseract OCR failed for page {page_num + 1}: {e}")
+        ocr_text, ocr_ms = ("" if has_text else f"[Page {page_num + 1} - OCR failed]"), 0.0
+
+    if not has_text:
+        if ocr_text and ocr_ms:
+            print(f"Used Tesseract fallback for page {page_num + 1}")
+        return ocr_text, True, ocr_ms, ocr_text
+    if ocr_text:
+        print(f"OCR'd image regions on page {page_num + 1}")
+        text = f"{text}\n\n{ocr_text}"
+    return text, bool(ocr_text), ocr_ms, ocr_text
+
+
+def page_benefits(page, text, ocr_text=""):
+    """Benefit values stated in the page's tables and text blocks"""
+    # Table detection is the slow part, so only pages that mention a benefit get it
+    if not mentions_benefits(text):
+        return []
+    if text == ocr_text:
+        # Scanned page: there is no text layer to find blocks or tables in
+        return extract_benefits([text])
+    blocks = [block[4] for block in page.get_text("blocks") if block[6] == 0]
+    if ocr_text:
+        blocks.append(ocr_text)
+    tables = []
+    try:
+        tables = [table.extract() for table in page.find_tables().tables]
+    except Exception as e:
+        print(f"Table detection failed for page {page.number + 1}: {e}")
+    return extract_benefits(blocks, tables)
+
+
+def page_fingerprints(path):
+    """sha256 per page of what the page draws: its size, content streams, form XObjects and images.
+
+    Computed without extracting text or rendering, so comparing a revised PDF
+    with the previous one is cheap. Pages that were not edited keep their
+    fingerprint even if other pages were added, removed or reordered. This
+    only decides which pages are extracted again; chunks are matched by text.
+    """
+    fingerprints = []
+    with fitz.open(path) as doc:
+        for page in doc:
+            digest = hashlib.sha256()
+            digest.update(repr(tuple(page.rect)).encode())
+            digest.update(page.read_contents())
+            for xobject in page.get_xobjects():
+                digest.update(doc.xref_stream_raw(xobject[0]) or b"")
+            # Scanned pages all draw "an image"; what differs is the image itself
+            for image in page.get_images(full=True):
+                digest.update(doc.xref_stream_raw(image[0]) or b"")
+            fingerprints.append(digest.hexdigest())
+    return fingerprints
+
+
+def extract_page_batch(path, page_nums):
+    """Extract the given pages of the PDF at `path`. Runs inside a pool worker."""
+    results = []
+    doc = fitz.open(path)
+    try:
+        for page_num in page_nums:
+            page_start = time.perf_counter()
+            page = doc.load_page(page_num)
+            text, used_ocr, ocr_ms, ocr_text = extract_text_from_page(page, page_num)
+            benefits = page_benefits(page, text, ocr_text) if EXTRACT_BENEFITS else []
+            results.append(PageResult(
+                page_num=page_num,
+                text=text,
+                elapsed_ms=(time.perf_counter() - page_start) * 1000,
+                ocr=used_ocr,
+                ocr_ms=ocr_ms,
+                benefits=benefits,
+            ))
+    finally:
+        doc.close()
+    return results
+
+
+def get_pool():
+    """Lazily create the shared extraction process pool"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS)
+        print(f"Started PDF extraction pool with {EXTRACT_WORKERS} workers")
+    return _pool
+
+
+def start_pool():
+    """Start the worker processes up front, before the server spins up request threads"""
+    if EXTRACT_WORKERS > 1:
+        get_pool().submit(os.getpid).result()
+
+
+def pool_started():
+    return EXTRACT_WORKERS <= 1 or _pool is not None
+
+
+def _replace_pool(broken):
+    """Drop a pool that a dead worker broke, so the next get_pool() starts a new one"""
+    global _pool
+    if _pool is broken:
+        _pool = None
+        broken.shutdown(wait=False, cancel_futures=True)
+        print("PDF extraction pool broke (a worker died); starting a new one")
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def iter_extracted_pages(path, page_nums, lookahead=None):
+    """Yield extracted pages of the PDF at `path` in page order.
+
+    Pages are extracted in batches of EXTRACT_BATCH_PAGES on the worker pool,
+    with at most `lookahead` batches in flight ahead of the consumer, so a slow
+    consumer holds back extraction instead of letting results pile up.
+
+    A worker that dies (killed for memory, or crashed in MuPDF or Tesseract)
+    breaks the whole pool; it is replaced, and the pages not yielded yet are
+    extracted again once before giving up on the document.
+    """
+    page_nums = sorted(page_nums)
+    if not page_nums:
+        return
+    loop = asyncio.get_running_loop()
+    executor = get_pool() if EXTRACT_WORKERS > 1 else None
+    lookahead = lookahead or max(2, EXTRACT_WORKERS * 2)
+    batches = [page_nums[start:start + EXTRACT_BATCH_PAGES] for start in range(0, len(page_nums), EXTRACT_BATCH_PAGES)]
+
+    # (batch index, future) of the batches submitted and not yielded yet
+    in_flight = deque()
+    next_batch = 0
+    retried = False
+    try:
+        while in_flight or next_batch < len(batches):
+            try:
+                while next_batch < len(batches) and len(in_flight) < lookahead:
+                    future = loop.run_in_executor(executor, extract_page_batch, path, batches[next_batch])
+                    in_flight.append((next_batch, future))
+                    next_batch += 1
+                results = await in_flight[0][1]
+            except BrokenProcessPool:
+                # Without a new pool every later ingest would fail the same way
+                _replace_pool(executor)
+                if retried:
+                    raise
+                retried = True
+                executor = get_pool()
+                next_batch = in_flight[0][0] if in_flight else next_batch
+                in_flight.clear()
+                continue
+            in_flight.popleft()
+            for result in results:
+                yield result
+    finally:
+        for _, future in in_flight:
+            future.cancel()
@@ -0,0 +1,84 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from chunking import CHUNK_OVERLAP, CHUNK_SIZE
+from database import IndexBuild
+from vectorstores import LocalVectorStore, PineconeVectorStore
+
+load_dotenv()
+
+# Embedding model of the index ingest builds, until reindex.py activates one built with another
+DEFAULT_EMBEDDING_MODEL = "text-embedding-3-small"
+# Vector store backend: "pinecone" (default) or "local" for the in-process NumPy index
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone").lower()
+
+# Index build states
+BUILDING = "building"
+ACTIVE = "active"
+RETIRED = "retired"
+
+
+def default_target(backend):
+    """Pinecone index name or local index path configured for `backend`"""
+    if backend == "local":
+        return os.getenv("LOCAL_INDEX_PATH", "./vector_index")
+    return os.getenv("PINECONE_INDEX_NAME", "docsage-lite")
+
+
+@dataclass
+class IndexSettings:
+    """How the served index was built: embedding model, chunking and where its vectors live.
+
+    build_id is None for the index built under the defaults by ingest alone.
+    """
+    embedding_model: str
+    chunk_size: int
+    chunk_overlap: int
+    vector_backend: str
+    vector_target: str
+    build_id: Optional[str] = None
+
+    @classmethod
+    def default(cls):
+        return cls(DEFAULT_EMBEDDING_MODEL, CHUNK_SIZE, CHUNK_OVERLAP, VECTOR_BACKEND, default_target(VECTOR_BACKEND))
+
+    @classmethod
+    def from_build(cls, build):
+        return cls(
+            build.embedding_model, build.chunk_size, build.chunk_overlap, build.vector_backend, build.vector_target,
+            build.id
+        )
+
+
+def active_settings(session_factory):
+    """Settings of the active index build, or the defaults if no build was ever activated"""
+    db = session_factory()
+    try:
+        build = db.query(IndexBuild).filter(IndexBuild.status == ACTIVE).first()
+    finally:
+        db.close()
+    return IndexSettings.from_build(build) if build else IndexSettings.default()
+
+
+def open_vector_store(backend, target):
+    """Open the vector store `backend` at `target`; Pinecone indexes must already exist"""
+    if backend == "local":
+        vectorstore = LocalVectorStore(
+            target,
+            dtype=os.getenv("LOCAL_INDEX_DTYPE", "float32"),
+            ivf_lists=int(os.getenv("LOCAL_INDEX_IVF_LISTS", "0")),
+            nprobe=int(os.getenv("LOCAL_INDEX_NPROBE", "8"))
+        )
+        print(f"✅ Using local vector index at {target} ({vectorstore.count()} vectors)")
+        return vectorstore
+
+    from pinecone import Pinecone
+    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    # Creating indexes requires configuration specific to your plan, so it is left to the dashboard
+    if target not in pc.list_indexes().names():
+        raise RuntimeError(f"Pinecone index '{target}' does not exist; create it in your Pinecone dashboard")
+    print(f"✅ Successfully initialized Pinecone vectorstore with index: {target}")
+    return PineconeVectorStore(pc.Index(target))
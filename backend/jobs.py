@@ -0,0 +1,183 @@
+import asyncio
+import json
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from database import IngestJob
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class IngestJobQueue:
+    """Runs ingest jobs on a bounded pool of asyncio workers.
+
+    Job state lives in the ingest_jobs table and uploads are spooled to disk,
+    so jobs that were queued or running when the process stopped are picked up
+    again by start(). `runner(pdf_path, filename, progress, document_id=...)`
+    does the actual ingest and returns a pydantic model; `progress(**fields)`
+    updates the job row.
+
+    Row updates go through a single writer thread: progress can be reported
+    from the event loop or from worker threads without blocking either, and
+    the updates land in the order they were made.
+    """
+
+    def __init__(self, runner, session_factory, spool_dir, workers=2, max_queued=100):
+        self.runner = runner
+        self.session_factory = session_factory
+        self.spool_dir = spool_dir
+        self.workers = workers
+        self.max_queued = max_queued
+        self._queue = None
+        self._tasks = []
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-jobs")
+
+    def _update(self, job_id, **fields):
+        db = self.session_factory()
+        try:
+            job = db.get(IngestJob, job_id)
+            if job is None:
+                return
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.updated_at = datetime.utcnow()
+            db.commit()
+        finally:
+            db.close()
+
+    def _recover(self):
+        """Requeue jobs interrupted by a restart; fail those whose upload is gone"""
+        db = self.session_factory()
+        try:
+            jobs = (
+                db.query(IngestJob)
+                .filter(IngestJob.status.in_([QUEUED, RUNNING]))
+                .order_by(IngestJob.created_at)
+                .all()
+            )
+            pending = []
+            for job in jobs:
+                if os.path.exists(job.file_path):
+                    job.status = QUEUED
+                    pending.append(job.id)
+                else:
+                    job.status = FAILED
+                    job.error = "Upload was lost before the job could run"
+                job.updated_at = datetime.utcnow()
+            db.commit()
+            return pending
+        finally:
+            db.close()
+
+    async def _write(self, job_id, **fields):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._writer, lambda: self._update(job_id, **fields))
+
+    @property
+    def running(self):
+        return self._queue is not None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        os.makedirs(self.spool_dir, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        pending = await loop.run_in_executor(self._writer, self._recover)
+        for job_id in pending:
+            self._queue.put_nowait(job_id)
+        if pending:
+            print(f"Resuming {len(pending)} interrupted ingest jobs")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._writer.shutdown(wait=True)
+
+    def _create(self, job_id, filename, upload_path, document_id):
+        """Move the upload into the spool directory and insert the job row"""
+        file_path = os.path.join(self.spool_dir, f"{job_id}.pdf")
+        shutil.move(upload_path, file_path)
+
+        now = datetime.utcnow()
+        db = self.session_factory()
+        try:
+            db.add(IngestJob(
+                id=job_id,
+                filename=filename,
+                file_path=file_path,
+                document_id=document_id,
+                status=QUEUED,
+                created_at=now,
+                updated_at=now,
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+    async def submit(self, filename, upload_path, document_id=None):
+        """Queue a job for an upload already spooled to `upload_path`, returns the job id.
+
+        With `document_id` the upload is ingested as a revision of that document.
+        """
+        if self._queue.qsize() >= self.max_queued:
+            raise QueueFullError(f"Ingest queue is full ({self.max_queued} jobs waiting)")
+
+        job_id = str(uuid.uuid4())
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._writer, self._create, job_id, filename, upload_path, document_id)
+        # Queued from the event loop itself: asyncio.Queue is not thread-safe, and a put
+        # from another thread may never wake the worker waiting on it
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    def get(self, job_id):
+        db = self.session_factory()
+        try:
+            return db.get(IngestJob, job_id)
+        finally:
+            db.close()
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id):
+        loop = asyncio.get_running_loop()
+        job = await loop.run_in_executor(self._writer, self.get, job_id)
+        if job is None or job.status != QUEUED:
+            return
+        await self._write(job_id, status=RUNNING)
+
+        def progress(**fields):
+            self._writer.submit(self._update, job_id, **fields)
+
+        try:
+            result = await self.runner(job.file_path, job.filename, progress, document_id=job.document_id)
+            await self._write(job_id, status=DONE, result=json.dumps(result.model_dump()))
+        except asyncio.CancelledError:
+            # Shutting down; the job stays "running" and is requeued on the next start
+            raise
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            print(f"Ingest job {job_id} failed: {detail}")
+            await self._write(job_id, status=FAILED, error=detail)
+
+        # Finished either way, so the spooled upload is no longer needed
+        os.remove(job.file_path)
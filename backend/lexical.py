@@ -0,0 +1,232 @@
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from database import Document, DocumentChunk, LexicalPosting
+from vectorstores import SearchResult
+
+# Ids are fetched in batches to keep the IN (...) clause a sane size
+_DB_BATCH = 500
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# Words that carry no meaning for matching a policy passage
+STOPWORDS = frozenset("""
+a about all am an and any are as at be been but by can do does for from had has
+have how i if in is it its me my no not of on or our so than that the their them
+then there these they this to under up was we were what when where which who
+will with would you your
+""".split())
+
+
+def tokenize(text):
+    """Lowercased alphanumeric terms without stopwords; procedure codes like 99213 are kept"""
+    return [
+        token for token in _TOKEN.findall(text.lower())
+        if token not in STOPWORDS and (len(token) > 1 or token.isdigit())
+    ]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked id lists: each id scores sum(1 / (k + rank)) over the lists it appears in"""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] += 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class LexicalIndex:
+    """In-memory BM25 index over chunk text, persisted as rows in lexical_postings.
+
+    The postings are loaded once by load() and kept up to date by add_chunks()
+    and remove_chunks() during ingest, so searching never touches the
+    database; fetch() reads the text and metadata of the winning chunks.
+    Postings are kept per document, so a search scoped to some documents
+    only visits theirs, while document frequencies stay corpus-wide.
+    """
+
+    def __init__(self, session_factory, k1=1.2, b=0.75):
+        self.session_factory = session_factory
+        self.k1 = k1
+        self.b = b
+        # document id -> term -> {chunk id: term frequency}
+        self._postings = defaultdict(lambda: defaultdict(dict))
+        # term -> number of chunks containing it, across all documents
+        self._df = Counter()
+        # chunk id -> number of indexed terms
+        self._lengths = {}
+        # chunk id -> document id
+        self._documents = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def load(self):
+        db = self.session_factory()
+        try:
+            rows = db.query(
+                LexicalPosting.term, LexicalPosting.chunk_id, LexicalPosting.document_id, LexicalPosting.tf
+            ).yield_per(10000)
+            with self._lock:
+                self._postings.clear()
+                self._df.clear()
+                self._lengths.clear()
+                self._documents.clear()
+                for term, chunk_id, document_id, tf in rows:
+                    self._postings[document_id][term][chunk_id] = tf
+                    self._df[term] += 1
+                    self._lengths[chunk_id] = self._lengths.get(chunk_id, 0) + tf
+                    self._documents[chunk_id] = document_id
+                self._total_length = sum(self._lengths.values())
+        finally:
+            db.close()
+        self.loaded = True
+        return len(self._lengths)
+
+    def _remove(self, chunk_id, terms):
+        document_id = self._documents.pop(chunk_id, None)
+        document = self._postings.get(document_id)
+        if document is not None:
+            for term in terms:
+                postings = document.get(term)
+                if postings is not None and postings.pop(chunk_id, None) is not None:
+                    self._df[term] -= 1
+                    if not self._df[term]:
+                        del self._df[term]
+                    if not postings:
+                        del document[term]
+            if not document:
+                del self._postings[document_id]
+        self._total_length -= self._lengths.pop(chunk_id, 0)
+
+    def add_chunks(self, document_id, chunk_ids, texts):
+        """Index (or re-index) chunks and persist their postings"""
+        counts = {chunk_id: Counter(tokenize(text)) for chunk_id, text in zip(chunk_ids, texts)}
+        db = self.session_factory()
+        try:
+            previous = defaultdict(set)
+            for start in range(0, len(chunk_ids), _DB_BATCH):
+                batch = chunk_ids[start:start + _DB_BATCH]
+                for term, chunk_id in (
+                    db.query(LexicalPosting.term, LexicalPosting.chunk_id)
+                    .filter(LexicalPosting.chunk_id.in_(batch))
+                ):
+                    previous[chunk_id].add(term)
+                db.query(LexicalPosting).filter(LexicalPosting.chunk_id.in_(batch)).delete(synchronize_session=False)
+            db.add_all([
+                LexicalPosting(term=term, chunk_id=chunk_id, document_id=document_id, tf=tf)
+                for chunk_id, terms in counts.items()
+                for term, tf in terms.items()
+            ])
+            db.commit()
+        finally:
+            db.close()
+
+        with self._lock:
+            for chunk_id, terms in counts.items():
+                self._remove(chunk_id, previous[chunk_id] | set(terms))
+                for term, tf in terms.items():
+                    self._postings[document_id][term][chunk_id] = tf
+                    self._df[term] += 1
+                self._lengths[chunk_id] = sum(terms.values())
+                self._total_length += self._lengths[chunk_id]
+                self._documents[chunk_id] = document_id
+
+    def remove_chunks(self, chunk_ids):
+        """Drop chunks from the index and delete their postings"""
+        previous = defaultdict(set)
+        db = self.session_factory()
+        try:
+            for start in range(0, len(chunk_ids), _DB_BATCH):
+                batch = chunk_ids[start:start + _DB_BATCH]
+                for term, chunk_id in (
+                    db.query(LexicalPosting.term, LexicalPosting.chunk_id)
+                    .filter(LexicalPosting.chunk_id.in_(batch))
+                ):
+                    previous[chunk_id].add(term)
+                db.query(LexicalPosting).filter(LexicalPosting.chunk_id.in_(batch)).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+        with self._lock:
+            for chunk_id in chunk_ids:
+                self._remove(chunk_id, previous[chunk_id])
+
+    def search(self, query, k=4, document_ids=None):
+        """Top `k` chunks by BM25 as (chunk id, score, fraction of query terms matched).
+
+        With `document_ids`, only the postings of those documents are visited;
+        term statistics stay corpus-wide.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        # Only the query terms' postings in the documents searched are copied under the lock; scoring runs
+        # outside it, so ingest and other searches don't wait for this one
+        with self._lock:
+            total = len(self._lengths)
+            if not total:
+                return []
+            average_length = self._total_length / total
+            if document_ids:
+                documents = [self._postings[id_] for id_ in set(document_ids) if id_ in self._postings]
+            else:
+                documents = list(self._postings.values())
+            lengths = {}
+            postings_by_term = []
+            for term in terms:
+                postings = [dict(document[term]) for document in documents if term in document]
+                for chunk_postings in postings:
+                    lengths.update((chunk_id, self._lengths[chunk_id]) for chunk_id in chunk_postings)
+                postings_by_term.append((self._df[term], postings))
+
+        scores = defaultdict(float)
+        matched = Counter()
+        for df, postings in postings_by_term:
+            if not postings:
+                continue
+            idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+            for chunk_postings in postings:
+                for chunk_id, tf in chunk_postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * lengths[chunk_id] / average_length)
+                    scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+                    matched[chunk_id] += 1
+        best = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [(chunk_id, scores[chunk_id], matched[chunk_id] / len(terms)) for chunk_id in best]
+
+    def fetch(self, chunk_ids):
+        """SearchResults for `chunk_ids`, in the same order, with the metadata the vector index stores"""
+        db = self.session_factory()
+        try:
+            rows = (
+                db.query(DocumentChunk, Document.filename)
+                .outerjoin(Document, Document.id == DocumentChunk.document_id)
+                .filter(DocumentChunk.id.in_(chunk_ids))
+                .all()
+            )
+        finally:
+            db.close()
+        found = {
+            chunk.id: SearchResult(
+                id=chunk.id,
+                score=0.0,
+                text=chunk.text,
+                metadata={
+                    "source": filename or "Unknown",
+                    "page": chunk.page,
+                    "page_end": chunk.page_end,
+                    "document_id": chunk.document_id,
+                },
+            )
+            for chunk, filename in rows
+        }
+        return [found[chunk_id] for chunk_id in chunk_ids if chunk_id in found]
+
+    def stats(self):
+        return {"chunks": len(self._lengths), "terms": len(self._df)}
@@ -0,0 +1,99 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+
+_ASK_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_INGEST_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+_PAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+ASK_REQUESTS = Counter(
+    "ask_requests_total", "Questions answered", ["endpoint", "retrieval", "cached"]
+)
+ASK_ERRORS = Counter("ask_errors_total", "Questions that failed", ["endpoint"])
+ASK_LATENCY = Histogram(
+    "ask_latency_seconds", "End-to-end question latency", ["endpoint", "retrieval"], buckets=_ASK_BUCKETS
+)
+ASK_STAGE = Histogram(
+    "ask_stage_seconds", "Time per question spent in each stage", ["endpoint", "stage"], buckets=_ASK_BUCKETS
+)
+INGEST_DOCUMENTS = Counter("ingest_documents_total", "Documents ingested", ["cached"])
+INGEST_ERRORS = Counter("ingest_errors_total", "Ingests that failed")
+INGEST_PAGES = Counter("ingest_pages_total", "Pages extracted", ["ocr"])
+INGEST_CHUNKS = Counter("ingest_chunks_total", "Chunks indexed")
+INGEST_LATENCY = Histogram("ingest_latency_seconds", "End-to-end ingest latency", buckets=_INGEST_BUCKETS)
+INGEST_STAGE = Histogram(
+    "ingest_stage_seconds", "Time per document spent in each ingest stage", ["stage"], buckets=_INGEST_BUCKETS
+)
+PAGE_EXTRACT = Histogram(
+    "ingest_page_seconds", "Extraction time per page", ["ocr"], buckets=_PAGE_BUCKETS
+)
+ASK_CONTEXT_TOKENS = Histogram(
+    "ask_context_tokens", "Prompt context size after merging and trimming retrieved chunks",
+    buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000)
+)
+AUDIT_PENDING = Gauge("audit_rows_pending", "Rows queued by the write-behind audit writer")
+AUDIT_WRITTEN = Counter("audit_rows_written_total", "Rows written by the audit writer", ["table"])
+AUDIT_DROPPED = Counter("audit_rows_dropped_total", "Rows the audit writer gave up on", ["table"])
+ADMISSION_IN_FLIGHT = Gauge("admission_in_flight", "Upstream calls holding an admission slot", ["limiter"])
+ADMISSION_QUEUED = Gauge("admission_queued", "Upstream calls waiting for an admission slot", ["limiter"])
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total", "Upstream calls turned away by admission control", ["limiter", "reason"]
+)
+ASK_COALESCED = Counter("ask_coalesced_total", "Questions answered by an identical question already in flight")
+ANSWERS_PREWARMED = Counter(
+    "answers_prewarmed_total", "Common questions answered ahead of time for newly ingested documents", ["outcome"]
+)
+
+
+class StageTimer:
+    """Wall time per named stage in milliseconds; a stage entered more than once accumulates.
+
+    Ingest stages overlap in the pipeline, so their times are busy time per
+    stage and can add up to more than the total.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name, elapsed_ms):
+        self.stages[name] = self.stages.get(name, 0.0) + elapsed_ms
+
+    def get(self, name):
+        return self.stages.get(name)
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def as_dict(self):
+        return {f"{name}_ms": elapsed_ms for name, elapsed_ms in self.stages.items()}
+
+
+def observe_ask(endpoint, timer, retrieval=None, cached=False):
+    retrieval = retrieval or ("cache" if cached else "none")
+    ASK_REQUESTS.labels(endpoint, retrieval, str(cached).lower()).inc()
+    ASK_LATENCY.labels(endpoint, retrieval).observe(timer.elapsed_ms() / 1000)
+    for stage, elapsed_ms in timer.stages.items():
+        ASK_STAGE.labels(endpoint, stage).observe(elapsed_ms / 1000)
+
+
+def observe_ingest(timer, chunks, cached=False):
+    INGEST_DOCUMENTS.labels(str(cached).lower()).inc()
+    INGEST_CHUNKS.inc(chunks)
+    INGEST_LATENCY.observe(timer.elapsed_ms() / 1000)
+    for stage, elapsed_ms in timer.stages.items():
+        INGEST_STAGE.labels(stage).observe(elapsed_ms / 1000)
+
+
+def observe_page(elapsed_ms, ocr):
+    INGEST_PAGES.labels(str(ocr).lower()).inc()
+    PAGE_EXTRACT.labels(str(ocr).lower()).observe(elapsed_ms / 1000)
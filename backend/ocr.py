@@ -0,0 +1,105 @@
+import math
+import os
+import threading
+import time
+
+import fitz
+import pytesseract
+from PIL import Image
+from dotenv import load_dotenv
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+load_dotenv()
+
+# "auto" uses tesserocr when it is installed, else pytesseract
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto").lower()
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+# Pages are rendered at whatever DPI gives about OCR_TARGET_PIXELS, within these bounds
+OCR_TARGET_PIXELS = int(os.getenv("OCR_TARGET_PIXELS", "4000000"))
+OCR_MIN_DPI = int(os.getenv("OCR_MIN_DPI", "150"))
+OCR_MAX_DPI = int(os.getenv("OCR_MAX_DPI", "300"))
+# Pages with a text layer also get their images OCR'd, if an image covers this fraction of the page
+OCR_IMAGE_REGIONS = os.getenv("OCR_IMAGE_REGIONS", "true").lower() == "true"
+OCR_MIN_REGION_FRACTION = float(os.getenv("OCR_MIN_REGION_FRACTION", "0.05"))
+
+pytesseract.pytesseract.tesseract_cmd = os.getenv("TESSERACT_CMD", "/usr/bin/tesseract")
+
+# One Tesseract instance per thread (extraction workers are single-threaded, but EXTRACT_WORKERS=1 uses a thread)
+_local = threading.local()
+
+
+def ocr_dpi(rect):
+    """Render resolution for a region: about OCR_TARGET_PIXELS, so small pages get more detail and big ones less"""
+    area_in2 = max(rect.width * rect.height / (72 * 72), 1e-6)
+    dpi = math.sqrt(OCR_TARGET_PIXELS / area_in2)
+    return int(min(max(dpi, OCR_MIN_DPI), OCR_MAX_DPI))
+
+
+def _tesseract_api():
+    api = getattr(_local, "api", None)
+    if api is None:
+        api = tesserocr.PyTessBaseAPI(lang=OCR_LANG)
+        _local.api = api
+    return api
+
+
+def _use_tesserocr():
+    return tesserocr is not None and OCR_ENGINE in ("auto", "tesserocr")
+
+
+def engine():
+    """Name of the engine recognize() uses"""
+    return "tesserocr" if _use_tesserocr() else "pytesseract"
+
+
+def recognize(pix, dpi):
+    """Text in a single-channel pixmap, passed to Tesseract as raw grayscale samples"""
+    if _use_tesserocr():
+        # The long-lived API skips starting a process and loading the language data for every page
+        api = _tesseract_api()
+        api.SetImageBytes(pix.samples, pix.width, pix.height, 1, pix.stride)
+        api.SetSourceResolution(dpi)
+        return api.GetUTF8Text().strip()
+    image = Image.frombuffer("L", (pix.width, pix.height), pix.samples_mv, "raw", "L", pix.stride, 1)
+    return pytesseract.image_to_string(image, lang=OCR_LANG, config=f"--dpi {dpi}").strip()
+
+
+def ocr_region(page, rect):
+    dpi = ocr_dpi(rect)
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False, clip=rect)
+    return recognize(pix, dpi)
+
+
+def image_regions(page):
+    """Rectangles of the page's images large enough to be worth OCR, that have no text layer of their own"""
+    page_area = abs(page.rect)
+    regions = []
+    for info in page.get_image_info():
+        rect = fitz.Rect(info["bbox"]) & page.rect
+        if rect.is_empty or abs(rect) < OCR_MIN_REGION_FRACTION * page_area:
+            continue
+        # Background images under real text are already covered by the text layer
+        if page.get_text("text", clip=rect).strip():
+            continue
+        if not any(rect.intersects(other) for other in regions):
+            regions.append(rect)
+    return regions
+
+
+def ocr_page(page, has_text):
+    """(OCR text, milliseconds spent) for a page: the whole page if it has no text, else its image regions"""
+    start = time.perf_counter()
+    if not has_text:
+        text = ocr_region(page, page.rect)
+    elif OCR_IMAGE_REGIONS:
+        regions = image_regions(page)
+        if not regions:
+            return "", 0.0
+        text = "\n\n".join(filter(None, (ocr_region(page, rect) for rect in regions)))
+    else:
+        return "", 0.0
+    return text, (time.perf_counter() - start) * 1000
@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+"""Rebuild the vector and lexical indexes from stored page text.
+
+Switching the embedding model or the chunking settings doesn't need the PDFs
+again: ingest keeps every page's text in page_texts, so a new index can be
+built next to the one being served and switched to once it is complete.
+
+Usage:
+    python reindex.py build --embedding-model text-embedding-3-large --pinecone-index docsage-large
+    python reindex.py build --chunk-size 800 --chunk-overlap 150 --local-path ./vector_index_800
+    python reindex.py status
+    python reindex.py activate <build id>
+
+Documents are rebuilt in rounds: their chunks are embedded in large batches
+with --concurrency requests in flight, upserted into the new vector index
+under the namespaces and ids ingest uses, and then the chunks, their lexical
+postings and a checkpoint per document are committed in one transaction. An
+interrupted build resumes after the last committed round when `build` is run
+again with the same settings (or with --build-id).
+
+`activate` first catches up on documents ingested or revised since they were
+built, then switches over in one transaction: document_chunks and
+lexical_postings are replaced with the build's rows and the build becomes the
+active one. The API notices within INDEX_CHECK_SECONDS and moves to the new
+vector index, embedding model and chunking; the previous index is left as it
+was. An ingest still running at that moment fails with a 503 and has to be
+submitted again.
+"""
+import argparse
+import sys
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import func, insert, literal, select, update
+
+from chunking import CHUNK_OVERLAP, CHUNK_SIZE, StreamingChunker
+from database import (
+    SessionLocal, Document, PageText, DocumentChunk, LexicalPosting, IndexBuild, IndexBuildDocument, ReindexChunk,
+    ReindexPosting, init_db, pack_vector,
+)
+from indexes import (
+    ACTIVE, BUILDING, DEFAULT_EMBEDDING_MODEL, RETIRED, IndexSettings, active_settings, default_target, open_vector_store,
+)
+from lexical import tokenize
+
+# Rows per bulk insert / IN (...) clause
+_DB_BATCH = 500
+# Catch-up rounds activate runs before giving up on documents that keep changing
+ACTIVATE_ATTEMPTS = 5
+
+
+def create_embeddings(model, batch_size):
+    # langchain_openai is slow to import, so it is only loaded by commands that embed
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(model=model, chunk_size=batch_size)
+
+
+def find_build(db, settings):
+    """The unfinished build with these settings, if any"""
+    return (
+        db.query(IndexBuild)
+        .filter(
+            IndexBuild.status == BUILDING,
+            IndexBuild.embedding_model == settings.embedding_model,
+            IndexBuild.chunk_size == settings.chunk_size,
+            IndexBuild.chunk_overlap == settings.chunk_overlap,
+            IndexBuild.vector_backend == settings.vector_backend,
+            IndexBuild.vector_target == settings.vector_target,
+        )
+        .first()
+    )
+
+
+def document_state(db, build_id):
+    """(documents still to build, documents whose page text is incomplete and can't be rebuilt)"""
+    built = dict(
+        db.query(IndexBuildDocument.document_id, IndexBuildDocument.content_hash)
+        .filter(IndexBuildDocument.build_id == build_id)
+    )
+    stored = dict(db.query(PageText.content_hash, func.count()).group_by(PageText.content_hash))
+    pending, missing = [], []
+    for document in db.query(Document.id, Document.filename, Document.content_hash, Document.page_count).order_by(
+        Document.uploaded_at
+    ):
+        if document.content_hash and built.get(document.id) == document.content_hash:
+            continue
+        if not document.content_hash or stored.get(document.content_hash, 0) < document.page_count:
+            missing.append(document)
+        else:
+            pending.append(document)
+    return pending, missing
+
+
+def chunk_document(db, document, build):
+    """Split a document's stored page text the way ingest would with the build's settings"""
+    chunker = StreamingChunker(build.chunk_size, build.chunk_overlap)
+    chunks = []
+    rows = (
+        db.query(PageText.page_num, PageText.text)
+        .filter(PageText.content_hash == document.content_hash)
+        .order_by(PageText.page_num)
+        .yield_per(256)
+    )
+    for page_num, text in rows:
+        chunks.extend(chunker.add_page(page_num + 1, text))
+    chunks.extend(chunker.finish())
+    return chunks
+
+
+class IndexBuilder:
+    """Builds pending documents of `build` into `store`, a round of documents at a time"""
+
+    def __init__(self, build, store, embeddings, batch_size, concurrency):
+        self.build = build
+        self.store = store
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        # Enough chunks per round to keep every request slot busy with a full batch
+        self.round_chunks = batch_size * concurrency
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="reindex-embed")
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def run(self):
+        """Build every pending document; returns the documents that can't be rebuilt"""
+        db = SessionLocal()
+        try:
+            pending, missing = document_state(db, self.build.id)
+            self._progress(documents_total=db.query(func.count(Document.id)).scalar() - len(missing))
+            if not pending:
+                return missing
+            print(f"Building {len(pending)} documents into {self.build.vector_backend}:{self.build.vector_target}")
+
+            start = time.time()
+            built_chunks = 0
+            round_ = []
+            for document in pending:
+                round_.append((document, chunk_document(db, document, self.build)))
+                if sum(len(chunks) for _, chunks in round_) >= self.round_chunks:
+                    built_chunks += self._write_round(round_)
+                    round_ = []
+                    self._report(built_chunks, start)
+            if round_:
+                built_chunks += self._write_round(round_)
+                self._report(built_chunks, start)
+            return missing
+        finally:
+            db.close()
+
+    def _progress(self, **fields):
+        db = SessionLocal()
+        try:
+            db.query(IndexBuild).filter(IndexBuild.id == self.build.id).update(
+                {**fields, "updated_at": datetime.utcnow()}, synchronize_session=False
+            )
+            db.commit()
+            self.build = db.get(IndexBuild, self.build.id)
+        finally:
+            db.close()
+
+    def _report(self, built_chunks, start):
+        elapsed = time.time() - start
+        print(
+            f"  {self.build.documents_done}/{self.build.documents_total} documents, "
+            f"{self.build.chunks} chunks ({built_chunks / max(elapsed, 1e-6):.0f} chunks/s)"
+        )
+
+    def _embed(self, texts):
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        return [vector for vectors in self._pool.map(self.embeddings.embed_documents, batches) for vector in vectors]
+
+    def _write_round(self, round_):
+        """Embed, upsert and checkpoint one round of (document, chunks); returns the chunks written"""
+        texts = [chunk.text for _, chunks in round_ for chunk in chunks]
+        vectors = iter(self._embed(texts))
+        document_ids = [document.id for document, _ in round_]
+
+        groups = []
+        chunk_rows = []
+        posting_rows = []
+        for document, chunks in round_:
+            ids = [f"{document.id}-{chunk.index}" for chunk in chunks]
+            document_vectors = [next(vectors) for _ in chunks]
+            groups.append((
+                document.id,
+                ids,
+                document_vectors,
+                [chunk.text for chunk in chunks],
+                [
+                    {
+                        "source": document.filename,
+                        "page": chunk.page_start,
+                        "page_end": chunk.page_end,
+                        "document_id": document.id
+                    }
+                    for chunk in chunks
+                ]
+            ))
+            for id_, chunk, vector in zip(ids, chunks, document_vectors):
+                chunk_rows.append({
+                    "build_id": self.build.id,
+                    "id": id_,
+                    "document_id": document.id,
+                    "chunk_index": chunk.index,
+                    "page": chunk.page_start,
+                    "page_end": chunk.page_end,
+                    "text": chunk.text,
+                    "embedding": pack_vector(vector),
+                })
+                posting_rows.extend(
+                    {"build_id": self.build.id, "term": term, "chunk_id": id_, "document_id": document.id, "tf": tf}
+                    for term, tf in Counter(tokenize(chunk.text)).items()
+                )
+
+        db = SessionLocal()
+        try:
+            # Documents built before under older content may have had more chunks than they have now
+            new_ids = {id_ for _, ids, _, _, _ in groups for id_ in ids}
+            stale = {}
+            for start in range(0, len(document_ids), _DB_BATCH):
+                for id_, document_id in db.query(ReindexChunk.id, ReindexChunk.document_id).filter(
+                    ReindexChunk.build_id == self.build.id,
+                    ReindexChunk.document_id.in_(document_ids[start:start + _DB_BATCH])
+                ):
+                    if id_ not in new_ids:
+                        stale.setdefault(document_id, []).append(id_)
+            # Ids are deterministic, so vectors upserted by a round that was interrupted are simply overwritten
+            self.store.upsert_many(groups)
+            for document_id, ids in stale.items():
+                self.store.delete(ids, namespace=document_id)
+
+            for start in range(0, len(document_ids), _DB_BATCH):
+                batch = document_ids[start:start + _DB_BATCH]
+                for model, column in ((ReindexChunk, ReindexChunk.document_id), (ReindexPosting, ReindexPosting.document_id)):
+                    db.query(model).filter(model.build_id == self.build.id, column.in_(batch)).delete(
+                        synchronize_session=False
+                    )
+                db.query(IndexBuildDocument).filter(
+                    IndexBuildDocument.build_id == self.build.id, IndexBuildDocument.document_id.in_(batch)
+                ).delete(synchronize_session=False)
+            for start in range(0, len(chunk_rows), _DB_BATCH):
+                db.execute(insert(ReindexChunk), chunk_rows[start:start + _DB_BATCH])
+            for start in range(0, len(posting_rows), _DB_BATCH * 10):
+                db.execute(insert(ReindexPosting), posting_rows[start:start + _DB_BATCH * 10])
+            now = datetime.utcnow()
+            db.add_all([
+                IndexBuildDocument(
+                    build_id=self.build.id,
+                    document_id=document.id,
+                    content_hash=document.content_hash,
+                    chunk_count=len(chunks),
+                    built_at=now
+                )
+                for document, chunks in round_
+            ])
+            db.flush()
+            done, chunk_count = db.query(func.count(), func.coalesce(func.sum(IndexBuildDocument.chunk_count), 0)).filter(
+                IndexBuildDocument.build_id == self.build.id
+            ).one()
+            db.query(IndexBuild).filter(IndexBuild.id == self.build.id).update(
+                {"documents_done": done, "chunks": chunk_count, "updated_at": now}, synchronize_session=False
+            )
+            db.commit()
+            self.build = db.get(IndexBuild, self.build.id)
+        finally:
+            db.close()
+        return len(chunk_rows)
+
+
+def switch_over(build_id, skip_missing):
+    """Make the build the active index in one transaction; False if documents changed since they were built"""
+    db = SessionLocal()
+    try:
+        pending, missing = document_state(db, build_id)
+        if pending:
+            return False
+        if missing and not skip_missing:
+            raise SystemExit(missing_message(missing))
+
+        # Everything is replaced, including rows of ingests that never finished: the new index is the whole truth
+        db.query(DocumentChunk).delete(synchronize_session=False)
+        db.query(LexicalPosting).delete(synchronize_session=False)
+        live = select(Document.id)
+        db.execute(insert(DocumentChunk).from_select(
+            ["id", "document_id", "chunk_index", "page", "page_end", "text", "embedding", "version"],
+            select(
+                ReindexChunk.id, ReindexChunk.document_id, ReindexChunk.chunk_index, ReindexChunk.page,
+                ReindexChunk.page_end, ReindexChunk.text, ReindexChunk.embedding, literal(1)
+            ).where(ReindexChunk.build_id == build_id, ReindexChunk.document_id.in_(live))
+        ))
+        db.execute(insert(LexicalPosting).from_select(
+            ["term", "chunk_id", "document_id", "tf"],
+            select(ReindexPosting.term, ReindexPosting.chunk_id, ReindexPosting.document_id, ReindexPosting.tf).where(
+                ReindexPosting.build_id == build_id, ReindexPosting.document_id.in_(live)
+            )
+        ))
+
+        built = [
+            {"id": document_id, "chunk_count": chunk_count, "indexed": True, "vector_namespace": document_id}
+            for document_id, chunk_count in db.query(IndexBuildDocument.document_id, IndexBuildDocument.chunk_count).filter(
+                IndexBuildDocument.build_id == build_id,
+                IndexBuildDocument.document_id.in_(live)
+            )
+        ]
+        for start in range(0, len(built), _DB_BATCH):
+            db.execute(update(Document), built[start:start + _DB_BATCH])
+        # Skipped documents are no longer searchable until they are ingested again
+        unbuilt = [{"id": document.id, "indexed": False} for document in missing]
+        for start in range(0, len(unbuilt), _DB_BATCH):
+            db.execute(update(Document), unbuilt[start:start + _DB_BATCH])
+
+        now = datetime.utcnow()
+        db.query(IndexBuild).filter(IndexBuild.status == ACTIVE).update(
+            {"status": RETIRED, "updated_at": now}, synchronize_session=False
+        )
+        db.query(IndexBuild).filter(IndexBuild.id == build_id).update(
+            {"status": ACTIVE, "activated_at": now, "updated_at": now}, synchronize_session=False
+        )
+        # The staged rows now live in document_chunks and lexical_postings
+        for model in (ReindexChunk, ReindexPosting, IndexBuildDocument):
+            db.query(model).filter(model.build_id == build_id).delete(synchronize_session=False)
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def missing_message(missing):
+    names = ", ".join(f"{document.filename} ({document.id})" for document in missing[:10])
+    more = f" and {len(missing) - 10} more" if len(missing) > 10 else ""
+    return (
+        f"{len(missing)} documents have no complete stored page text and can't be rebuilt: {names}{more}. "
+        "Ingest them again, or pass --skip-missing to leave them out of the new index."
+    )
+
+
+def requested_settings(args, current):
+    """Settings for `build`: the active ones, with whatever the arguments change"""
+    if args.pinecone_index:
+        backend, target = "pinecone", args.pinecone_index
+    elif args.local_path:
+        backend, target = "local", args.local_path
+    else:
+        backend, target = current.vector_backend, None
+    return IndexSettings(
+        embedding_model=args.embedding_model or current.embedding_model,
+        chunk_size=args.chunk_size or current.chunk_size,
+        chunk_overlap=args.chunk_overlap if args.chunk_overlap is not None else current.chunk_overlap,
+        vector_backend=backend,
+        vector_target=target
+    )
+
+
+def open_builder(build, args):
+    store = open_vector_store(build.vector_backend, build.vector_target)
+    embeddings = create_embeddings(build.embedding_model, args.batch_size)
+    return IndexBuilder(build, store, embeddings, args.batch_size, args.concurrency)
+
+
+def build_command(args):
+    db = SessionLocal()
+    try:
+        current = active_settings(SessionLocal)
+        if args.build_id:
+            build = db.get(IndexBuild, args.build_id)
+            if build is None or build.status != BUILDING:
+                raise SystemExit(f"No unfinished build {args.build_id}")
+        else:
+            settings = requested_settings(args, current)
+            if not settings.vector_target:
+                raise SystemExit("Pass --pinecone-index or --local-path: the new index is built next to the served one")
+            if (settings.vector_backend, settings.vector_target) == (current.vector_backend, current.vector_target):
+                raise SystemExit(f"{settings.vector_target} is the index being served; build into another one")
+            # Vectors of another model or chunking left in the target would be searched alongside the new ones
+            used = db.query(IndexBuild).filter(
+                IndexBuild.vector_backend == settings.vector_backend,
+                IndexBuild.vector_target == settings.vector_target
+            ).all()
+            build = find_build(db, settings)
+            if settings.vector_target == default_target(settings.vector_backend) or any(
+                other is not build for other in used
+            ):
+                raise SystemExit(f"{settings.vector_target} already holds another index; build into a new one")
+            if build is None:
+                now = datetime.utcnow()
+                build = IndexBuild(
+                    id=str(uuid.uuid4()),
+                    status=BUILDING,
+                    embedding_model=settings.embedding_model,
+                    chunk_size=settings.chunk_size,
+                    chunk_overlap=settings.chunk_overlap,
+                    vector_backend=settings.vector_backend,
+                    vector_target=settings.vector_target,
+                    created_at=now,
+                    updated_at=now
+                )
+                db.add(build)
+                db.commit()
+                print(f"Started build {build.id}")
+            else:
+                print(f"Resuming build {build.id}")
+            db.refresh(build)
+        db.expunge(build)
+    finally:
+        db.close()
+
+    builder = open_builder(build, args)
+    try:
+        missing = builder.run()
+    finally:
+        builder.close()
+    print(
+        f"Build {build.id}: {builder.build.documents_done}/{builder.build.documents_total} documents, "
+        f"{builder.build.chunks} chunks. Activate it with: python reindex.py activate {build.id}"
+    )
+    if missing:
+        print(f"Warning: {missing_message(missing)}")
+
+
+def activate_command(args):
+    db = SessionLocal()
+    try:
+        build = db.get(IndexBuild, args.build_id)
+        if build is None or build.status != BUILDING:
+            raise SystemExit(f"No unfinished build {args.build_id}")
+        db.expunge(build)
+    finally:
+        db.close()
+
+    builder = open_builder(build, args)
+    try:
+        for _ in range(ACTIVATE_ATTEMPTS):
+            # Documents ingested or revised since they were built
+            missing = builder.run()
+            if missing and not args.skip_missing:
+                raise SystemExit(missing_message(missing))
+            if switch_over(build.id, args.skip_missing):
+                print(
+                    f"Build {build.id} is now active ({build.embedding_model}, chunks of {build.chunk_size}/"
+                    f"{build.chunk_overlap}, {build.vector_backend}:{build.vector_target})"
+                )
+                return
+        raise SystemExit("Documents kept changing while catching up; run activate again")
+    finally:
+        builder.close()
+
+
+def status_command(args):
+    db = SessionLocal()
+    try:
+        builds = db.query(IndexBuild).order_by(IndexBuild.created_at).all()
+    finally:
+        db.close()
+    if not builds:
+        print("No index builds; serving the index ingest built with the default settings")
+        return
+    for build in builds:
+        print(
+            f"{build.id}  {build.status:<8}  {build.embedding_model}  chunks {build.chunk_size}/{build.chunk_overlap}  "
+            f"{build.vector_backend}:{build.vector_target}  {build.documents_done}/{build.documents_total} documents  "
+            f"{build.chunks} chunks  updated {build.updated_at:%Y-%m-%d %H:%M:%S}"
+        )
+
+
+def drop_command(args):
+    db = SessionLocal()
+    try:
+        build = db.get(IndexBuild, args.build_id)
+        if build is None or build.status != BUILDING:
+            raise SystemExit(f"No unfinished build {args.build_id}")
+        target = build.vector_target
+        for model in (ReindexChunk, ReindexPosting, IndexBuildDocument):
+            db.query(model).filter(model.build_id == build.id).delete(synchronize_session=False)
+        db.delete(build)
+        db.commit()
+    finally:
+        db.close()
+    print(f"Dropped build {args.build_id}; vectors already written to {target} were left in place")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def embedding_options(command):
+        command.add_argument("--batch-size", type=int, default=1000, help="texts per embedding request")
+        command.add_argument("--concurrency", type=int, default=4, help="embedding requests in flight")
+
+    build = commands.add_parser("build", help="start or resume a build")
+    build.add_argument("--embedding-model", help=f"default: the active model ({DEFAULT_EMBEDDING_MODEL} initially)")
+    build.add_argument("--chunk-size", type=int, help=f"default: the active chunk size ({CHUNK_SIZE} initially)")
+    build.add_argument("--chunk-overlap", type=int, help=f"default: the active overlap ({CHUNK_OVERLAP} initially)")
+    target = build.add_mutually_exclusive_group()
+    target.add_argument("--pinecone-index", help="existing Pinecone index to build into")
+    target.add_argument("--local-path", help=f"local index directory to build into (served: {default_target('local')})")
+    build.add_argument("--build-id", help="resume this build")
+    embedding_options(build)
+
+    activate = commands.add_parser("activate", help="catch up and switch the API over to a build")
+    activate.add_argument("build_id")
+    activate.add_argument("--skip-missing", action="store_true", help="leave out documents without stored page text")
+    embedding_options(activate)
+
+    commands.add_parser("status", help="list builds")
+
+    drop = commands.add_parser("drop", help="discard an unfinished build")
+    drop.add_argument("build_id")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    init_db()
+    {"build": build_command, "activate": activate_command, "status": status_command, "drop": drop_command}[
+        args.command
+    ](args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
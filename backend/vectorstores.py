@@ -0,0 +1,721 @@
+import json
+import os
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+# Rows scored per matrix product when scanning int8 data, bounds the float32 temporary
+_SCAN_BLOCK = 65536
+
+
+@dataclass
+class SearchResult:
+    id: str
+    score: float
+    text: str
+    metadata: dict
+
+
+class VectorStore:
+    """Interface the API uses for chunk vectors.
+
+    Vectors are always supplied by the caller (the embedding cache decides
+    what needs an API call), so backends only store and search them.
+    Vectors live in namespaces (one per document, "" for the default one);
+    a search only looks at the namespaces it is given, so its cost depends
+    on their size rather than on the whole index.
+    """
+
+    def upsert(self, ids, vectors, texts, metadatas, namespace=""):
+        raise NotImplementedError
+
+    def upsert_many(self, groups):
+        """Upsert into several namespaces at once; `groups` holds (namespace, ids, vectors, texts, metadatas)"""
+        for namespace, ids, vectors, texts, metadatas in groups:
+            self.upsert(ids, vectors, texts, metadatas, namespace=namespace)
+
+    def search(self, vector, k=4, filter=None, namespaces=None) -> List[SearchResult]:
+        """Top `k` over `namespaces` (default: the default namespace only)"""
+        raise NotImplementedError
+
+    def search_many(self, vectors, k=4, filter=None, namespaces=None) -> List[List[SearchResult]]:
+        """`search` for each of `vectors`, in the same order"""
+        return [self.search(vector, k=k, filter=filter, namespaces=namespaces) for vector in vectors]
+
+    def update_metadata(self, ids, metadatas, namespace=""):
+        """Set the given metadata keys of existing vectors, leaving their values and other keys as they are"""
+        raise NotImplementedError
+
+    def delete(self, ids=None, filter=None, namespace=""):
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+
+class PineconeVectorStore(VectorStore):
+    """Pinecone index, laid out the way LangChain's Pinecone wrapper writes it
+    (chunk text under the "text" metadata key) so existing indexes keep working."""
+
+    def __init__(self, index, text_key="text", batch_size=100, metric="cosine"):
+        self.index = index
+        self.text_key = text_key
+        self.batch_size = batch_size
+        self.metric = metric
+
+    def upsert(self, ids, vectors, texts, metadatas, namespace=""):
+        for start in range(0, len(ids), self.batch_size):
+            stop = start + self.batch_size
+            self.index.upsert(vectors=[
+                {"id": vector_id, "values": list(vector), "metadata": {**metadata, self.text_key: text}}
+                for vector_id, vector, text, metadata in zip(
+                    ids[start:stop], vectors[start:stop], texts[start:stop], metadatas[start:stop]
+                )
+            ], namespace=namespace)
+
+    def search(self, vector, k=4, filter=None, namespaces=None):
+        namespaces = namespaces or [""]
+        if len(namespaces) == 1:
+            response = self.index.query(
+                vector=list(vector), top_k=k, filter=filter, namespace=namespaces[0], include_metadata=True
+            )
+        else:
+            # The client queries the namespaces in parallel and merges the matches by score
+            response = self.index.query_namespaces(
+                vector=list(vector), namespaces=namespaces, metric=self.metric, top_k=k, filter=filter,
+                include_metadata=True
+            )
+        results = []
+        for match in response.matches:
+            metadata = dict(match.metadata or {})
+            text = metadata.pop(self.text_key, "")
+            results.append(SearchResult(id=match.id, score=match.score, text=text, metadata=metadata))
+        return results
+
+    def update_metadata(self, ids, metadatas, namespace=""):
+        # Pinecone updates one vector per request
+        for vector_id, metadata in zip(ids, metadatas):
+            self.index.update(id=vector_id, set_metadata=metadata, namespace=namespace)
+
+    def delete(self, ids=None, filter=None, namespace=""):
+        if ids:
+            for start in range(0, len(ids), 1000):
+                self.index.delete(ids=ids[start:start + 1000], namespace=namespace)
+        elif filter:
+            self.index.delete(filter=filter, namespace=namespace)
+
+    def count(self):
+        return self.index.describe_index_stats().total_vector_count
+
+
+def _matches(value, condition):
+    if isinstance(condition, dict):
+        for op, operand in condition.items():
+            if op == "$eq" and value != operand:
+                return False
+            if op == "$ne" and value == operand:
+                return False
+            if op == "$in" and value not in operand:
+                return False
+            if op == "$nin" and value in operand:
+                return False
+        return True
+    return value == condition
+
+
+def matches_filter(metadata, filter):
+    """Evaluate a Pinecone-style metadata filter ($eq, $ne, $in, $nin, $and, $or)"""
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif not _matches(metadata.get(key), condition):
+            return False
+    return True
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _kmeans(matrix, lists, iterations=10, seed=0):
+    """Plain k-means on unit vectors (spherical), returns normalized centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = matrix[rng.choice(len(matrix), size=lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(matrix @ centroids.T, axis=1)
+        for list_id in range(lists):
+            members = matrix[assignments == list_id]
+            if len(members):
+                centroids[list_id] = members.mean(axis=0)
+        centroids = _normalize_rows(centroids)
+    return centroids.astype(np.float32)
+
+
+class _Segment:
+    """One batch of vectors as written to disk, with their records.
+
+    The vector files never change once written; the records file is
+    rewritten when metadata of its rows is updated.
+    """
+
+    def __init__(self, name, matrix, scales, records, assignments=None):
+        self.name = name
+        self.matrix = matrix
+        self.scales = scales
+        self.records = records
+        # IVF partition of each row, while the index is partitioned
+        self.assignments = assignments
+
+    def __len__(self):
+        return len(self.records)
+
+
+class _Snapshot:
+    """Immutable view of the local index; writers build a new one and swap it in.
+
+    Rows are numbered across the segments in order. `deleted` maps a segment
+    name to its rows that were deleted or overwritten after it was written;
+    they stay on disk until the segment is merged.
+    """
+
+    def __init__(self, segments=(), deleted=None, centroids=None):
+        self.segments = tuple(segments)
+        self.deleted = deleted or {}
+        self.centroids = centroids
+        self.starts = np.cumsum([0] + [len(segment) for segment in self.segments])
+        self.records = [record for segment in self.segments for record in segment.records]
+        self.alive = np.ones(len(self.records), dtype=bool)
+        for segment, start in zip(self.segments, self.starts):
+            rows = self.deleted.get(segment.name)
+            if rows:
+                self.alive[start + np.fromiter(rows, dtype=np.int64, count=len(rows))] = False
+        self.live = int(self.alive.sum())
+        self._row_by_key = None
+        self._assignments = None
+        self._value_indexes = {}
+        self._namespace_index = None
+
+    @property
+    def row_by_key(self):
+        """(namespace, id) -> row of the live copy"""
+        if self._row_by_key is None:
+            self._row_by_key = {
+                (record.get("namespace", ""), record["id"]): row
+                for row, record in enumerate(self.records) if self.alive[row]
+            }
+        return self._row_by_key
+
+    @property
+    def assignments(self):
+        """IVF partition of every row, or None if the index isn't partitioned"""
+        if self._assignments is None and self.centroids is not None:
+            if self.segments and all(segment.assignments is not None for segment in self.segments):
+                self._assignments = np.concatenate([segment.assignments for segment in self.segments])
+        return self._assignments
+
+    def locate(self, rows):
+        """(segment index, row within the segment) for each of the given rows"""
+        rows = np.asarray(rows, dtype=np.int64)
+        segments = np.searchsorted(self.starts, rows, side="right") - 1
+        return zip(segments.tolist(), (rows - self.starts[segments]).tolist())
+
+    def namespace_rows(self, namespaces):
+        """Row numbers in any of `namespaces`, sorted"""
+        if self._namespace_index is None:
+            groups = {}
+            for row, record in enumerate(self.records):
+                groups.setdefault(record.get("namespace", ""), []).append(row)
+            self._namespace_index = {name: np.asarray(rows, dtype=np.int64) for name, rows in groups.items()}
+        if set(namespaces) >= set(self._namespace_index):
+            return None
+        matched = [self._namespace_index[name] for name in namespaces if name in self._namespace_index]
+        return np.sort(np.concatenate(matched)) if matched else np.zeros(0, dtype=np.int64)
+
+    def value_index(self, key):
+        """Metadata value -> row numbers for `key`, built on first use"""
+        index = self._value_indexes.get(key)
+        if index is None:
+            groups = {}
+            for row, record in enumerate(self.records):
+                value = record["metadata"].get(key)
+                if isinstance(value, (str, int, float, bool)):
+                    groups.setdefault(value, []).append(row)
+            index = {value: np.asarray(rows, dtype=np.int64) for value, rows in groups.items()}
+            self._value_indexes[key] = index
+        return index
+
+    def filter_rows(self, filter):
+        """Row numbers matching a metadata filter, sorted"""
+        rows = None
+        for key, condition in filter.items():
+            if key.startswith("$") or (isinstance(condition, dict) and set(condition) - {"$eq", "$in"}):
+                break
+            if isinstance(condition, dict) and len(condition) != 1:
+                break
+            if isinstance(condition, dict):
+                values = condition["$in"] if "$in" in condition else [condition["$eq"]]
+            else:
+                values = [condition]
+            index = self.value_index(key)
+            matched = [index[value] for value in values if value in index]
+            matched = np.unique(np.concatenate(matched)) if matched else np.zeros(0, dtype=np.int64)
+            rows = matched if rows is None else np.intersect1d(rows, matched)
+        else:
+            return rows if rows is not None else np.arange(len(self.records))
+
+        # Operators the value index can't answer fall back to a scan
+        allowed = np.fromiter(
+            (matches_filter(record["metadata"], filter) for record in self.records),
+            dtype=bool, count=len(self.records)
+        )
+        return np.flatnonzero(allowed)
+
+
+class LocalVectorStore(VectorStore):
+    """In-process cosine index persisted under `path`.
+
+    Vectors are normalized at insert so cosine similarity is a dot product over
+    memory-mapped matrices, stored as float32 or as int8 with a per-row scale
+    (4x smaller, slightly lossy). With `ivf_lists` set, corpora of at least
+    `ivf_min_vectors` are partitioned by k-means and a search only scans the
+    `nprobe` closest partitions.
+
+    Each upsert appends a segment holding just its own vectors, and deletes
+    (or overwrites) only mark rows in the manifest, so a write costs in
+    proportion to the batch rather than the index. Segments are merged as
+    they accumulate, a newer one into an older one once it has grown as
+    large, so there are O(log n) of them and each row is rewritten O(log n)
+    times; merges copy rows block by block and drop deleted ones, and a
+    segment that is mostly deleted rows is rewritten on its own. compact()
+    merges everything into one segment on demand.
+    """
+
+    def __init__(self, path, dtype="float32", ivf_lists=0, nprobe=8, ivf_min_vectors=20000):
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"Unsupported local index dtype: {dtype}")
+        self.path = path
+        self.dtype = dtype
+        self.ivf_lists = ivf_lists
+        self.nprobe = nprobe
+        self.ivf_min_vectors = ivf_min_vectors
+        self._lock = threading.Lock()
+        self._state = _Snapshot()
+        self._trained_size = 0
+        # Number of the last segment written; segment names are never reused
+        self._counter = 0
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        if not os.path.exists(self._file("manifest.json")):
+            if not os.path.exists(self._file("records.json")):
+                return
+            self._migrate()
+        with open(self._file("manifest.json")) as f:
+            manifest = json.load(f)
+        self._counter = manifest["counter"]
+        centroids = None
+        if os.path.exists(self._file("ivf.npz")):
+            ivf = np.load(self._file("ivf.npz"))
+            centroids = ivf["centroids"]
+            self._trained_size = int(ivf["trained_size"])
+        segments = [self._open_segment(name) for name in manifest["segments"]]
+        deleted = {name: set(rows) for name, rows in manifest["deleted"].items()}
+        self._state = _Snapshot(segments, deleted, centroids)
+
+        # Segments written by a merge or upsert that crashed before updating the manifest
+        names = set(manifest["segments"])
+        for filename in os.listdir(self.path):
+            if filename.startswith("seg-") and filename[4:].split(".")[0].split("-")[0] not in names:
+                os.remove(self._file(filename))
+        if segments:
+            print(
+                f"Loaded local vector index with {self._state.live} vectors in {len(segments)} segments from {self.path}"
+            )
+
+    def _migrate(self):
+        """Turn an index written as a single vectors.npy and records.json into its first segment"""
+        with open(self._file("records.json")) as f:
+            records = json.load(f)
+        name = "000001"
+        if records:
+            if os.path.exists(self._file("vectors.npy")):
+                os.replace(self._file("vectors.npy"), self._file(f"seg-{name}.npy"))
+            if os.path.exists(self._file("scales.npy")):
+                os.replace(self._file("scales.npy"), self._file(f"seg-{name}-scales.npy"))
+            if os.path.exists(self._file("ivf.npz")):
+                ivf = np.load(self._file("ivf.npz"))
+                self._save_array(f"seg-{name}-ivf.npy", ivf["assignments"])
+                self._save_ivf(ivf["centroids"], int(ivf["trained_size"]))
+            self._save_json(f"seg-{name}.json", records)
+        self._save_json("manifest.json", {"segments": [name] if records else [], "deleted": {}, "counter": 1})
+        os.remove(self._file("records.json"))
+
+    def _save_array(self, name, array):
+        # Write then rename, so a crash never leaves a half-written file behind
+        tmp = self._file(f".{name}.tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp, self._file(name))
+
+    def _save_json(self, name, value):
+        tmp = self._file(f".{name}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp, self._file(name))
+
+    def _save_ivf(self, centroids, trained_size):
+        tmp = self._file(".ivf.npz.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, centroids=centroids, trained_size=trained_size)
+        os.replace(tmp, self._file("ivf.npz"))
+
+    def _open_segment(self, name, records=None):
+        if records is None:
+            with open(self._file(f"seg-{name}.json")) as f:
+                records = json.load(f)
+        matrix = np.load(self._file(f"seg-{name}.npy"), mmap_mode="r")
+        scales = np.load(self._file(f"seg-{name}-scales.npy")) if self.dtype == "int8" else None
+        assignments = None
+        if os.path.exists(self._file(f"seg-{name}-ivf.npy")):
+            assignments = np.load(self._file(f"seg-{name}-ivf.npy"))
+        return _Segment(name, matrix, scales, records, assignments)
+
+    def _remove_segment(self, name):
+        for filename in (f"seg-{name}.npy", f"seg-{name}-scales.npy", f"seg-{name}-ivf.npy", f"seg-{name}.json"):
+            if os.path.exists(self._file(filename)):
+                os.remove(self._file(filename))
+
+    def _next_name(self):
+        self._counter += 1
+        return f"{self._counter:06d}"
+
+    def _write_segment(self, vectors, records, centroids):
+        """Write normalized float32 `vectors` and their records as a new segment"""
+        name = self._next_name()
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self._save_array(f"seg-{name}.npy", np.round(vectors / scales[:, None]).astype(np.int8))
+            self._save_array(f"seg-{name}-scales.npy", scales.astype(np.float32))
+        else:
+            self._save_array(f"seg-{name}.npy", vectors)
+        if centroids is not None:
+            self._save_array(f"seg-{name}-ivf.npy", np.argmax(vectors @ centroids.T, axis=1).astype(np.int32))
+        self._save_json(f"seg-{name}.json", records)
+        return self._open_segment(name, records)
+
+    def _merge(self, segments, deleted):
+        """Write the live rows of `segments` as one new segment; None if none are left.
+
+        Rows are copied block by block between the memory-mapped files, so a
+        merge never holds more than _SCAN_BLOCK rows in memory.
+        """
+        kept = []
+        for segment in segments:
+            rows = np.arange(len(segment))
+            if deleted.get(segment.name):
+                rows = np.setdiff1d(rows, np.fromiter(deleted[segment.name], dtype=np.int64))
+            kept.append((segment, rows))
+        total = sum(len(rows) for _, rows in kept)
+        if not total:
+            return None
+
+        name = self._next_name()
+        tmp = self._file(f".seg-{name}.npy.tmp")
+        out = np.lib.format.open_memmap(
+            tmp, mode="w+", dtype=segments[0].matrix.dtype, shape=(total, segments[0].matrix.shape[1])
+        )
+        position = 0
+        for segment, rows in kept:
+            for start in range(0, len(rows), _SCAN_BLOCK):
+                block = rows[start:start + _SCAN_BLOCK]
+                out[position:position + len(block)] = segment.matrix[block]
+                position += len(block)
+        out.flush()
+        del out
+        os.replace(tmp, self._file(f"seg-{name}.npy"))
+        if self.dtype == "int8":
+            self._save_array(f"seg-{name}-scales.npy", np.concatenate([segment.scales[rows] for segment, rows in kept]))
+        if all(segment.assignments is not None for segment in segments):
+            self._save_array(
+                f"seg-{name}-ivf.npy", np.concatenate([segment.assignments[rows] for segment, rows in kept])
+            )
+        records = [segment.records[row] for segment, rows in kept for row in rows.tolist()]
+        self._save_json(f"seg-{name}.json", records)
+        return self._open_segment(name, records)
+
+    def _compact(self, segments, deleted):
+        """Segments after the merges due, and the segments they replace"""
+        def live(segment):
+            return len(segment) - len(deleted.get(segment.name, ()))
+
+        retired = []
+        compacted = []
+        for segment in segments:
+            if live(segment) * 2 <= len(segment):
+                # Mostly deleted rows, which every search would scan and skip
+                retired.append(segment)
+                segment = self._merge([segment], deleted)
+                if segment is None:
+                    continue
+            compacted.append(segment)
+        segments = compacted
+        while len(segments) > 1 and live(segments[-2]) <= live(segments[-1]):
+            merged = self._merge(segments[-2:], deleted)
+            retired.extend(segments[-2:])
+            segments[-2:] = [merged] if merged else []
+        return segments, retired
+
+    def _dense(self, segment, rows):
+        """Float32 copy (dequantized for int8) of the given rows of a segment"""
+        matrix = np.asarray(segment.matrix[rows], dtype=np.float32)
+        return matrix * segment.scales[rows][:, None] if self.dtype == "int8" else matrix
+
+    def _partition(self, segments, deleted, centroids):
+        """(segments, centroids) with the IVF partitions trained, or retrained once the corpus has doubled"""
+        live = sum(len(segment) - len(deleted.get(segment.name, ())) for segment in segments)
+        if not self.ivf_lists or live < self.ivf_min_vectors:
+            if centroids is not None and os.path.exists(self._file("ivf.npz")):
+                os.remove(self._file("ivf.npz"))
+            return segments, None
+        if centroids is not None and live < 2 * self._trained_size:
+            return segments, centroids
+
+        # Train on a sample of the live rows, then assign every row to its closest partition
+        alive = [
+            np.setdiff1d(np.arange(len(segment)), np.fromiter(deleted.get(segment.name, ()), dtype=np.int64))
+            for segment in segments
+        ]
+        sizes = np.cumsum([0] + [len(rows) for rows in alive])
+        picks = np.sort(np.random.default_rng(0).permutation(live)[:100000])
+        sample = np.concatenate([
+            self._dense(segment, rows[picks[(picks >= start) & (picks < stop)] - start])
+            for segment, rows, start, stop in zip(segments, alive, sizes, sizes[1:])
+        ])
+        centroids = _kmeans(sample, min(self.ivf_lists, len(sample)))
+        self._trained_size = live
+        partitioned = []
+        for segment in segments:
+            assignments = np.concatenate([
+                np.argmax(self._dense(segment, np.arange(start, min(start + _SCAN_BLOCK, len(segment)))) @ centroids.T,
+                          axis=1)
+                for start in range(0, len(segment), _SCAN_BLOCK)
+            ]).astype(np.int32)
+            self._save_array(f"seg-{segment.name}-ivf.npy", assignments)
+            partitioned.append(_Segment(segment.name, segment.matrix, segment.scales, segment.records, assignments))
+        self._save_ivf(centroids, self._trained_size)
+        return partitioned, centroids
+
+    def _commit(self, segments, deleted, centroids, retired=()):
+        """Make the new segments the index: write the manifest, swap in the snapshot, remove replaced files"""
+        names = {segment.name for segment in segments}
+        deleted = {name: rows for name, rows in deleted.items() if rows and name in names}
+        self._save_json("manifest.json", {
+            "segments": [segment.name for segment in segments],
+            "deleted": {name: sorted(rows) for name, rows in deleted.items()},
+            "counter": self._counter
+        })
+        self._state = _Snapshot(segments, deleted, centroids)
+        # Searches still holding the previous snapshot keep reading the unlinked files
+        for segment in retired:
+            if segment.name not in names:
+                self._remove_segment(segment.name)
+
+    def _write(self, state, doomed, new_segment=None):
+        """Mark `doomed` rows deleted, add `new_segment`, merge what is due and commit"""
+        deleted = {name: set(rows) for name, rows in state.deleted.items()}
+        for position, row in state.locate(doomed):
+            deleted.setdefault(state.segments[position].name, set()).add(row)
+        segments = list(state.segments) + ([new_segment] if new_segment else [])
+        segments, retired = self._compact(segments, deleted)
+        segments, centroids = self._partition(segments, deleted, state.centroids)
+        self._commit(segments, deleted, centroids, retired)
+
+    def upsert(self, ids, vectors, texts, metadatas, namespace=""):
+        self.upsert_many([(namespace, ids, vectors, texts, metadatas)])
+
+    def upsert_many(self, groups):
+        # One segment per call, so several namespaces are written in one go
+        groups = [group for group in groups if group[1]]
+        if not groups:
+            return
+        vectors = _normalize_rows(np.concatenate([np.asarray(group[2], dtype=np.float32) for group in groups]))
+        records = [
+            {"id": vector_id, "text": text, "metadata": metadata, **({"namespace": namespace} if namespace else {})}
+            for namespace, ids, _, texts, metadatas in groups
+            for vector_id, text, metadata in zip(ids, texts, metadatas)
+        ]
+        with self._lock:
+            state = self._state
+            replaced = [
+                state.row_by_key[(namespace, vector_id)]
+                for namespace, ids, _, _, _ in groups
+                for vector_id in ids
+                if (namespace, vector_id) in state.row_by_key
+            ]
+            self._write(state, replaced, self._write_segment(vectors.astype(np.float32), records, state.centroids))
+
+    def delete(self, ids=None, filter=None, namespace=""):
+        with self._lock:
+            state = self._state
+            if ids is not None:
+                doomed = [
+                    state.row_by_key[(namespace, vector_id)]
+                    for vector_id in set(ids)
+                    if (namespace, vector_id) in state.row_by_key
+                ]
+            elif filter:
+                in_namespace = state.namespace_rows([namespace])
+                doomed = state.filter_rows(filter)
+                if in_namespace is not None:
+                    doomed = np.intersect1d(doomed, in_namespace)
+                doomed = doomed[state.alive[doomed]]
+            else:
+                return
+            if not len(doomed):
+                return
+            self._write(state, doomed)
+
+    def update_metadata(self, ids, metadatas, namespace=""):
+        """Only the records files of the segments holding `ids` are rewritten; their vectors stay as they are"""
+        with self._lock:
+            state = self._state
+            changes = {}
+            for vector_id, metadata in zip(ids, metadatas):
+                row = state.row_by_key.get((namespace, vector_id))
+                if row is not None:
+                    changes[row] = metadata
+            if not changes:
+                return
+            by_segment = defaultdict(dict)
+            for (position, row), metadata in zip(state.locate(list(changes)), changes.values()):
+                by_segment[position][row] = metadata
+            segments = list(state.segments)
+            for position, rows in by_segment.items():
+                segment = segments[position]
+                records = list(segment.records)
+                for row, metadata in rows.items():
+                    records[row] = {**records[row], "metadata": {**records[row]["metadata"], **metadata}}
+                self._save_json(f"seg-{segment.name}.json", records)
+                segments[position] = _Segment(
+                    segment.name, segment.matrix, segment.scales, records, segment.assignments
+                )
+            self._state = _Snapshot(segments, state.deleted, state.centroids)
+
+    def compact(self):
+        """Merge all segments into one without the deleted rows; searches carry on meanwhile"""
+        with self._lock:
+            state = self._state
+            if len(state.segments) <= 1 and not state.deleted:
+                return
+            merged = self._merge(list(state.segments), state.deleted) if state.segments else None
+            self._commit([merged] if merged else [], {}, state.centroids, state.segments)
+
+    def _score_segment(self, segment, rows, query):
+        """Cosine scores of a segment's `rows` (None = all) against the normalized query, or against each
+        column of a matrix of queries"""
+        matrix, scales = segment.matrix, segment.scales
+        if self.dtype == "int8" and query.ndim > 1:
+            scales = scales[:, None]
+        if rows is not None:
+            if self.dtype != "int8":
+                return matrix[rows] @ query
+            return (matrix[rows].astype(np.float32) @ query) * scales[rows]
+        if self.dtype != "int8":
+            return matrix @ query
+        scores = np.empty((len(matrix),) + query.shape[1:], dtype=np.float32)
+        for start in range(0, len(matrix), _SCAN_BLOCK):
+            scores[start:start + _SCAN_BLOCK] = matrix[start:start + _SCAN_BLOCK].astype(np.float32) @ query
+        return scores * scales
+
+    def _score(self, state, rows, query):
+        """Cosine scores of `rows` (sorted, None = all rows) against the normalized query(s); -inf for deleted rows"""
+        parts = []
+        for segment, start, stop in zip(state.segments, state.starts, state.starts[1:]):
+            if rows is None:
+                parts.append(self._score_segment(segment, None, query))
+                continue
+            low, high = np.searchsorted(rows, [start, stop])
+            if low < high:
+                parts.append(self._score_segment(segment, rows[low:high] - start, query))
+        scores = np.concatenate(parts).astype(np.float32, copy=False)
+        scores[~(state.alive if rows is None else state.alive[rows])] = -np.inf
+        return scores
+
+    def _rows(self, state, filter, namespaces):
+        """Rows a search over `namespaces` matching `filter` looks at (None = all rows)"""
+        rows = state.namespace_rows(namespaces or [""])
+        if filter:
+            matched = state.filter_rows(filter)
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+        return rows
+
+    def _probes(self, state, rows):
+        """Whether a scan of `rows` only looks at the partitions nearest the query"""
+        # A small filtered subset is scanned exactly; partitions only pay off on large scans
+        return state.assignments is not None and (rows is None or len(rows) > self.ivf_min_vectors)
+
+    def _top(self, state, rows, scores, k):
+        top = min(k, int(np.isfinite(scores).sum()))
+        if not top:
+            return []
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best])]
+        results = []
+        for position in best:
+            record = state.records[int(rows[position]) if rows is not None else int(position)]
+            results.append(SearchResult(
+                id=record["id"],
+                score=float(scores[position]),
+                text=record["text"],
+                metadata=record["metadata"],
+            ))
+        return results
+
+    def _search(self, state, query, rows, k):
+        if self._probes(state, rows):
+            probes = np.argsort(-(state.centroids @ query))[:self.nprobe]
+            probed = np.flatnonzero(np.isin(state.assignments, probes))
+            rows = probed if rows is None else np.intersect1d(rows, probed, assume_unique=True)
+        if rows is not None and not len(rows):
+            return []
+        return self._top(state, rows, self._score(state, rows, query), k)
+
+    def search(self, vector, k=4, filter=None, namespaces=None):
+        state = self._state
+        if not state.live:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        return self._search(state, query, self._rows(state, filter, namespaces), k)
+
+    def search_many(self, vectors, k=4, filter=None, namespaces=None):
+        """`search` for each of `vectors`, scoring all of them in one pass over the rows"""
+        state = self._state
+        if not state.live or not len(vectors):
+            return [[] for _ in vectors]
+        queries = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+        rows = self._rows(state, filter, namespaces)
+        if self._probes(state, rows):
+            # Each query scans its own nearest partitions
+            return [self._search(state, query, rows, k) for query in queries]
+        if rows is not None and not len(rows):
+            return [[] for _ in vectors]
+        scores = self._score(state, rows, queries.T)
+        return [self._top(state, rows, scores[:, column], k) for column in range(len(queries))]
+
+    def count(self):
+        return self._state.live
@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""Offline benchmark for /ingest and /ask.
+
+Drives the FastAPI app in-process with local stand-ins for the external
+services, so runs need no network access and are comparable over time:
+
+- OpenAI embeddings: deterministic hashed bag-of-words vectors
+- OpenAI chat completions: a local server speaking the chat completions API,
+  with configurable first-token latency and per-token delay
+- Pinecone: an in-memory NumPy vector store
+- Tesseract: a stand-in with a configurable per-page delay
+
+Usage:
+    python benchmark.py
+    python benchmark.py --pages 10 100 --concurrency 1 8 32 --requests 200
+    python benchmark.py --compare benchmark_results/benchmark-20250101-120000.json
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+POLICY_LINES = [
+    "The copay for specialist visits is $40 per visit.",
+    "Primary care office visits have a $20 copay.",
+    "Emergency room copay is $250, waived if admitted.",
+    "MRI and CT scans require prior authorization; coinsurance 20% after deductible.",
+    "The annual deductible is $1,500 per individual and $3,000 per family.",
+    "The out-of-pocket maximum is $6,000 per individual.",
+    "Physical therapy is limited to 30 visits per calendar year.",
+    "Mental health outpatient services are covered at 80% in-network.",
+    "Prescription drugs: tier 1 generic $10, tier 2 preferred brand $35.",
+    "Procedure 99213 established patient office visit is covered after the deductible.",
+    "Preventive care, including an annual physical, is covered with no charge.",
+    "Out-of-network services are reimbursed at 60% of the allowed amount.",
+    "Cosmetic surgery is excluded unless medically necessary after an accident.",
+    "Claims must be submitted within 90 days of the date of service.",
+]
+
+QUESTIONS = [
+    "What's the copay for specialist visits?",
+    "What is the annual deductible?",
+    "Is MRI covered?",
+    "Are prescription drugs covered?",
+    "What's the out-of-pocket maximum?",
+    "Is physical therapy covered and how many visits?",
+    "Are mental health services covered?",
+    "Would the plan pay for surgery after a car accident?",
+    "How long do I have to submit a claim?",
+    "What happens if I see a doctor outside the network?",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50], help="PDF sizes to ingest")
+    parser.add_argument("--kinds", nargs="+", default=["text", "scanned"], choices=["text", "scanned"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="/ask concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="/ask requests per concurrency level")
+    parser.add_argument("--endpoints", nargs="+", default=["ask", "stream"], choices=["ask", "stream", "batch"])
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="fake chat completion time to first token")
+    parser.add_argument("--token-delay-ms", type=float, default=5, help="fake chat completion delay between tokens")
+    parser.add_argument("--answer-tokens", type=int, default=40)
+    parser.add_argument("--embed-latency-ms", type=float, default=20, help="fake embeddings request time")
+    parser.add_argument("--embed-dim", type=int, default=256)
+    parser.add_argument("--ocr-latency-ms", type=float, default=150, help="fake Tesseract time per page")
+    parser.add_argument("--rag-only", action="store_true", help="disable the benefits table and lexical fast path")
+    parser.add_argument("--answer-cache", action="store_true", help="leave the semantic answer cache on")
+    parser.add_argument(
+        "--seed", type=int, default=0, help="synthetic PDF text; runs with the same seed ingest and search the same text"
+    )
+    parser.add_argument("--output", help="results file (default benchmark_results/benchmark-<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results file to print deltas against")
+    return parser.parse_args()
+
+
+def configure_environment(args, workdir):
+    """Point the app at throwaway local state; must run before the app is imported"""
+    os.environ.update({
+        "OPENAI_API_KEY": "benchmark",
+        "PINECONE_API_KEY": "benchmark",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'benchmark.db')}",
+        "VECTOR_BACKEND": "local",
+        "LOCAL_INDEX_PATH": os.path.join(workdir, "vector_index"),
+        "INGEST_SPOOL_DIR": os.path.join(workdir, "ingest_spool"),
+        "ANSWER_CACHE_WARM": "0",
+        # Answers computed in the background after ingest would overlap the /ask runs
+        "PREWARM_ANSWERS": "false",
+    })
+    if not args.answer_cache:
+        # No question can clear a similarity above 1, so every /ask does the full work
+        os.environ["ANSWER_CACHE_THRESHOLD"] = "2"
+    if args.rag_only:
+        os.environ["BENEFITS_ANSWERS"] = "false"
+        os.environ["LEXICAL_FAST_PATH"] = "false"
+    sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+
+def fake_embeddings(dim, latency_ms):
+    from langchain_core.embeddings import Embeddings
+
+    class HashedEmbeddings(Embeddings):
+        """Bag-of-words vectors from hashed tokens: deterministic, and similar texts land close"""
+
+        def _vector(self, text):
+            vector = np.zeros(dim, dtype=np.float32)
+            for token in re.findall(r"[a-z0-9]+", text.lower()):
+                digest = hashlib.md5(token.encode("utf-8")).digest()
+                vector[int.from_bytes(digest[:4], "little") % dim] += 1.0 if digest[4] & 1 else -1.0
+            norm = np.linalg.norm(vector)
+            return (vector / norm if norm else vector).tolist()
+
+        def embed_documents(self, texts):
+            time.sleep(latency_ms / 1000)
+            return [self._vector(text) for text in texts]
+
+        def embed_query(self, text):
+            return self.embed_documents([text])[0]
+
+    return HashedEmbeddings()
+
+
+def memory_vector_store():
+    from vectorstores import SearchResult, VectorStore, matches_filter
+
+    class MemoryVectorStore(VectorStore):
+        """Brute-force cosine search over vectors held in memory"""
+
+        def __init__(self):
+            self.records = {}
+            self._lock = threading.Lock()
+            self._matrix = None
+
+        def upsert(self, ids, vectors, texts, metadatas, namespace=""):
+            with self._lock:
+                for vector_id, vector, text, metadata in zip(ids, vectors, texts, metadatas):
+                    vector = np.asarray(vector, dtype=np.float32)
+                    norm = np.linalg.norm(vector)
+                    self.records[vector_id] = (vector / norm if norm else vector, text, dict(metadata), namespace)
+                self._matrix = None
+
+        def search(self, vector, k=4, filter=None, namespaces=None):
+            namespaces = set(namespaces or [""])
+            with self._lock:
+                if self._matrix is None:
+                    self._ids = list(self.records)
+                    self._matrix = np.stack([self.records[i][0] for i in self._ids]) if self._ids else None
+                ids, matrix = self._ids, self._matrix
+            if matrix is None:
+                return []
+            scores = matrix @ np.asarray(vector, dtype=np.float32)
+            results = []
+            for row in np.argsort(-scores):
+                _, text, metadata, namespace = self.records[ids[row]]
+                if namespace not in namespaces or (filter and not matches_filter(metadata, filter)):
+                    continue
+                results.append(SearchResult(id=ids[row], score=float(scores[row]), text=text, metadata=metadata))
+                if len(results) == k:
+                    break
+            return results
+
+        def delete(self, ids=None, filter=None, namespace=""):
+            with self._lock:
+                for vector_id in list(ids or self.records):
+                    record = self.records.get(vector_id)
+                    if record and record[3] == namespace and (ids or matches_filter(record[2], filter or {})):
+                        self.records.pop(vector_id)
+                self._matrix = None
+
+        def count(self):
+            return len(self.records)
+
+    return MemoryVectorStore()
+
+
+def fake_tesseract(latency_ms):
+    def image_to_string(image, *args, **kwargs):
+        time.sleep(latency_ms / 1000)
+        return " ".join(POLICY_LINES[:6])
+
+    return image_to_string
+
+
+def start_fake_openai(args):
+    """Serve a minimal chat completions API on a free local port; returns its base URL"""
+    import uvicorn
+    from fastapi import FastAPI, Request
+    from fastapi.responses import StreamingResponse
+
+    api = FastAPI()
+    words = [f"word{i} " for i in range(args.answer_tokens - 1)] + ["[p1]."]
+
+    @api.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        await asyncio.sleep(args.llm_latency_ms / 1000)
+        if body.get("stream"):
+            async def events():
+                for word in words:
+                    chunk = {
+                        "id": "benchmark", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                        "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(args.token_delay_ms / 1000)
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(args.token_delay_ms * len(words) / 1000)
+        return {
+            "id": "benchmark", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+        }
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(api, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+def make_pdf(path, pages, scanned=False, seed=0):
+    """Synthetic policy booklet; scanned pages are images only, so extraction falls back to OCR"""
+    import fitz
+
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for page_num in range(pages):
+        lines = [f"Section {seed}.{page_num}.{i}: {rng.choice(POLICY_LINES)}" for i in range(30)]
+        text = "\n".join(lines)
+        page = doc.new_page()
+        if scanned:
+            scratch = fitz.open()
+            scratch.new_page().insert_textbox(fitz.Rect(50, 50, 560, 800), text, fontsize=9)
+            pixmap = scratch[0].get_pixmap(dpi=100)
+            page.insert_image(page.rect, pixmap=pixmap)
+            scratch.close()
+        else:
+            page.insert_textbox(fitz.Rect(50, 50, 560, 800), text, fontsize=9)
+    doc.save(path)
+    doc.close()
+
+
+def summarize(latencies_ms, elapsed_s, errors):
+    latencies = np.asarray(latencies_ms) if latencies_ms else np.zeros(1)
+    return {
+        "requests": len(latencies_ms) + errors,
+        "errors": errors,
+        "throughput_rps": len(latencies_ms) / elapsed_s if elapsed_s else 0.0,
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+    }
+
+
+async def bench_ingest(client, args, workdir):
+    results = []
+    seed = args.seed
+    for kind in args.kinds:
+        for pages in args.pages:
+            seed += 1
+            path = os.path.join(workdir, f"{kind}-{pages}.pdf")
+            make_pdf(path, pages, scanned=kind == "scanned", seed=seed)
+            with open(path, "rb") as f:
+                content = f.read()
+            start = time.perf_counter()
+            response = await client.post("/ingest", files={"file": (os.path.basename(path), content, "application/pdf")})
+            elapsed = time.perf_counter() - start
+            body = response.json()
+            result = {
+                "kind": kind,
+                "pages": pages,
+                "status": response.status_code,
+                "elapsed_ms": elapsed * 1000,
+                "pages_per_sec": pages / elapsed,
+                "chunks": body.get("chunks"),
+                "extract_ms": body.get("extract_ms"),
+                "extract_workers": body.get("extract_workers"),
+            }
+            results.append(result)
+            print(f"ingest {kind:8} {pages:5} pages  {result['elapsed_ms']:9.1f} ms  {result['pages_per_sec']:8.1f} pages/s")
+    return results
+
+
+async def ask_once(client, endpoint, question):
+    """Latency of one question in ms, and how the server answered it"""
+    start = time.perf_counter()
+    if endpoint == "stream":
+        first_token_ms = None
+        retrieval = None
+        async with client.stream("POST", "/ask/stream", json={"question": question}) as response:
+            response.raise_for_status()
+            event = None
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    if event == "token" and first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - start) * 1000
+                    elif event == "error":
+                        raise RuntimeError(json.loads(line[len("data: "):])["detail"])
+                    elif event == "done":
+                        retrieval = json.loads(line[len("data: "):]).get("retrieval")
+        return (time.perf_counter() - start) * 1000, retrieval, first_token_ms
+
+    response = await client.post("/ask", json={"question": question})
+    response.raise_for_status()
+    return (time.perf_counter() - start) * 1000, response.json().get("retrieval"), None
+
+
+async def bench_ask(client, args):
+    results = []
+    for endpoint in [endpoint for endpoint in args.endpoints if endpoint != "batch"]:
+        for concurrency in args.concurrency:
+            latencies, first_tokens, retrievals = [], [], {}
+            errors = 0
+            slots = asyncio.Semaphore(concurrency)
+
+            async def one(i):
+                nonlocal errors
+                async with slots:
+                    try:
+                        latency, retrieval, first_token = await ask_once(client, endpoint, QUESTIONS[i % len(QUESTIONS)])
+                    except Exception as e:
+                        errors += 1
+                        print(f"  request failed: {e}")
+                        return
+                latencies.append(latency)
+                retrievals[str(retrieval)] = retrievals.get(str(retrieval), 0) + 1
+                if first_token is not None:
+                    first_tokens.append(first_token)
+
+            start = time.perf_counter()
+            await asyncio.gather(*[one(i) for i in range(args.requests)])
+            result = {"endpoint": endpoint, "concurrency": concurrency, **summarize(latencies, time.perf_counter() - start, errors)}
+            if first_tokens:
+                result["first_token_p50_ms"] = float(np.percentile(first_tokens, 50))
+                result["first_token_p99_ms"] = float(np.percentile(first_tokens, 99))
+            result["retrieval"] = retrievals
+            results.append(result)
+            print(
+                f"{endpoint:6} c={concurrency:<3} p50 {result['p50_ms']:8.1f} ms  p99 {result['p99_ms']:8.1f} ms  "
+                f"{result['throughput_rps']:7.1f} req/s  errors {errors}"
+            )
+    return results
+
+
+async def bench_batch(client, args):
+    if "batch" not in args.endpoints:
+        return []
+    start = time.perf_counter()
+    response = await client.post("/ask/batch", json={"questions": QUESTIONS}, timeout=300)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    body = response.json() if response.status_code == 200 else {}
+    result = {
+        "questions": len(QUESTIONS),
+        "status": response.status_code,
+        "elapsed_ms": elapsed_ms,
+        "embed_ms": body.get("embed_ms"),
+        "unique_chunks": body.get("unique_chunks"),
+        "slowest_question_ms": max((item["latency_ms"] for item in body.get("results", [])), default=None),
+    }
+    print(f"batch  {len(QUESTIONS)} questions  {elapsed_ms:8.1f} ms")
+    return [result]
+
+
+async def run(args, workdir):
+    import httpx
+    import ocr
+    import app as backend
+
+    # Fake the pytesseract engine, even where tesserocr is installed
+    ocr.tesserocr = None
+    ocr.pytesseract.image_to_string = fake_tesseract(args.ocr_latency_ms)
+    backend.embeddings.embeddings = fake_embeddings(args.embed_dim, args.embed_latency_ms)
+    backend.vector_store.set(memory_vector_store())
+
+    transport = httpx.ASGITransport(app=backend.app)
+    async with backend.app.router.lifespan_context(backend.app):
+        # Startup only schedules the database setup; wait for it like a readiness probe would
+        await asyncio.gather(*backend.startup_tasks)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=300) as client:
+            ingest = await bench_ingest(client, args, workdir)
+            ask = await bench_ask(client, args)
+            batch = await bench_batch(client, args)
+    return {"ingest": ingest, "ask": ask, "batch": batch}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(results, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nCompared with {previous_path} ({previous.get('git_commit') or 'unknown commit'}):")
+    seed, previous_seed = results["config"]["seed"], previous.get("config", {}).get("seed")
+    if previous_seed != seed:
+        print(f"Note: that run used seed {previous_seed}, this one {seed}, so their PDFs differ")
+
+    def delta(new, old):
+        return f"{new:9.1f} vs {old:9.1f} ({(new - old) / old * 100:+.1f}%)" if old else f"{new:9.1f}"
+
+    old_ingest = {(r["kind"], r["pages"]): r for r in previous.get("ingest", [])}
+    for r in results["ingest"]:
+        old = old_ingest.get((r["kind"], r["pages"]))
+        if old:
+            print(f"ingest {r['kind']:8} {r['pages']:5} pages  pages/s {delta(r['pages_per_sec'], old['pages_per_sec'])}")
+    old_ask = {(r["endpoint"], r["concurrency"]): r for r in previous.get("ask", [])}
+    for r in results["ask"]:
+        old = old_ask.get((r["endpoint"], r["concurrency"]))
+        if old:
+            print(f"{r['endpoint']:6} c={r['concurrency']:<3} p50 {delta(r['p50_ms'], old['p50_ms'])}  p99 {delta(r['p99_ms'], old['p99_ms'])}")
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="benchmark-")
+    configure_environment(args, workdir)
+    os.environ["OPENAI_BASE_URL"] = start_fake_openai(args)
+
+    started_at = datetime.now()
+    results = asyncio.run(run(args, workdir))
+    report = {
+        "started_at": started_at.isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "config": vars(args),
+        **results,
+    }
+
+    output = args.output or os.path.join(ROOT, "benchmark_results", f"benchmark-{started_at:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,22 @@
 
 -- Database: docsage
 -- Tables will be created automatically:
--- - documents(id, filename, page_count, uploaded_at)
--- - queries(id, question, answer, latency_ms, created_at)
+-- - documents(id, filename, page_count, uploaded_at, content_hash, chunk_count, indexed, vector_namespace, version,
+--     ingest_ms, extract_ms, ocr_ms, ocr_pages, split_ms, embed_ms, upsert_ms, db_ms)
+-- - queries(id, question, answer, latency_ms, created_at, scope, sources,
+--     retrieval, embed_ms, retrieve_ms, prompt_ms, llm_ms)
+-- - page_texts(content_hash, page_num, text, ocr, page_hash)
+-- - document_chunks(id, document_id, chunk_index, page, page_end, text, embedding, version)
+-- - benefits(id, document_id, category, benefit_type, value, network, page, snippet)
+-- - lexical_postings(term, chunk_id, document_id, tf)
+-- - prewarmed_answers(document_id, question, answer, sources, created_at)
+-- - embedding_cache(key, model, embedding, created_at)
+-- - ingest_jobs(id, filename, file_path, document_id, status, pages_total, pages_done, chunks_total, chunks_embedded, result, error, created_at, updated_at)
+-- - index_builds(id, status, embedding_model, chunk_size, chunk_overlap, vector_backend, vector_target,
+--     documents_total, documents_done, chunks, created_at, updated_at, activated_at)
+-- - index_build_documents(build_id, document_id, content_hash, chunk_count, built_at)
+-- - reindex_chunks(build_id, id, document_id, chunk_index, page, page_end, text, embedding)
+-- - reindex_postings(build_id, term, chunk_id, document_id, tf)
+-- Reporting indexes (also created automatically): documents(filename), documents(uploaded_at), queries(created_at)
 
 -- This file is kept for reference and manual database operations if needed
@@ -1,5 +1,7 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import time
 from dotenv import load_dotenv
@@ -12,6 +14,104 @@ load_dotenv()
 # For local Docker Compose: use port 8001, for Render: use port 8000
 DEFAULT_BASE_URL = "http://localhost:8001" if os.getenv("RENDER") != "true" else "http://localhost:8000"
 BASE_URL = os.getenv("BASE_URL", DEFAULT_BASE_URL)
+# Seconds a backend health check is reused across reruns, and between ingest progress polls
+HEALTH_TTL_SECONDS = int(os.getenv("HEALTH_TTL_SECONDS", "15"))
+INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", "0.5"))
+
+@st.cache_resource
+def http_session():
+    """One pooled session shared by every rerun, so backend connections are kept alive"""
+    session = requests.Session()
+    # Only connection failures are retried; nothing has reached the backend at that point
+    retry = Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.5)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+session = http_session()
+
+@st.cache_data(ttl=HEALTH_TTL_SECONDS, show_spinner=False)
+def backend_health():
+    """("ready" | "starting" | "error", detail) from /health/ready"""
+    try:
+        response = session.get(f"{BASE_URL}/health/ready", timeout=5)
+    except requests.exceptions.RequestException as e:
+        return "error", str(e)
+    if response.status_code == 200:
+        return "ready", None
+    try:
+        checks = response.json().get("checks", {})
+        waiting = [name for name, check in checks.items() if not check.get("ready")]
+    except ValueError:
+        waiting = []
+    return "starting", ", ".join(waiting) or response.text
+
+def ingest_progress(job):
+    """Fraction of an ingest job done: extracting pages is the first half, embedding chunks the second"""
+    extracted = job["pages_done"] / job["pages_total"] if job.get("pages_total") else 0.0
+    embedded = job["chunks_embedded"] / job["chunks_total"] if job.get("chunks_total") else 0.0
+    return min(0.5 * extracted + 0.5 * embedded, 1.0)
+
+def track_ingest_job(job_id):
+    """Poll an ingest job, updating a progress bar, until it finishes"""
+    progress = st.progress(0.0, text="Queued...")
+    while True:
+        response = session.get(f"{BASE_URL}/ingest/jobs/{job_id}", timeout=10)
+        if response.status_code != 200:
+            st.session_state.ingest_job = None
+            st.error(f"❌ Error checking PDF processing: {response.text}")
+            return
+        job = response.json()
+        if job["status"] == "done":
+            st.session_state.ingest_job = None
+            st.session_state.document_info = job["result"]
+            progress.progress(1.0, text="Done")
+            st.success(f"✅ PDF processed successfully! ({job['result']['pages']} pages, {job['result']['chunks']} sections)")
+            return
+        if job["status"] == "failed":
+            st.session_state.ingest_job = None
+            progress.empty()
+            st.error(f"❌ Error processing PDF: {job['error']}")
+            return
+        if job["status"] == "queued":
+            text = "Queued..."
+        elif job.get("chunks_embedded"):
+            text = f"Indexing... {job['chunks_embedded']} sections embedded"
+        elif job.get("pages_total"):
+            text = f"Reading pages... {job['pages_done']}/{job['pages_total']}"
+        else:
+            text = "Processing PDF..."
+        progress.progress(ingest_progress(job), text=text)
+        time.sleep(INGEST_POLL_SECONDS)
+
+def stream_answer(payload, placeholder):
+    """Call /ask/stream and render answer tokens into `placeholder` as they arrive.
+
+    Returns the final event (answer, latency_ms, stages) plus the sources.
+    """
+    answer = ""
+    result = {"sources": []}
+    event = None
+    with session.post(f"{BASE_URL}/ask/stream", json=payload, stream=True, timeout=120) as response:
+        if response.status_code != 200:
+            raise RuntimeError(response.text)
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if event == "sources":
+                    result["sources"] = data["sources"]
+                elif event == "token":
+                    answer += data["text"]
+                    placeholder.markdown(answer + "▌")
+                elif event == "done":
+                    result.update(data)
+                elif event == "error":
+                    raise RuntimeError(data["detail"])
+    placeholder.markdown(answer)
+    return result
 
 # Page configuration
 st.set_page_config(
@@ -24,41 +124,26 @@ st.set_page_config(
 st.title("🏥 AI Medical Insurance Coverage Checker")
 st.markdown("Upload your insurance policy PDF and ask questions about coverage, copays, and benefits.")
 
-# Check backend status
-backend_status = "unknown"
-max_retries = 3
-retry_delay = 2
-
-for attempt in range(max_retries):
-    try:
-        response = requests.get(f"{BASE_URL}/health", timeout=10)
-        if response.status_code == 200:
-            st.success("✅ Backend is connected and ready")
-            backend_status = "connected"
-            break
-        else:
-            st.warning("⚠️ Backend is responding but may have issues")
-            backend_status = "warning"
-            break
-    except requests.exceptions.ConnectionError as e:
-        if attempt < max_retries - 1:
-            st.warning(f"⚠️ Backend not ready (attempt {attempt + 1}/{max_retries}). Retrying in {retry_delay} seconds...")
-            time.sleep(retry_delay)
-        else:
-            st.error(f"❌ Cannot connect to backend after {max_retries} attempts: {str(e)}")
-            st.info(f"Backend URL: {BASE_URL}")
-            st.info("🔄 The backend may still be starting up. Please wait a moment and refresh the page.")
-            backend_status = "error"
-    except Exception as e:
-        st.error(f"❌ Error connecting to backend: {str(e)}")
-        backend_status = "error"
-        break
+# Check backend status (cached, so reruns don't hit the backend every time)
+backend_status, backend_detail = backend_health()
+if backend_status == "ready":
+    st.success("✅ Backend is connected and ready")
+elif backend_status == "starting":
+    st.warning(f"⚠️ Backend is starting up, waiting for: {backend_detail}")
+else:
+    st.error(f"❌ Cannot connect to backend: {backend_detail}")
+    st.info(f"Backend URL: {BASE_URL}")
+if backend_status != "ready" and st.button("🔄 Check again"):
+    backend_health.clear()
+    st.rerun()
 
 # Initialize session state
 if 'uploaded_file' not in st.session_state:
     st.session_state.uploaded_file = None
 if 'document_info' not in st.session_state:
     st.session_state.document_info = None
+if 'ingest_job' not in st.session_state:
+    st.session_state.ingest_job = None
 
 # Section A: PDF Upload
 st.header("📄 Upload Insurance Policy PDF")
@@ -74,41 +159,24 @@ if uploaded_file is not None:
     st.session_state.uploaded_file = uploaded_file
     
     if st.button("📤 Process PDF", type="primary"):
-        with st.spinner("Processing PDF..."):
-            try:
-                # Prepare file for upload
-                files = {'file': (uploaded_file.name, uploaded_file.getvalue(), 'application/pdf')}
-                
-                # Try to connect to backend with retries
-                max_retries = 3
-                for attempt in range(max_retries):
-                    try:
-                        # Call backend ingest endpoint
-                        response = requests.post(f"{BASE_URL}/ingest", files=files, timeout=30)
-                        
-                        if response.status_code == 200:
-                            result = response.json()
-                            st.session_state.document_info = result
-                            
-                            st.success(f"✅ PDF processed successfully! ({result['pages']} pages, {result['chunks']} sections)")
-                            break
-                        else:
-                            st.error(f"❌ Error processing PDF: {response.text}")
-                            break
-                            
-                    except requests.exceptions.ConnectionError as e:
-                        if attempt < max_retries - 1:
-                            st.warning(f"⚠️ Backend not ready (attempt {attempt + 1}/{max_retries}). Retrying...")
-                            time.sleep(2)
-                        else:
-                            st.error(f"❌ Cannot connect to backend after {max_retries} attempts: {str(e)}")
-                            st.info("Please wait a moment and try again, or refresh the page.")
-                    except Exception as e:
-                        st.error(f"❌ Error: {str(e)}")
-                        break
-                    
-            except Exception as e:
-                st.error(f"❌ Error: {str(e)}")
+        try:
+            # Queued as a background job, so the upload returns as soon as the file is sent
+            files = {'file': (uploaded_file.name, uploaded_file.getvalue(), 'application/pdf')}
+            response = session.post(f"{BASE_URL}/ingest/jobs", files=files, timeout=60)
+            if response.status_code == 202:
+                st.session_state.ingest_job = response.json()["job_id"]
+            else:
+                st.error(f"❌ Error processing PDF: {response.text}")
+        except requests.exceptions.RequestException as e:
+            st.error(f"❌ Cannot connect to backend: {str(e)}")
+            st.info("Please wait a moment and try again, or refresh the page.")
+
+# Keeps tracking a job across reruns until it finishes
+if st.session_state.ingest_job:
+    try:
+        track_ingest_job(st.session_state.ingest_job)
+    except requests.exceptions.RequestException as e:
+        st.error(f"❌ Lost connection while processing PDF: {str(e)}")
 
 # Section B: Ask Questions
 st.header("❓ Ask Questions About Your Coverage")
@@ -126,32 +194,25 @@ if st.session_state.document_info:
     
     # Simple ask button
     if st.button("🔍 Ask Question", type="primary") and question:
-        with st.spinner("Searching for answer..."):
-            try:
-                # Call backend ask endpoint with default settings
-                payload = {
-                    "question": question,
-                    "k": 4  # Default value
-                }
+        try:
+            # Call backend streaming ask endpoint with default settings
+            payload = {
+                "question": question,
+                "k": 4,  # Default value
+                # Answer from the uploaded policy only, not every document in the index
+                "document_id": st.session_state.document_info['document_id']
+            }
+            
+            # Display answer in a clean format, token by token as it is generated
+            st.subheader("💡 Answer")
+            result = stream_answer(payload, st.empty())
+            
+            # Display sources in a simple format
+            if result['sources']:
+                st.caption(f"📚 Sources: {len(result['sources'])} pages referenced")
                 
-                response = requests.post(f"{BASE_URL}/ask", json=payload)
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    
-                    # Display answer in a clean format
-                    st.subheader("💡 Answer")
-                    st.write(result['answer'])
-                    
-                    # Display sources in a simple format
-                    if result['sources']:
-                        st.caption(f"📚 Sources: {len(result['sources'])} pages referenced")
-                    
-                else:
-                    st.error(f"❌ Error getting answer: {response.text}")
-                    
-            except Exception as e:
-                st.error(f"❌ Error: {str(e)}")
+        except Exception as e:
+            st.error(f"❌ Error getting answer: {str(e)}")
     
     # Example questions in a cleaner layout
     st.subheader("💡 Example Questions")
@@ -177,6 +238,33 @@ if st.session_state.document_info:
                 st.session_state.example_question = example
                 st.rerun()
     
+    # Answer every example question in one batch request
+    if st.button("📋 Answer All Example Questions", key="answer_all", use_container_width=True):
+        try:
+            with st.spinner("Answering all example questions..."):
+                response = session.post(
+                    f"{BASE_URL}/ask/batch",
+                    json={
+                        "questions": example_questions,
+                        "k": 4,
+                        "document_id": st.session_state.document_info['document_id']
+                    },
+                    timeout=180
+                )
+            if response.status_code == 200:
+                batch = response.json()
+                st.caption(f"⏱️ Answered {len(batch['results'])} questions in {batch['latency_ms']:.0f}ms")
+                for item in batch['results']:
+                    with st.expander(item['question']):
+                        if item.get('error'):
+                            st.error(item['error'])
+                        else:
+                            st.markdown(item['answer'])
+            else:
+                st.error(f"❌ Error: {response.text}")
+        except Exception as e:
+            st.error(f"❌ Error getting answers: {str(e)}")
+    
     # Clear example question
     if st.session_state.get('example_question'):
         if st.button("🗑️ Clear Question", key="clear_example", use_container_width=True):
@@ -213,10 +301,11 @@ with st.expander("⚙️ Advanced Settings"):
                 try:
                     payload = {
                         "question": advanced_question,
-                        "k": k_chunks
+                        "k": k_chunks,
+                        "document_id": st.session_state.document_info['document_id']
                     }
                     
-                    response = requests.post(f"{BASE_URL}/ask", json=payload)
+                    response = session.post(f"{BASE_URL}/ask", json=payload, timeout=120)
                     
                     if response.status_code == 200:
                         result = response.json()
@@ -235,7 +324,10 @@ with st.expander("⚙️ Advanced Settings"):
                         if result['sources']:
                             st.subheader("📚 Detailed Sources")
                             for i, source in enumerate(result['sources']):
-                                st.info(f"**Source {i+1}:** {source['source']} - Page {source['page']}")
+                                pages = source['page']
+                                if source.get('page_end') and source['page_end'] != source['page']:
+                                    pages = f"{source['page']}-{source['page_end']}"
+                                st.info(f"**Source {i+1}:** {source['source']} - Page {pages}")
                         
                     else:
                         st.error(f"❌ Error: {response.text}")
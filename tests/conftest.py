@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The backend modules import each other as top-level modules, as they do when app.py runs from backend/
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+# Offline settings, set before the backend modules read them at import
+WORKDIR = tempfile.mkdtemp(prefix="docsage-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(WORKDIR, 'test.db')}",
+    "VECTOR_BACKEND": "local",
+    "LOCAL_INDEX_PATH": os.path.join(WORKDIR, "vector_index"),
+    "INGEST_SPOOL_DIR": os.path.join(WORKDIR, "ingest_spool"),
+    "OPENAI_API_KEY": "test",
+    "PINECONE_API_KEY": "test",
+    "ANSWER_CACHE_WARM": "0",
+    "PREWARM_ANSWERS": "false",
+    "EXTRACT_WORKERS": "1",
+})
+
+
+class FakeEmbeddings:
+    """Deterministic embeddings derived from the text, counting calls and texts"""
+
+    def __init__(self, dimensions=32):
+        self.dimensions = dimensions
+        self.calls = 0
+        self.texts = 0
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+        return np.random.default_rng(seed).standard_normal(self.dimensions).tolist()
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.texts += len(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class FakeChat:
+    """Stands in for the AsyncOpenAI client; answers every prompt the same way, after `delay` seconds"""
+
+    answer = ["The copay ", "is $30 ", "[p1]."]
+
+    def __init__(self):
+        self.chat = self
+        self.completions = self
+        self.calls = 0
+        self.delay = 0.0
+
+    async def create(self, stream=False, **kwargs):
+        self.calls += 1
+        if stream:
+            return self._stream()
+        await asyncio.sleep(self.delay)
+        message = type("Message", (), {"content": "".join(self.answer)})()
+        return type("Response", (), {"choices": [type("Choice", (), {"message": message})()]})()
+
+    async def _stream(self):
+        for text in self.answer:
+            await asyncio.sleep(self.delay / len(self.answer))
+            delta = type("Delta", (), {"content": text})()
+            yield type("Chunk", (), {"choices": [type("Choice", (), {"delta": delta})()]})()
+
+    async def close(self):
+        pass
+
+
+class Api:
+    """The app running in one event loop for the whole session, with an HTTP client against it"""
+
+    def __init__(self, runner, client, app):
+        self.runner = runner
+        self.client = client
+        self.app = app
+
+    def run(self, coro):
+        return self.runner.run(coro)
+
+    def get(self, path, **kwargs):
+        return self.run(self.client.get(path, **kwargs))
+
+    def post(self, path, **kwargs):
+        return self.run(self.client.post(path, **kwargs))
+
+    def ingest(self, path, **data):
+        with open(path, "rb") as f:
+            content = f.read()
+        return self.post("/ingest", files={"file": (os.path.basename(path), content, "application/pdf")}, data=data)
+
+
+@pytest.fixture(scope="session")
+def api():
+    """The FastAPI app with fake OpenAI clients, started once.
+
+    Its executors are shut down with the app, so the lifespan can't be
+    entered twice in one process; every test shares this one.
+    """
+    import httpx
+    import app as backend
+
+    backend.embeddings.embeddings = FakeEmbeddings()
+    backend.openai_client = FakeChat()
+    # Debug mode makes asyncio raise on calls into the loop from other threads
+    runner = asyncio.Runner(debug=True)
+    lifespan = backend.app.router.lifespan_context(backend.app)
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=backend.app), base_url="http://test", timeout=60)
+
+    async def start():
+        await lifespan.__aenter__()
+        while (await client.get("/health/ready")).status_code != 200:
+            await asyncio.sleep(0.05)
+
+    runner.run(start())
+    yield Api(runner, client, backend)
+    runner.run(client.aclose())
+    runner.run(lifespan.__aexit__(None, None, None))
+    runner.close()
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+@pytest.fixture
+def make_pdf(tmp_path):
+    """Write a PDF with one page per string in `pages`"""
+    def make(name, pages):
+        import fitz
+        path = str(tmp_path / name)
+        doc = fitz.open()
+        for text in pages:
+            doc.new_page().insert_text((50, 60), text, fontsize=10)
+        doc.save(path)
+        doc.close()
+        return path
+    return make
@@ -0,0 +1,50 @@
+import time
+
+import numpy as np
+
+from answer_cache import GLOBAL_SCOPE, AnswerCache, scope_key
+
+
+def unit(seed, dimensions=32):
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return vector / np.linalg.norm(vector)
+
+
+def test_similar_question_hits_only_in_its_scope():
+    cache = AnswerCache(threshold=0.95)
+    question = unit(1)
+    scope = scope_key(["doc-b", "doc-a"])
+    cache.store(scope, question, "Is an MRI covered?", "Yes, with prior authorization.", [], ["doc-a"])
+
+    # A rewording embeds close to the cached question
+    similar = question + 0.05 * unit(2)
+    hit = cache.lookup(scope_key(["doc-a", "doc-b"]), similar)
+    assert hit is not None and hit.answer == "Yes, with prior authorization."
+    assert cache.lookup(scope, unit(3)) is None
+
+    # The same question against other documents, or all of them, is a different question
+    assert cache.lookup(scope_key(["doc-a"]), question) is None
+    assert cache.lookup(GLOBAL_SCOPE, question) is None
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_reingested_document_invalidates_its_answers():
+    cache = AnswerCache()
+    cache.store(scope_key(["doc-a"]), unit(1), "Is an MRI covered?", "Yes.", [], ["doc-a"])
+    cache.store(scope_key(["doc-b"]), unit(2), "Is an MRI covered?", "No.", [], ["doc-b"])
+    cache.store(GLOBAL_SCOPE, unit(3), "Are MRIs covered?", "It depends on the plan.", [], ["doc-b"])
+
+    assert cache.invalidate_document("doc-a") == 2
+    assert cache.lookup(scope_key(["doc-a"]), unit(1)) is None
+    assert cache.lookup(GLOBAL_SCOPE, unit(3)) is None
+    assert cache.lookup(scope_key(["doc-b"]), unit(2)).answer == "No."
+
+
+def test_expired_best_match_does_not_hide_a_fresh_one():
+    cache = AnswerCache(threshold=0.9, ttl_seconds=60)
+    question = unit(1)
+    cache.store("doc", question, "Is an MRI covered?", "Old answer.", [], ["doc"], created_at=time.time() - 120)
+    cache.store("doc", question + 0.1 * unit(2), "Are MRIs covered?", "New answer.", [], ["doc"])
+
+    assert cache.lookup("doc", question).answer == "New answer."
+    assert cache.stats()["entries"] == 1
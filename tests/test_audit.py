@@ -0,0 +1,54 @@
+import time
+
+from audit import AuditWriter
+from database import Query
+
+
+class FlakySession:
+    """Session factory whose first `failures` sessions fail, recording when each was opened and the rows written"""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.attempts = []
+        self.rows = []
+
+    def __call__(self):
+        self.attempts.append(time.monotonic())
+        if len(self.attempts) <= self.failures:
+            raise ConnectionError("database unavailable")
+        return self
+
+    def execute(self, statement, rows):
+        self.rows.extend(rows)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_failed_flush_waits_out_its_backoff():
+    sessions = FlakySession(failures=1)
+    writer = AuditWriter(sessions, batch_size=5, flush_interval=0.3, max_backoff=1.0)
+    writer.start()
+    for i in range(5):
+        writer.add(Query, id=f"q{i}")
+    while not sessions.attempts:
+        time.sleep(0.01)
+
+    # A full batch arriving during the backoff doesn't bring the retry forward
+    for i in range(5, 20):
+        writer.add(Query, id=f"q{i}")
+    time.sleep(0.15)
+    assert len(sessions.attempts) == 1
+
+    deadline = time.monotonic() + 5
+    while len(sessions.rows) < 20 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    writer.stop()
+    assert [row["id"] for row in sessions.rows] == [f"q{i}" for i in range(20)]
+    assert sessions.attempts[1] - sessions.attempts[0] >= 0.3
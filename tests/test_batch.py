@@ -0,0 +1,33 @@
+def test_batch_retrieves_questions_together(api, make_pdf, monkeypatch):
+    pdf = make_pdf("batch.pdf", [
+        f"Batch test plan BT-3, page {n}.\nOrthodontic braces and retainers are covered in section {n}." for n in range(1, 5)
+    ])
+    document_id = api.ingest(pdf).json()["document_id"]
+
+    fetches = []
+    fetch = api.app.lexical_index.fetch
+    monkeypatch.setattr(api.app.lexical_index, "fetch", lambda ids: fetches.append(ids) or fetch(ids))
+    questions = [
+        "How are orthodontic braces covered under the batch test plan?",
+        "Which sections of plan BT-3 describe retainers and braces?",
+        "What does the batch test plan say about orthodontic retainers?",
+    ]
+    body = api.post("/ask/batch", json={"questions": questions, "k": 3, "document_id": document_id}).json()
+
+    results = body["results"]
+    assert [item["question"] for item in results] == questions
+    assert all(item["answer"] and item["retrieve_ms"] is not None for item in results)
+    # Every question draws from the document's four chunks, each kept once across the batch
+    assert 0 < body["unique_chunks"] <= 4
+    assert len(fetches) <= 1
+
+
+def test_null_k_uses_the_default(api, make_pdf):
+    pdf = make_pdf("null-k.pdf", [f"Null k test plan NK-{n}.\nAllergy testing is covered in full." for n in range(3)])
+    document_id = api.ingest(pdf).json()["document_id"]
+    question = "Is allergy testing covered in full by the null k test plan?"
+
+    response = api.post("/ask", json={"question": question, "k": None, "document_id": document_id})
+    assert response.status_code == 200 and response.json()["sources"]
+    batch = api.post("/ask/batch", json={"questions": [question], "k": None, "document_id": document_id})
+    assert batch.status_code == 200 and not batch.json()["results"][0]["error"]
@@ -0,0 +1,90 @@
+import os
+
+import fitz
+import pytest
+
+from benefits import extract_benefits, match_question
+from extraction import page_benefits
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def policy_page(tmp_path):
+    """test_policy.txt rendered as a one-page PDF"""
+    with open(os.path.join(ROOT, "test_policy.txt")) as f:
+        text = f.read()
+    path = str(tmp_path / "policy.pdf")
+    doc = fitz.open()
+    doc.new_page().insert_text((50, 60), text, fontsize=10)
+    doc.save(path)
+    doc.close()
+    doc = fitz.open(path)
+    yield doc[0]
+    doc.close()
+
+
+def values(rows):
+    return {(row.category, row.benefit_type, row.value) for row in rows}
+
+
+def test_policy_figures(policy_page):
+    rows = values(page_benefits(policy_page, policy_page.get_text()))
+    assert rows == {
+        ("imaging", "copay", "$50"),
+        ("emergency_room", "copay", "$100"),
+        ("specialist", "copay", "$30"),
+        ("general", "deductible", "$1,000"),
+        ("general", "out_of_pocket_max", "$5,000"),
+        ("prescription_drugs", "copay", "$10 (Generic)"),
+        ("prescription_drugs", "copay", "$25 (Brand Name)"),
+        ("prescription_drugs", "copay", "$50 (Specialty)"),
+        ("mental_health", "copay", "$20"),
+        ("physical_therapy", "copay", "$25"),
+    }
+
+
+def test_scanned_policy_text():
+    # OCR text arrives as one block
+    with open(os.path.join(ROOT, "test_policy.txt")) as f:
+        rows = values(extract_benefits([f.read()]))
+    assert ("general", "deductible", "$1,000") in rows
+    assert ("general", "out_of_pocket_max", "$5,000") in rows
+    assert ("emergency_room", "copay", "$100") in rows
+
+
+def test_values_stay_in_their_clause():
+    rows = values(extract_benefits([
+        "Specialist visits: $30 copay; coinsurance for imaging is 20%\nOut-of-pocket maximum: $5,000"
+    ]))
+    assert rows == {
+        ("specialist", "copay", "$30"),
+        ("imaging", "coinsurance", "20%"),
+        ("general", "out_of_pocket_max", "$5,000"),
+    }
+
+
+def test_wrapped_line_is_joined():
+    rows = values(extract_benefits(["The annual deductible for this plan\nis $1,500 per person."]))
+    assert rows == {("general", "deductible", "$1,500")}
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("What's the copay for emergency room visits?", ("emergency_room", "copay")),
+    ("What's the annual deductible?", ("general", "deductible")),
+    ("How much is the specialist copay?", ("specialist", "copay")),
+    ("out-of-pocket maximum", ("general", "out_of_pocket_max")),
+])
+def test_value_questions_match(question, expected):
+    assert match_question(question) == expected
+
+
+@pytest.mark.parametrize("question", [
+    "Is my ER copay waived if I'm admitted?",
+    "Does the deductible apply to generic drugs?",
+    "Do I still pay the specialist copay after meeting the deductible?",
+    "What's the ER copay if I'm admitted?",
+    "Is MRI covered under this policy?",
+])
+def test_yes_no_and_conditional_questions_fall_through(question):
+    assert match_question(question) is None
@@ -0,0 +1,126 @@
+import asyncio
+import json
+from contextlib import aclosing
+
+from admission import AdmissionLimiter, SingleFlight
+
+
+def sse_events(body):
+    """(event, data) pairs of a Server-Sent Events response body"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_identical_questions_share_one_completion(api, make_pdf):
+    pdf = make_pdf("coalesce.pdf", [
+        f"Coalescing test plan CT-{n}.\nVision exams are covered once a year." for n in range(3)
+    ])
+    document_id = api.ingest(pdf).json()["document_id"]
+    chat = api.app.openai_client
+    calls, chat.delay = chat.calls, 0.2
+    questions = [
+        {"question": "How often are vision exams covered by the coalescing test plan?", "document_id": document_id},
+        {"question": "how often are vision exams covered by the coalescing test plan", "document_id": document_id},
+    ]
+
+    async def ask_together():
+        return await asyncio.gather(*[api.client.post("/ask", json=questions[i % 2]) for i in range(5)])
+
+    try:
+        responses = api.run(ask_together())
+    finally:
+        chat.delay = 0.0
+    assert chat.calls - calls == 1
+    bodies = [response.json() for response in responses]
+    assert {body["answer"] for body in bodies} == {"The copay is $30 [p1]."}
+    assert sorted(body["coalesced"] for body in bodies) == [False, True, True, True, True]
+    assert len(api.app.ask_flights) == 0
+
+
+def test_completions_beyond_the_queue_are_rejected(api, make_pdf, monkeypatch):
+    pdf = make_pdf("admission.pdf", [
+        f"Admission test plan AT-{n}.\nChiropractic care is covered for twelve visits." for n in range(3)
+    ])
+    document_id = api.ingest(pdf).json()["document_id"]
+    monkeypatch.setattr(api.app, "llm_limiter", AdmissionLimiter("completion model", max_concurrency=1, max_queue=1))
+    chat = api.app.openai_client
+    calls, chat.delay = chat.calls, 0.3
+    questions = [
+        f"Question {n}: how many chiropractic visits does the admission test plan cover?" for n in range(4)
+    ]
+
+    async def ask_together():
+        return await asyncio.gather(*[
+            api.client.post("/ask", json={"question": question, "document_id": document_id}) for question in questions
+        ])
+
+    try:
+        responses = api.run(ask_together())
+    finally:
+        chat.delay = 0.0
+    # One completion runs, one waits for it, and the rest are turned away straight away
+    assert sorted(response.status_code for response in responses) == [200, 200, 429, 429]
+    assert chat.calls - calls == 2
+    rejected = [response for response in responses if response.status_code == 429]
+    assert all(int(response.headers["Retry-After"]) >= 1 for response in rejected)
+
+
+def test_identical_streamed_questions_share_one_completion(api, make_pdf):
+    pdf = make_pdf("stream.pdf", [
+        f"Stream test plan ST-{n}.\nHearing aids are covered once every three years." for n in range(3)
+    ])
+    document_id = api.ingest(pdf).json()["document_id"]
+    chat = api.app.openai_client
+    calls, chat.delay = chat.calls, 0.3
+    question = {"question": "How often does the stream test plan cover new hearing aids?", "document_id": document_id}
+
+    async def ask_together():
+        first = asyncio.ensure_future(api.client.post("/ask/stream", json=question))
+        # The others arrive while the first is already streaming
+        await asyncio.sleep(0.15)
+        later = [asyncio.ensure_future(api.client.post("/ask/stream", json=question)) for _ in range(2)]
+        return await asyncio.gather(first, *later)
+
+    try:
+        responses = api.run(ask_together())
+    finally:
+        chat.delay = 0.0
+    assert chat.calls - calls == 1
+
+    coalesced = []
+    for response in responses:
+        events = sse_events(response.text)
+        assert [event for event, _ in events] == ["sources", "token", "token", "token", "done"]
+        assert "".join(data["text"] for event, data in events if event == "token") == "The copay is $30 [p1]."
+        coalesced.append(events[-1][1]["coalesced"])
+    assert coalesced == [False, True, True]
+    assert len(api.app.ask_flights) == 0
+
+
+def test_shared_stream_stops_once_every_caller_has_gone():
+    async def main():
+        flights = SingleFlight()
+        produced = []
+
+        async def events():
+            for i in range(20):
+                produced.append(i)
+                yield i
+                await asyncio.sleep(0.01)
+
+        first, _ = flights.stream("key", events)
+        second, shared = flights.stream("key", events)
+        assert shared
+        for stream in (first, second):
+            async with aclosing(stream):
+                async for event in stream:
+                    if event == 2:
+                        break
+        await asyncio.sleep(0.05)
+        return produced, len(flights)
+
+    produced, in_flight = asyncio.run(main())
+    assert len(produced) < 20 and in_flight == 0
@@ -0,0 +1,46 @@
+import random
+
+from context import ContextBuilder
+from vectorstores import SearchResult
+
+
+def passage_text(seed, sentences=30):
+    rng = random.Random(seed)
+    words = ["coverage", "deductible", "copay", "network", "provider", "claim", "benefit", "member", "therapy", "plan"]
+    return " ".join(" ".join(rng.choice(words) for _ in range(12)).capitalize() + "." for _ in range(sentences))
+
+
+def hit(chunk_id, text, document_id, page):
+    return SearchResult(
+        id=chunk_id, score=0.0, text=text, metadata={"document_id": document_id, "page": page, "source": "plan.pdf"}
+    )
+
+
+def test_consecutive_chunks_are_merged_without_their_overlap():
+    text = passage_text(1)
+    first, second = text[:600], text[400:]
+    builder = ContextBuilder("gpt-4o-mini", token_budget=5000)
+    # Ranked out of order, and with the same chunk twice
+    hits = [hit("doc-1", second, "doc", 3), hit("doc-0", first, "doc", 2), hit("doc-1", second, "doc", 3)]
+    context = builder.build(hits)
+
+    assert context.text == f"Pages 2-3:\n{text}"
+    assert context.sources == [{"page": 2, "page_end": 3, "source": "plan.pdf"}]
+
+
+def test_best_passages_fill_the_budget_first():
+    builder = ContextBuilder("gpt-4o-mini")
+    texts = [passage_text(seed) for seed in (10, 11, 12)]
+    hits = [hit(f"doc{n}-0", text, f"doc{n}", n + 1) for n, text in enumerate(texts)]
+    budget = builder.count_tokens(texts[0]) + builder.count_tokens(texts[1]) // 2
+    context = builder.build(hits, token_budget=budget)
+
+    assert context.tokens <= budget
+    assert builder.count_tokens(context.text) <= budget + 1
+    # The best hit is kept whole, the next is cut at a sentence, and the last no longer fits
+    best, cut = context.text.split("\n\n")
+    assert best == f"Page 1:\n{texts[0]}"
+    assert cut.startswith("Page 2:\n") and texts[1].startswith(cut[len("Page 2:\n"):]) and cut.endswith(".")
+    assert (context.truncated, context.dropped) == (1, 1)
+    assert [source["page"] for source in context.sources] == [1, 2]
+    assert context.document_ids == {"doc0", "doc1"}
@@ -0,0 +1,35 @@
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from conftest import FakeEmbeddings
+from database import Base
+from embedding_cache import CachedEmbeddings
+
+
+def make_cache(tmp_path, max_entries):
+    engine = create_engine(f"sqlite:///{tmp_path / 'embeddings.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    return CachedEmbeddings(FakeEmbeddings(), "test-model", sessionmaker(bind=engine), max_entries=max_entries)
+
+
+def test_evicted_embeddings_come_from_the_database(tmp_path):
+    cache = make_cache(tmp_path, max_entries=2)
+    first = cache.embed_query("What's the annual deductible?")
+    cache.embed_documents(["Specialist visits: $45 copay", "Emergency room: $250 copay"])
+    assert cache.stats()["entries_in_memory"] == 2
+    assert cache.embeddings.texts == 3
+
+    # Evicted from the LRU, but found in the embedding_cache table, so the model isn't called again
+    again = cache.embed_query("  what's the ANNUAL deductible? ")
+    assert np.allclose(again, first)
+    assert cache.embeddings.texts == 3
+    assert (cache.memory_hits, cache.db_hits, cache.misses) == (0, 1, 3)
+    # ...and it is back in memory for the next lookup
+    cache.embed_documents(["What's the annual deductible?"])
+    assert cache.memory_hits == 1
+
+    # Another model's cache shares the table but not the vectors
+    other = cache.for_model("other-model", FakeEmbeddings())
+    other.embed_query("What's the annual deductible?")
+    assert other.misses == 1 and other.db_hits == 0
@@ -0,0 +1,36 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import extraction
+
+
+def extract(path, pages):
+    async def collect():
+        return [result async for result in extraction.iter_extracted_pages(path, range(pages))]
+    return asyncio.run(collect())
+
+
+def test_broken_pool_is_replaced(make_pdf, monkeypatch):
+    monkeypatch.setattr(extraction, "EXTRACT_WORKERS", 2)
+    monkeypatch.setattr(extraction, "EXTRACT_BATCH_PAGES", 1)
+    broken = ProcessPoolExecutor(max_workers=2)
+    monkeypatch.setattr(extraction, "_pool", broken)
+    # A worker killed (as by the OOM killer) breaks the pool for every later task
+    with pytest.raises(BrokenProcessPool):
+        broken.submit(os._exit, 1).result()
+
+    pdf = make_pdf("broken-pool.pdf", [f"Extraction test page {n}." for n in range(5)])
+    try:
+        results = extract(pdf, 5)
+        assert [result.page_num for result in results] == list(range(5))
+        assert results[3].text == "Extraction test page 3."
+        pool = extraction.get_pool()
+        assert pool is not broken
+        # ...and it keeps serving later documents
+        assert len(extract(pdf, 5)) == 5 and extraction.get_pool() is pool
+    finally:
+        extraction.shutdown_pool()
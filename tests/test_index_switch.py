@@ -0,0 +1,30 @@
+import dataclasses
+
+from vectorstores import LocalVectorStore
+
+
+def test_requests_keep_the_index_they_started_with(api, tmp_path):
+    backend = api.app
+    index = backend.served_index()
+    settings, store = backend.active_index, backend.vector_store.value
+    other = LocalVectorStore(str(tmp_path / "other"))
+    try:
+        # What refresh_index() does when reindex.py activates a build with another model
+        backend.vector_store.set(other)
+        backend.use_index(dataclasses.replace(settings, embedding_model="other-model", build_id="other-build"))
+
+        served = backend.served_index()
+        assert served.store is other and served.embeddings.model == "other-model"
+        # A request that started before the switch still embeds and searches in the old build
+        assert index.store is store and index.embeddings.model == settings.embedding_model
+        assert not backend.still_served(index)
+
+        # ...and its answer, found with the old model's vector, stays out of the cache
+        backend.store_answer(index, "switch-scope", [1.0] * 32, "Switched question?", "answer", [], [])
+        assert backend.answer_cache.lookup_question("switch-scope", "Switched question?") is None
+        assert backend.lookup_answer(index, "switch-scope", [1.0] * 32) is None
+    finally:
+        backend.vector_store.set(store)
+        backend.active_index = settings
+        backend.embeddings = index.embeddings
+    assert backend.still_served(index)
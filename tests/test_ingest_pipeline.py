@@ -0,0 +1,72 @@
+import random
+import time
+
+import pytest
+
+from database import SessionLocal, Document
+
+
+def policy_page(seed):
+    """A few chunks of text, different for every seed"""
+    rng = random.Random(seed)
+    words = ["inpatient", "outpatient", "referral", "formulary", "premium", "dependent", "hospice", "imaging"]
+    lines = [" ".join(rng.choice(words) for _ in range(10)) + "." for _ in range(36)]
+    return f"Pipeline test plan PT-{seed}.\n" + "\n".join(lines)
+
+
+def test_slow_upserts_hold_back_extraction(api, make_pdf, monkeypatch):
+    backend = api.app
+    monkeypatch.setattr(backend, "EMBED_BATCH_SIZE", 2)
+    monkeypatch.setattr(backend, "PIPELINE_QUEUE_SIZE", 1)
+    store = backend.vector_store.value
+    upsert = store.upsert
+
+    def slow_upsert(*args, **kwargs):
+        time.sleep(0.01)
+        return upsert(*args, **kwargs)
+
+    monkeypatch.setattr(store, "upsert", slow_upsert)
+    progress = {"chunks_total": 0, "chunks_embedded": 0}
+    lag = []
+
+    def record(**fields):
+        progress.update(fields)
+        lag.append(progress["chunks_total"] - progress["chunks_embedded"])
+
+    pdf = make_pdf("pipeline.pdf", [policy_page(seed) for seed in range(20)])
+    result = api.run(backend.run_ingest(pdf, "pipeline.pdf", progress=record))
+
+    assert result.chunks > 40 and progress["chunks_embedded"] == result.chunks
+    # At most a batch in each queue and one in each of the embed and upsert stages, plus one chunker flush
+    assert max(lag) <= 4 * 2 + 10
+
+
+def test_failing_stage_stops_the_pipeline(api, make_pdf, monkeypatch):
+    backend = api.app
+    monkeypatch.setattr(backend, "EMBED_BATCH_SIZE", 2)
+    embed_chunk_batch = backend.embed_chunk_batch
+    calls = []
+
+    def failing(*args):
+        calls.append(args)
+        if len(calls) == 2:
+            raise RuntimeError("embedding service unavailable")
+        return embed_chunk_batch(*args)
+
+    monkeypatch.setattr(backend, "embed_chunk_batch", failing)
+    pdf = make_pdf("pipeline-failure.pdf", [policy_page(seed) for seed in range(100, 110)])
+    with pytest.raises(RuntimeError, match="embedding service unavailable"):
+        api.run(backend.run_ingest(pdf, "pipeline-failure.pdf"))
+    # The other stages were cancelled instead of embedding the rest
+    assert len(calls) == 2
+
+    db = SessionLocal()
+    try:
+        assert not db.query(Document).filter(Document.filename == "pipeline-failure.pdf").count()
+    finally:
+        db.close()
+
+    # Nothing was left half done that stops the same PDF from being ingested again
+    monkeypatch.setattr(backend, "embed_chunk_batch", embed_chunk_batch)
+    result = api.run(backend.run_ingest(pdf, "pipeline-failure.pdf"))
+    assert result.chunks > 10 and not result.cached
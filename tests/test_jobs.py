@@ -0,0 +1,21 @@
+import asyncio
+
+
+def test_submitted_job_runs(api, make_pdf):
+    path = make_pdf("job.pdf", ["Ingest job test policy.\nPhysical therapy: $25 copay per session"])
+    with open(path, "rb") as f:
+        response = api.post("/ingest/jobs", files={"file": ("job.pdf", f.read(), "application/pdf")})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    async def wait():
+        for _ in range(200):
+            job = (await api.client.get(f"/ingest/jobs/{job_id}")).json()
+            if job["status"] in ("done", "failed"):
+                return job
+            await asyncio.sleep(0.05)
+        return job
+
+    job = api.run(wait())
+    assert job["status"] == "done", job
+    assert job["result"]["chunks"] > 0
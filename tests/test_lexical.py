@@ -0,0 +1,45 @@
+import math
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+from lexical import LexicalIndex
+
+
+def make_index(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'lexical.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    return LexicalIndex(sessionmaker(bind=engine))
+
+
+def test_scoped_search_keeps_corpus_statistics(tmp_path):
+    index = make_index(tmp_path)
+    index.add_chunks("a", ["a-0", "a-1"], ["prior authorization for imaging", "copay for office visits"])
+    index.add_chunks("b", ["b-0", "b-1", "b-2"], [
+        "prior authorization for surgery", "prior authorization for drugs", "dental cleaning"
+    ])
+
+    hits = index.search("prior authorization", k=10, document_ids=["a"])
+    assert [chunk_id for chunk_id, _, _ in hits] == ["a-0"]
+    # The idf of each term counts the chunks of both documents
+    unscoped = {chunk_id: score for chunk_id, score, _ in index.search("prior authorization", k=10)}
+    assert set(unscoped) == {"a-0", "b-0", "b-1"}
+    assert math.isclose(hits[0][1], unscoped["a-0"])
+    assert index.search("prior authorization", document_ids=["missing"]) == []
+
+
+def test_reindex_and_remove_keep_counts(tmp_path):
+    index = make_index(tmp_path)
+    index.add_chunks("a", ["a-0", "a-1"], ["prior authorization", "office copay"])
+    index.add_chunks("a", ["a-0"], ["dental cleaning"])
+    assert index.search("authorization") == []
+    assert [chunk_id for chunk_id, _, _ in index.search("dental")] == ["a-0"]
+
+    index.remove_chunks(["a-0"])
+    assert index.stats() == {"chunks": 1, "terms": 2}
+
+    reloaded = LexicalIndex(index.session_factory)
+    reloaded.load()
+    assert reloaded.stats() == index.stats()
+    assert reloaded.search("copay") == index.search("copay")
@@ -0,0 +1,32 @@
+import asyncio
+
+
+def test_prewarmed_questions_are_answered_from_the_cache(api, make_pdf, monkeypatch):
+    backend = api.app
+    questions = ["Are acupuncture sessions covered by the prewarm test plan?", "Is massage therapy covered?"]
+    monkeypatch.setattr(backend, "PREWARM_ANSWERS", True)
+    monkeypatch.setattr(backend, "PREWARM_SEED_QUESTIONS", questions)
+    monkeypatch.setattr(backend, "PREWARM_TOP_QUERIES", 0)
+    pdf = make_pdf("prewarm.pdf", [
+        f"Prewarm test plan PW-{n}.\nAcupuncture and massage therapy are covered with a referral." for n in range(3)
+    ])
+    chat = backend.openai_client
+    calls = chat.calls
+    document_id = api.ingest(pdf).json()["document_id"]
+
+    async def prewarmed():
+        await asyncio.gather(*backend.prewarm_tasks.values())
+
+    api.run(prewarmed())
+    assert chat.calls - calls == len(questions)
+
+    def ask(question):
+        return api.post("/ask", json={"question": question, "document_id": document_id}).json()
+
+    for question in questions:
+        assert ask(question)["cached"]
+    # A restart loads them back from prewarmed_answers
+    backend.answer_cache.clear()
+    backend.load_prewarmed_answers(backend.served_index())
+    assert ask(questions[0].lower())["cached"]
+    assert chat.calls - calls == len(questions)
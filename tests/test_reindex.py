@@ -0,0 +1,79 @@
+import uuid
+from datetime import datetime
+
+import pytest
+
+from conftest import FakeEmbeddings
+from database import SessionLocal, IndexBuild, IndexBuildDocument, ReindexChunk, ReindexPosting
+from indexes import BUILDING
+from reindex import IndexBuilder, document_state
+from vectorstores import LocalVectorStore
+
+
+class Interrupted(Exception):
+    pass
+
+
+def open_builder(build, path, rounds, fail_at=None):
+    """An IndexBuilder writing a document per round, recording them, and failing at round `fail_at`"""
+    builder = IndexBuilder(build, LocalVectorStore(path), FakeEmbeddings(), batch_size=100, concurrency=1)
+    builder.round_chunks = 1
+    write_round = builder._write_round
+
+    def record(round_):
+        if len(rounds) + 1 == fail_at:
+            raise Interrupted()
+        rounds.append([document.id for document, _ in round_])
+        return write_round(round_)
+
+    builder._write_round = record
+    return builder
+
+
+def test_resumed_build_skips_finished_documents(api, make_pdf, tmp_path):
+    for n in range(2):
+        api.ingest(make_pdf(f"reindex-{n}.pdf", [f"Reindex test plan RX-{n}, page {page}." for page in range(3)]))
+    now = datetime.utcnow()
+    build = IndexBuild(
+        id=str(uuid.uuid4()), status=BUILDING, embedding_model="other-model", chunk_size=500, chunk_overlap=50,
+        vector_backend="local", vector_target=str(tmp_path / "build"), created_at=now, updated_at=now
+    )
+    db = SessionLocal()
+    try:
+        db.add(build)
+        db.commit()
+        db.refresh(build)
+        db.expunge(build)
+    finally:
+        db.close()
+    path = str(tmp_path / "build")
+    try:
+        first = []
+        builder = open_builder(build, path, first, fail_at=2)
+        with pytest.raises(Interrupted):
+            builder.run()
+        builder.close()
+        assert len(first) == 1
+
+        second = []
+        builder = open_builder(build, path, second)
+        assert builder.run() == []
+        builder.close()
+        # Only the documents the interrupted run didn't finish are built again
+        built = [id_ for round_ in second for id_ in round_]
+        assert first[0] not in built and len(built) == len(set(built))
+        assert builder.build.documents_done == builder.build.documents_total == len(built) + 1
+        db = SessionLocal()
+        try:
+            assert document_state(db, build.id) == ([], [])
+        finally:
+            db.close()
+    finally:
+        db = SessionLocal()
+        try:
+            for model in (ReindexChunk, ReindexPosting, IndexBuildDocument):
+                db.query(model).filter(model.build_id == build.id).delete(synchronize_session=False)
+            db.query(IndexBuild).filter(IndexBuild.id == build.id).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
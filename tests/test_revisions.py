@@ -0,0 +1,95 @@
+import random
+
+from database import Benefit, DocumentChunk, SessionLocal
+
+
+def page(number, extra=""):
+    return f"Revision test policy RT-7, page {number}.\nCovered services are listed by section.\n{extra}"
+
+
+def stored_state(api, document_id):
+    """Vector ids in the document's namespace, its chunk rows and the pages of its benefit rows"""
+    hits = api.app.vector_store.value.search([1.0] * 32, k=1000, namespaces=[document_id])
+    db = SessionLocal()
+    try:
+        chunk_ids = {row.id for row in db.query(DocumentChunk.id).filter(DocumentChunk.document_id == document_id)}
+        benefit_pages = {row.page for row in db.query(Benefit.page).filter(Benefit.document_id == document_id)}
+    finally:
+        db.close()
+    return {hit.id for hit in hits}, chunk_ids, benefit_pages
+
+
+def test_reuploading_the_original_revises_the_document(api, make_pdf):
+    original = make_pdf("original.pdf", [page(n) for n in range(1, 7)])
+    revised = make_pdf("revised.pdf", [page(n) for n in range(1, 6)] + [
+        page(6, "Section 6 was rewritten."),
+        page(7, "Specialist visits: $45 copay"),
+        page(8),
+    ])
+
+    first = api.ingest(original).json()
+    document_id = first["document_id"]
+    assert first["version"] == 1
+
+    second = api.ingest(revised, document_id=document_id).json()
+    assert second["document_id"] == document_id and second["version"] == 2
+    assert 7 in stored_state(api, document_id)[2]
+
+    # The original again, as a new upload: its content-derived id is the revised document's
+    third = api.ingest(original)
+    assert third.status_code == 200
+    third = third.json()
+    assert third["document_id"] == document_id
+    assert third["version"] == 3
+    assert third["pages"] == 6
+
+    vector_ids, chunk_ids, benefit_pages = stored_state(api, document_id)
+    assert vector_ids == chunk_ids
+    assert len(chunk_ids) == third["chunks"]
+    assert not any(f"{document_id}-v2-" in id_ for id_ in vector_ids)
+    assert all(page_num <= 6 for page_num in benefit_pages)
+
+    # Unchanged now, so a further upload of it is served from the cache
+    again = api.ingest(original).json()
+    assert again["cached"] and again["version"] == 3
+
+
+def long_page(seed):
+    """About three chunks of text, different for every seed"""
+    rng = random.Random(seed)
+    words = ["coverage", "deductible", "copay", "network", "provider", "claim", "benefit", "member", "therapy"]
+    lines = [" ".join(rng.choice(words) for _ in range(10)) + "." for _ in range(36)]
+    return f"Section {seed} of plan RT-9.\n" + "\n".join(lines)
+
+
+def test_inserted_page_only_embeds_its_own_chunks(api, make_pdf):
+    pages = [long_page(seed) for seed in range(30)]
+    original = make_pdf("insert-original.pdf", pages)
+    revised = make_pdf("insert-revised.pdf", pages[:3] + [long_page(100)] + pages[3:])
+
+    first = api.ingest(original).json()
+    document_id = first["document_id"]
+    db = SessionLocal()
+    try:
+        rows = db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id)
+        before = {row.text: row.page for row in rows}
+    finally:
+        db.close()
+
+    second = api.ingest(revised, document_id=document_id).json()
+    assert second["version"] == 2 and second["pages_changed"] == 1
+    # The new page's chunks and the ones straddling its edges, out of about 120
+    assert first["chunks"] > 100
+    assert second["chunks_changed"] <= 6
+    assert second["chunks_removed"] <= 3
+
+    db = SessionLocal()
+    try:
+        rows = {row.id: row for row in db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id)}
+    finally:
+        db.close()
+    # Chunks behind the new page moved down a page, in document_chunks and in the vector index alike
+    moved = [row for row in rows.values() if before.get(row.text, 0) > 4]
+    assert len(moved) > 70 and all(row.page == before[row.text] + 1 for row in moved)
+    hits = api.app.vector_store.value.search([1.0] * 32, k=1000, namespaces=[document_id])
+    assert {hit.id: hit.metadata["page"] for hit in hits} == {id_: row.page for id_, row in rows.items()}
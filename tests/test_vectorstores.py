@@ -0,0 +1,137 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from vectorstores import LocalVectorStore
+
+
+def vectors(count, seed, dimensions=16):
+    return np.random.default_rng(seed).standard_normal((count, dimensions)).astype(np.float32)
+
+
+def upsert(store, ids, matrix, namespace="doc"):
+    store.upsert(ids, matrix, [f"text of {id_}" for id_ in ids], [{"document_id": namespace}] * len(ids), namespace)
+
+
+def segment_files(path):
+    """Vector files of the segments, one per segment"""
+    return sorted(
+        name for name in os.listdir(path) if name.startswith("seg-") and name.count("-") == 1 and name.endswith(".npy")
+    )
+
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_overwrite_delete_and_reload(tmp_path, dtype):
+    path = str(tmp_path / "index")
+    store = LocalVectorStore(path, dtype=dtype)
+    first = vectors(50, 1)
+    upsert(store, [f"c{i}" for i in range(50)], first)
+    replacement = vectors(10, 2)
+    upsert(store, [f"c{i}" for i in range(10)], replacement)
+    assert store.count() == 50
+
+    # The overwritten rows are only found in their new version
+    hit = store.search(replacement[3], k=1, namespaces=["doc"])[0]
+    assert hit.id == "c3" and hit.score == pytest.approx(1.0, abs=0.02)
+    assert store.search(first[3], k=1, namespaces=["doc"])[0].score < 0.9
+
+    store.delete(["c20", "c21"], namespace="doc")
+    store.delete(filter={"document_id": "doc"}, namespace="other")
+    assert store.count() == 48
+    assert "c20" not in {hit.id for hit in store.search(first[20], k=50, namespaces=["doc"])}
+
+    reloaded = LocalVectorStore(path, dtype=dtype)
+    assert reloaded.count() == 48
+    assert reloaded.search(first[30], k=1, namespaces=["doc"])[0].id == "c30"
+    reloaded.compact()
+    assert len(segment_files(path)) == 1
+    assert reloaded.count() == 48
+    assert LocalVectorStore(path, dtype=dtype).search(replacement[3], k=1, namespaces=["doc"])[0].id == "c3"
+
+
+def test_upsert_leaves_earlier_segments_alone(tmp_path):
+    path = str(tmp_path / "index")
+    store = LocalVectorStore(path)
+    upsert(store, [f"a{i}" for i in range(100)], vectors(100, 1))
+    (written,) = segment_files(path)
+    modified = os.path.getmtime(os.path.join(path, written))
+
+    # Smaller than the existing segment, so it is appended rather than merged
+    upsert(store, [f"b{i}" for i in range(10)], vectors(10, 2))
+    assert written in segment_files(path) and len(segment_files(path)) == 2
+    assert os.path.getmtime(os.path.join(path, written)) == modified
+
+
+def test_segments_stay_logarithmic(tmp_path):
+    path = str(tmp_path / "index")
+    store = LocalVectorStore(path)
+    for batch in range(64):
+        upsert(store, [f"{batch}-{i}" for i in range(10)], vectors(10, batch))
+    assert store.count() == 640
+    assert len(segment_files(path)) <= 7
+
+
+def test_mostly_deleted_segment_is_rewritten(tmp_path):
+    path = str(tmp_path / "index")
+    store = LocalVectorStore(path)
+    upsert(store, [f"c{i}" for i in range(100)], vectors(100, 1))
+    store.delete([f"c{i}" for i in range(60)], namespace="doc")
+    (segment,) = segment_files(path)
+    assert len(np.load(os.path.join(path, segment), mmap_mode="r")) == 40
+
+
+def test_ivf_partitions_follow_appends(tmp_path):
+    path = str(tmp_path / "index")
+    store = LocalVectorStore(path, ivf_lists=4, nprobe=4, ivf_min_vectors=100)
+    matrix = vectors(300, 1)
+    for start in range(0, 300, 30):
+        upsert(store, [f"c{i}" for i in range(start, start + 30)], matrix[start:start + 30])
+    assert os.path.exists(os.path.join(path, "ivf.npz"))
+    for row in (0, 150, 299):
+        assert store.search(matrix[row], k=1, namespaces=["doc"])[0].id == f"c{row}"
+
+
+def test_single_file_index_is_migrated(tmp_path):
+    path = tmp_path / "index"
+    path.mkdir()
+    matrix = vectors(5, 1)
+    np.save(path / "vectors.npy", matrix / np.linalg.norm(matrix, axis=1, keepdims=True))
+    records = [{"id": f"c{i}", "text": "t", "metadata": {}, "namespace": "doc"} for i in range(5)]
+    (path / "records.json").write_text(json.dumps(records))
+
+    store = LocalVectorStore(str(path))
+    assert store.count() == 5
+    assert store.search(matrix[2], k=1, namespaces=["doc"])[0].id == "c2"
+    assert not (path / "records.json").exists()
+    assert LocalVectorStore(str(path)).count() == 5
+
+
+@pytest.mark.parametrize("dtype,ivf_lists", [("float32", 0), ("int8", 0), ("float32", 4)])
+def test_search_many_matches_search(tmp_path, dtype, ivf_lists):
+    store = LocalVectorStore(str(tmp_path / "index"), dtype=dtype, ivf_lists=ivf_lists, ivf_min_vectors=100)
+    upsert(store, [f"a{i}" for i in range(150)], vectors(150, 1))
+    upsert(store, [f"b{i}" for i in range(60)], vectors(60, 2), namespace="other")
+    store.delete(["a7"], namespace="doc")
+    queries = vectors(5, 3)
+    for namespaces in (["doc"], ["doc", "other"]):
+        expected = [[hit.id for hit in store.search(query, k=6, namespaces=namespaces)] for query in queries]
+        found = [[hit.id for hit in hits] for hits in store.search_many(queries, k=6, namespaces=namespaces)]
+        assert found == expected
+    assert store.search_many(queries, k=3, namespaces=["missing"]) == [[]] * 5
+
+
+def test_update_metadata_keeps_vectors(tmp_path):
+    path = str(tmp_path / "index")
+    store = LocalVectorStore(path)
+    matrix = vectors(20, 1)
+    upsert(store, [f"c{i}" for i in range(10)], matrix[:10])
+    upsert(store, [f"c{i}" for i in range(10, 20)], matrix[10:])
+    store.update_metadata(["c3", "c15", "missing"], [{"page": 7}, {"page": 9}, {"page": 1}], namespace="doc")
+
+    for reloaded in (store, LocalVectorStore(path)):
+        hit = reloaded.search(matrix[15], k=1, namespaces=["doc"])[0]
+        assert hit.id == "c15" and hit.metadata == {"document_id": "doc", "page": 9}
+        assert reloaded.search(matrix[3], k=1, namespaces=["doc"])[0].metadata["page"] == 7
+        assert reloaded.count() == 20